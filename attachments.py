@@ -0,0 +1,228 @@
+"""
+Storage for post attachments.
+
+Uploads are streamed to a temporary file in chunks while they are hashed, so a
+large file is never held in worker memory, and the file is then moved to a
+path named by its SHA-256. Equal files are stored once, however many
+attachments refer to them. Downloads send the stored file, or one byte range of
+it, with the server's zero-copy ``sendfile`` extension when it offers one.
+
+Deleting an attachment only deletes its row; a ``delete_attachment_blob`` job
+removes the file later, once no attachment refers to it.
+"""
+import hashlib
+import logging
+import os
+import time
+import uuid
+from contextlib import suppress
+from pathlib import Path
+from typing import AsyncIterable, Optional
+from urllib.parse import quote
+
+import aiofiles
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from starlette import status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+import jobs
+from models import Attachment
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DIR = Path(os.getenv("ATTACHMENT_DIR", "attachments"))
+MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+# Files written or reused more recently than this are never deleted; see delete_blob.
+GRACE_SECONDS = 300
+
+
+def blob_path(sha256: str) -> Path:
+    """Return the path of the stored file with the given SHA-256 hex digest."""
+    return STORAGE_DIR / sha256[:2] / sha256
+
+
+def _place(temp: Path, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # The content is already stored; refreshing its mtime keeps a pending delete_blob from removing it.
+        os.utime(path)
+    except FileNotFoundError:
+        os.replace(temp, path)
+    else:
+        os.unlink(temp)
+
+
+async def store(chunks: AsyncIterable[bytes], max_bytes: Optional[int] = None) -> tuple[str, int]:
+    """Write an upload to storage chunk by chunk, hashing it on the way.
+
+    :param chunks: The body of the upload, e.g. ``request.stream()``.
+    :param max_bytes: The maximum size of the upload; defaults to ``MAX_BYTES``.
+
+    :raises HTTPException: If the upload is larger than ``max_bytes``.
+
+    :return: The SHA-256 hex digest and the size of the stored file.
+    """
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    temp_dir = STORAGE_DIR / "tmp"
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp = temp_dir / uuid.uuid4().hex
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(temp, "wb") as file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                        detail="Attachment is too large")
+                digest.update(chunk)
+                await file.write(chunk)
+        sha256 = digest.hexdigest()
+        await run_in_threadpool(_place, temp, blob_path(sha256))
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(temp)
+        raise
+    return sha256, size
+
+
+def schedule_delete(db: Session, sha256: str):
+    """Enqueue the removal of a stored file, as part of the caller's transaction."""
+    jobs.enqueue(db, "delete_attachment_blob", {"sha256": sha256}, delay=GRACE_SECONDS)
+
+
+@jobs.task("delete_attachment_blob")
+def delete_blob(db: Session, sha256: str) -> bool:
+    """Delete a stored file if no attachment refers to it.
+
+    The file is first moved aside, so an upload of the same content either
+    finds it gone and stores its own copy, or has refreshed its mtime before
+    the move, in which case the file is put back.
+
+    :param db: The database session.
+    :param sha256: The SHA-256 hex digest of the file.
+
+    :return: True if the file was deleted.
+    """
+    if db.query(Attachment.id).filter(Attachment.sha256 == sha256).first() is not None:
+        return False
+    path = blob_path(sha256)
+    doomed = path.with_name(f"{path.name}.{uuid.uuid4().hex}.deleting")
+    try:
+        os.replace(path, doomed)
+    except FileNotFoundError:
+        return False
+    if time.time() - doomed.stat().st_mtime < GRACE_SECONDS:
+        os.replace(doomed, path)
+        return False
+    os.unlink(doomed)
+    return True
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """Parse a ``Range`` header with a single byte range.
+
+    Headers that are malformed or ask for several ranges are ignored, as RFC 9110 allows.
+
+    :param header: The raw header value, if any.
+    :param size: The size of the file.
+
+    :raises HTTPException: If the range starts past the end of the file.
+
+    :return: The first and last byte of the range, or None to send the whole file.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, separator, last = header[len("bytes="):].strip().partition("-")
+    if not separator or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # A suffix range: the last ``last`` bytes.
+        start, end = max(size - int(last), 0), size - 1
+        if not int(last):
+            start = size
+    elif last and int(last) < int(first):
+        return None
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                            detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class BlobResponse(Response):
+    """Sends a stored file, or one byte range of it, without reading it into memory.
+
+    The file is sent with the server's ``http.response.zerocopysend`` extension
+    (``sendfile``) when it offers one, whole files with ``http.response.pathsend``,
+    and otherwise in chunks read with aiofiles.
+
+    :param attachment: The attachment to send.
+    :param range_header: The request's ``Range`` header, if any.
+    :param if_range: The request's ``If-Range`` header; the range is ignored unless it matches the ETag.
+    """
+
+    def __init__(self, attachment: Attachment, range_header: Optional[str] = None, if_range: Optional[str] = None):
+        self.path = blob_path(attachment.sha256)
+        self.media_type = attachment.content_type
+        self.background = None
+        etag = f'"{attachment.sha256}"'
+        self.byte_range = None
+        if if_range is None or if_range == etag:
+            self.byte_range = parse_range(range_header, attachment.size)
+
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "content-disposition": f"attachment; filename*=utf-8''{quote(attachment.filename)}",
+            "x-content-type-options": "nosniff",
+        }
+        if self.byte_range is None:
+            self.status_code = status.HTTP_200_OK
+            self.offset, self.count = 0, attachment.size
+        else:
+            start, end = self.byte_range
+            self.status_code = status.HTTP_206_PARTIAL_CONTENT
+            self.offset, self.count = start, end - start + 1
+            headers["content-range"] = f"bytes {start}-{end}/{attachment.size}"
+        headers["content-length"] = str(self.count)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        start = {"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers}
+        extensions = scope.get("extensions") or {}
+        if scope["method"].upper() == "HEAD":
+            await send(start)
+            await send({"type": "http.response.body", "body": b""})
+        elif "http.response.zerocopysend" in extensions:
+            file = await run_in_threadpool(open, self.path, "rb")
+            try:
+                await send(start)
+                await send({"type": "http.response.zerocopysend", "file": file,
+                            "offset": self.offset, "count": self.count})
+            finally:
+                file.close()
+        elif self.byte_range is None and "http.response.pathsend" in extensions:
+            await send(start)
+            await send({"type": "http.response.pathsend", "path": str(self.path)})
+        else:
+            async with aiofiles.open(self.path, "rb") as file:
+                await send(start)
+                await file.seek(self.offset)
+                remaining = self.count
+                while remaining:
+                    chunk = await file.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        logger.error("Attachment file %s is shorter than its recorded size", self.path)
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining or not self.count:
+                    await send({"type": "http.response.body", "body": b""})
+        if self.background is not None:
+            await self.background()
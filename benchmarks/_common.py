@@ -0,0 +1,59 @@
+"""
+Helpers shared by the benchmarks.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    """Return a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url: str, started: float, timeout: float) -> float:
+    """Poll ``url`` until it answers 200 and return the elapsed seconds since ``started``."""
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(url)
+
+
+@contextmanager
+def scratch_app():
+    """Copy the application into a temporary directory with a freshly migrated database.
+
+    Benchmarks run against the copy so they never touch a real database.
+
+    :return: A ``(workdir, env)`` pair to run subprocesses with.
+    """
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        for path in ["alembic.ini", "migrations", "routers", "benchmarks"] + [p.name for p in ROOT.glob("*.py")]:
+            source = ROOT / path
+            copy = shutil.copytree if source.is_dir() else shutil.copy
+            copy(source, workdir / path)
+        env = dict(os.environ, PYTHONPATH=str(workdir))
+        subprocess.check_call(
+            [sys.executable, "-c", "import startup, database; startup.upgrade(database.engine)"], cwd=workdir, env=env
+        )
+        yield workdir, env
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,115 @@
+"""
+Fault injection for soak tests.
+
+Serving ``benchmarks.chaos:app`` instead of ``main:app`` runs the application
+with faults injected into ``database.engine`` connections, so the failure
+modes of production incidents can be reproduced on one machine:
+
+* slow I/O: a fraction of statements is delayed before it runs. The delay
+  blocks like a slow disk would, so it stalls whatever thread runs the
+  statement, including the event loop of ``async def`` handlers;
+* lock contention: a thread in every worker periodically takes the write lock
+  with ``BEGIN IMMEDIATE`` on one of the engine's connections and holds it,
+  so writers queue on the busy timeout and eventually fail with
+  "database is locked".
+
+Faults are configured with environment variables, so every worker process,
+forked or spawned, picks them up:
+
+* ``CHAOS_LATENCY_MS`` (default 0): the delay of slow statements;
+* ``CHAOS_SLOW_FRACTION`` (default 0.1): the fraction of statements that are slow;
+* ``CHAOS_LOCK_EVERY_SECONDS`` (default 0, off): the mean interval between write locks of each worker;
+* ``CHAOS_LOCK_HOLD_MS`` (default 0): how long each write lock is held;
+* ``CHAOS_BUSY_TIMEOUT_MS`` (default unset): replaces the 5 second busy timeout of ``database.py``.
+
+Usage::
+
+    CHAOS_LATENCY_MS=50 CHAOS_LOCK_EVERY_SECONDS=2 CHAOS_LOCK_HOLD_MS=500 \\
+        python server.py --app benchmarks.chaos:app
+"""
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import database
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SECONDS = float(os.getenv("CHAOS_LATENCY_MS", "0")) / 1000
+SLOW_FRACTION = float(os.getenv("CHAOS_SLOW_FRACTION", "0.1"))
+LOCK_EVERY_SECONDS = float(os.getenv("CHAOS_LOCK_EVERY_SECONDS", "0"))
+LOCK_HOLD_SECONDS = float(os.getenv("CHAOS_LOCK_HOLD_MS", "0")) / 1000
+BUSY_TIMEOUT_MS = int(os.environ["CHAOS_BUSY_TIMEOUT_MS"]) if os.getenv("CHAOS_BUSY_TIMEOUT_MS") else None
+
+
+def hold_write_lock(engine: Engine, seconds: float):
+    """Take the database write lock on one of ``engine``'s connections and hold it for ``seconds``."""
+    with engine.connect() as connection:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            time.sleep(seconds)
+        finally:
+            connection.exec_driver_sql("COMMIT")
+
+
+def _run_locker(engine: Engine, every: float, hold: float):
+    while True:
+        # Exponential gaps, so workers do not take turns in lockstep.
+        time.sleep(random.expovariate(1 / every))
+        try:
+            hold_write_lock(engine, hold)
+        except Exception:
+            logger.exception("Chaos lock failed")
+
+
+def install(engine: Engine, latency: float = LATENCY_SECONDS, slow_fraction: float = SLOW_FRACTION,
+            lock_every: float = LOCK_EVERY_SECONDS, lock_hold: float = LOCK_HOLD_SECONDS,
+            busy_timeout_ms: Optional[int] = BUSY_TIMEOUT_MS):
+    """Inject faults into the connections of ``engine``.
+
+    :param engine: The engine, usually ``database.engine``.
+    :param latency: The number of seconds slow statements are delayed; 0 disables the delay.
+    :param slow_fraction: The fraction of statements that are slow.
+    :param lock_every: The mean number of seconds between write locks; 0 disables locking.
+    :param lock_hold: The number of seconds each write lock is held.
+    :param busy_timeout_ms: A busy timeout replacing the engine's own, or None to keep it.
+    """
+    if busy_timeout_ms is not None:
+        # Registered after database.set_sqlite_pragmas, so it runs last and wins.
+        @event.listens_for(engine, "connect")
+        def set_busy_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+            cursor.close()
+
+    if latency > 0:
+        @event.listens_for(engine, "before_cursor_execute")
+        def delay(connection, cursor, statement, parameters, context, executemany):
+            if random.random() < slow_fraction:
+                time.sleep(latency)
+
+    if lock_every > 0 and lock_hold > 0:
+        started_in = set()
+
+        # Started from the first connection of each process rather than here, so workers
+        # forked from a preloaded app get their own thread.
+        @event.listens_for(engine, "connect")
+        def start_locker(dbapi_connection, connection_record):
+            if os.getpid() not in started_in:
+                started_in.add(os.getpid())
+                threading.Thread(target=_run_locker, args=(engine, lock_every, lock_hold),
+                                 name="chaos-locker", daemon=True).start()
+
+    logger.warning("Chaos enabled: latency %.0f ms on %.0f%% of statements, %.0f ms locks every %.1f s",
+                   latency * 1000, slow_fraction * 100, lock_hold * 1000, lock_every)
+
+
+install(database.engine)
+
+from main import app  # noqa: E402
@@ -0,0 +1,330 @@
+"""
+Soak test.
+
+Runs mixed read and write traffic against ``server.py`` for a long time with
+faults injected by :mod:`benchmarks.chaos` (slow statements, write locks held
+by other connections, a shorter busy timeout) and reports, every interval,
+the throughput, the error rates, the latency percentiles and the memory of
+the server processes, so changes to the database layer can be compared under
+lock contention and slow I/O. Rate limits are off by default, as a few users
+writing as fast as they can would otherwise mostly measure the limits; pass
+``--rate-limit-scale 1`` to keep the production limits.
+
+Usage::
+
+    python -m benchmarks.soak --duration 3600 --latency-ms 20 --lock-every 5 --lock-hold-ms 500 --csv soak.csv
+"""
+import argparse
+import csv
+import http.client
+import json
+import math
+import multiprocessing
+import queue
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+from benchmarks._common import free_port, scratch_app, wait_for
+
+OUTCOMES = ("ok", "throttled", "client_errors", "server_errors", "failures")
+# Latencies are counted in buckets of this many seconds.
+RESOLUTION = 0.0001
+# Shorter runs mostly show the caches and pools filling up, not a leak.
+MIN_TREND_SECONDS = 300.0
+
+
+def seed(users: int, posts: int, valid_for: float) -> str:
+    """Insert users and their posts into the current database and return their tokens as JSON.
+
+    Runs inside the scratch application directory.
+    """
+    from datetime import timedelta
+
+    import factories
+    from database import SessionLocal
+    from routers.auth import create_access_token
+
+    db = SessionLocal()
+    user_ids = factories.users(db, users, username=lambda index: f"soak{index}",
+                               email=lambda index: f"soak{index}@example.com", hashed_password="!")
+    post_ids = factories.posts(db, posts, owner_id=lambda index: user_ids[index % users],
+                               content="lorem ipsum " * 50)
+    db.commit()
+    tokens = [create_access_token(f"soak{index}", user_id, False, timedelta(seconds=valid_for))
+              for index, user_id in enumerate(user_ids)]
+    return json.dumps({"tokens": tokens, "post_ids": [min(post_ids), max(post_ids)]})
+
+
+def next_request(post_ids: tuple[int, int], write_fraction: float) -> tuple[str, str, dict]:
+    """Pick the next request of the traffic mix as ``(method, path, body)``."""
+    post_id = random.randint(*post_ids)
+    if random.random() < write_fraction:
+        if random.random() < 0.1:
+            return "POST", "/posts/create_post", {"title": "Soak", "content": "lorem ipsum " * 20}
+        return "POST", f"/comments/create_comment?post_id={post_id}", {"content": "soak comment"}
+    return random.choice([
+        ("GET", f"/posts/{post_id}", None),
+        ("GET", "/posts/?view=summary&limit=20", None),
+        ("GET", f"/comments/?post_id={post_id}", None),
+        ("GET", f"/comments/threads?post_id={post_id}", None),
+        ("GET", "/posts/hot", None),
+    ])
+
+
+def classify(status: int) -> str:
+    """Map a response status to one of :data:`OUTCOMES`."""
+    if status < 400:
+        return "ok"
+    if status == 429:
+        return "throttled"
+    return "client_errors" if status < 500 else "server_errors"
+
+
+def client_loop(args):
+    """Send requests until the deadline and report each interval's outcomes and latencies to ``results``."""
+    port, tokens, post_ids, write_fraction, started, interval, deadline, timeout, results = args
+    connection = None
+    window, outcomes, latencies = 0, Counter(), Counter()
+    while time.time() < deadline:
+        current = int((time.time() - started) // interval)
+        if current != window:
+            results.put((window, outcomes, latencies))
+            window, outcomes, latencies = current, Counter(), Counter()
+
+        method, path, body = next_request(post_ids, write_fraction)
+        headers = {"Authorization": f"Bearer {random.choice(tokens)}"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+        sent = time.perf_counter()
+        try:
+            connection = connection or http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            outcome = classify(response.status)
+            if outcome == "server_errors":
+                # The server drops the connection after an unhandled error; do not count that twice.
+                connection.close()
+                connection = None
+        except (OSError, http.client.HTTPException):
+            if connection is not None:
+                connection.close()
+            connection = None
+            outcome = "failures"
+        outcomes[outcome] += 1
+        latencies[int((time.perf_counter() - sent) / RESOLUTION)] += 1
+    results.put((window, outcomes, latencies))
+    if connection is not None:
+        connection.close()
+
+
+def percentile(latencies: Counter, fraction: float) -> float:
+    """Return the latency in seconds below which ``fraction`` of the counted requests finished."""
+    total = sum(latencies.values())
+    if not total:
+        return 0.0
+    rank = fraction * total
+    seen = 0
+    for bucket in sorted(latencies):
+        seen += latencies[bucket]
+        if seen >= rank:
+            return (bucket + 1) * RESOLUTION
+    return (max(latencies) + 1) * RESOLUTION
+
+
+def process_tree_rss(pid: int) -> int:
+    """Return the resident memory in bytes of a process and all of its descendants; Linux only."""
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            # The process name may contain spaces and parentheses; the fields after it do not.
+            fields = (entry / "stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry.name))
+
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        pending.extend(children.get(current, ()))
+        try:
+            for line in Path(f"/proc/{current}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def server_env(args) -> dict:
+    """Return the environment variables configuring :mod:`benchmarks.chaos` and the rate limits."""
+    env = {
+        "RATE_LIMIT_SCALE": str(args.rate_limit_scale),
+        "CHAOS_LATENCY_MS": str(args.latency_ms),
+        "CHAOS_SLOW_FRACTION": str(args.slow_fraction),
+        "CHAOS_LOCK_EVERY_SECONDS": str(args.lock_every),
+        "CHAOS_LOCK_HOLD_MS": str(args.lock_hold_ms),
+    }
+    if args.busy_timeout_ms is not None:
+        env["CHAOS_BUSY_TIMEOUT_MS"] = str(args.busy_timeout_ms)
+    return env
+
+
+def report(row: dict, writer=None):
+    """Print one interval and append it to the CSV file, if any."""
+    print(f"{row['elapsed']:>8.0f} {row['rps']:>8.0f} {row['error_rate']:>7.2%} {row['throttled']:>9} "
+          f"{row['p50_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['max_ms']:>9.1f} {row['rss_mb']:>8.1f}", flush=True)
+    if writer is not None:
+        writer.writerow(row)
+
+
+def summarize(rows: list[dict], totals: Counter, latencies: Counter, duration: float):
+    """Print the totals of the run and the memory growth of the server."""
+    requests = sum(totals.values())
+    errors = totals["server_errors"] + totals["failures"]
+    print()
+    print(f"requests {requests}  ({requests / duration:.0f}/s)   " +
+          "   ".join(f"{outcome} {totals[outcome]}" for outcome in OUTCOMES))
+    print(f"error rate {errors / max(requests, 1):.2%}   p50 {percentile(latencies, 0.5) * 1000:.1f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} ms   "
+          f"worst interval p99 {max((row['p99_ms'] for row in rows), default=0):.1f} ms")
+    if not rows:
+        return
+    memory = f"server memory {rows[0]['rss_mb']:.1f} -> {rows[-1]['rss_mb']:.1f} MB"
+    if len(rows) >= 2 and duration >= MIN_TREND_SECONDS:
+        slope, _ = statistics.linear_regression([row["elapsed"] for row in rows], [row["rss_mb"] for row in rows])
+        memory += f"   trend {slope * 3600:+.1f} MB/hour"
+    print(memory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--duration", type=float, default=600.0, help="Seconds to run; hours for a soak.")
+    parser.add_argument("--interval", type=float, default=10.0, help="Seconds per reported interval.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--write-fraction", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds before a request counts as failed.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay of slow statements.")
+    parser.add_argument("--slow-fraction", type=float, default=0.1, help="Fraction of slow statements.")
+    parser.add_argument("--lock-every", type=float, default=0.0, help="Mean seconds between write locks per worker.")
+    parser.add_argument("--lock-hold-ms", type=float, default=0.0, help="How long each write lock is held.")
+    parser.add_argument("--busy-timeout-ms", type=int, default=None, help="Replaces the server's busy timeout.")
+    parser.add_argument("--rate-limit-scale", type=float, default=0.0,
+                        help="Multiplies the server's rate limits; 0, the default, disables them.")
+    parser.add_argument("--csv", type=Path, default=None, help="Also write every interval to this CSV file.")
+    parser.add_argument("--server-log", type=Path, default=None,
+                        help="Write the server's output, e.g. the 'database is locked' tracebacks, to this file.")
+    args = parser.parse_args()
+
+    with scratch_app() as (workdir, env):
+        seeded = json.loads(subprocess.check_output(
+            [sys.executable, "-c",
+             f"from benchmarks.soak import seed; print(seed({args.users}, {args.posts}, {args.duration + 3600}))"],
+            cwd=workdir, env=env, text=True,
+        ))
+        port = free_port()
+        log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+        server = subprocess.Popen(
+            [sys.executable, "server.py", "--workers", str(args.workers), "--port", str(port),
+             "--app", "benchmarks.chaos:app"],
+            cwd=workdir, env={**env, **server_env(args)}, stdout=log, stderr=subprocess.STDOUT,
+        )
+        csv_file = open(args.csv, "w", newline="") if args.csv else None
+        try:
+            wait_for(f"http://127.0.0.1:{port}/ready", time.perf_counter(), 60.0)
+            writer = None
+            if csv_file is not None:
+                writer = csv.DictWriter(csv_file, ["elapsed", "rps", "error_rate", *OUTCOMES,
+                                                   "p50_ms", "p99_ms", "max_ms", "rss_mb"], extrasaction="ignore")
+                writer.writeheader()
+            run(args, port, seeded, server.pid, writer)
+        finally:
+            server.terminate()
+            server.wait()
+            if csv_file is not None:
+                csv_file.close()
+            if args.server_log:
+                log.close()
+
+
+def drain(results, windows: dict, totals: Counter, all_latencies: Counter, first_open: int, until: float):
+    """Move client reports into ``windows`` until the time ``until``, then take what is left without waiting.
+
+    Reports for windows before ``first_open``, which were already printed, only count towards the totals.
+    """
+    while True:
+        try:
+            if time.time() < until:
+                index, outcomes, latencies = results.get(timeout=until - time.time())
+            else:
+                index, outcomes, latencies = results.get_nowait()
+        except queue.Empty:
+            return
+        totals.update(outcomes)
+        all_latencies.update(latencies)
+        if index >= first_open:
+            collected = windows.setdefault(index, (Counter(), Counter()))
+            collected[0].update(outcomes)
+            collected[1].update(latencies)
+
+
+def run(args, port: int, seeded: dict, server_pid: int, writer):
+    """Drive the clients and report every interval until the duration has passed."""
+    manager = multiprocessing.Manager()
+    results = manager.Queue()
+    started = time.time()
+    client_args = (port, seeded["tokens"], tuple(seeded["post_ids"]), args.write_fraction, started,
+                   args.interval, started + args.duration, args.timeout, results)
+    pool = multiprocessing.Pool(args.clients)
+    pending = pool.map_async(client_loop, [client_args] * args.clients)
+
+    windows: dict[int, tuple[Counter, Counter]] = {}
+    totals, all_latencies = Counter(), Counter()
+    rows = []
+    print(f"{'elapsed':>8} {'req/s':>8} {'errors':>7} {'throttled':>9} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>9} {'rss MB':>8}")
+    count = math.ceil(args.duration / args.interval)
+    for window in range(count):
+        # Clients report a window after their first request past its end, so wait a little for slow ones.
+        until = started + (window + 1) * args.interval + min(args.timeout, args.interval) / 2
+        if window == count - 1:
+            pending.wait()
+            until = 0.0
+        drain(results, windows, totals, all_latencies, window, until)
+
+        outcomes, latencies = windows.pop(window, (Counter(), Counter()))
+        length = min(args.interval, args.duration - window * args.interval)
+        requests = sum(outcomes.values())
+        row = {
+            "elapsed": window * args.interval + length,
+            "rps": requests / length,
+            "error_rate": (outcomes["server_errors"] + outcomes["failures"]) / max(requests, 1),
+            **{outcome: outcomes[outcome] for outcome in OUTCOMES},
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "max_ms": percentile(latencies, 1.0) * 1000,
+            "rss_mb": process_tree_rss(server_pid) / 2 ** 20,
+        }
+        rows.append(row)
+        report(row, writer)
+
+    pending.get()
+    pool.close()
+    pool.join()
+    manager.shutdown()
+    summarize(rows, totals, all_latencies, args.duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Startup benchmark.
+
+Measures how long a fresh worker takes to import the application, to accept
+connections (``/healthy``) and to finish warming up (``/ready``).
+
+Usage::
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from benchmarks._common import free_port, scratch_app, wait_for
+
+
+def import_time(cwd: Path, env: dict) -> float:
+    """Return the number of seconds a new interpreter needs to import ``main``."""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=cwd, env=env)
+    return float(output)
+
+
+def boot_time(cwd: Path, env: dict, timeout: float) -> tuple[float, float]:
+    """Start uvicorn and return the seconds until it is live and until it is ready."""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=cwd, env=env,
+    )
+    try:
+        live = wait_for(f"http://127.0.0.1:{port}/healthy", started, timeout)
+        ready = wait_for(f"http://127.0.0.1:{port}/ready", started, timeout)
+    finally:
+        process.terminate()
+        process.wait()
+    return live, ready
+
+
+def summarize(name: str, samples: list[float]):
+    print(f"{name:<10} median {statistics.median(samples) * 1000:8.1f} ms   "
+          f"min {min(samples) * 1000:8.1f} ms   max {max(samples) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    imports, lives, readies = [], [], []
+    with scratch_app() as (workdir, env):
+        for _ in range(args.runs):
+            imports.append(import_time(workdir, env))
+            live, ready = boot_time(workdir, env, args.timeout)
+            lives.append(live)
+            readies.append(ready)
+
+    summarize("import", imports)
+    summarize("live", lives)
+    summarize("ready", readies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Read throughput benchmark.
+
+Starts ``server.py`` with an increasing number of workers against a seeded
+scratch database and hammers the read endpoints from several client
+processes, reporting requests per second and scaling efficiency.
+
+Usage::
+
+    python -m benchmarks.throughput --workers 1 2 4 --duration 10
+"""
+import argparse
+import http.client
+import multiprocessing
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks._common import free_port, scratch_app, wait_for
+
+READ_PATHS = ["/posts/{post_id}", "/posts/?view=summary&limit=20"]
+
+
+def seed(posts: int) -> str:
+    """Insert a user and ``posts`` posts into the current database and return a token for the user.
+
+    Runs inside the scratch application directory.
+    """
+    from datetime import timedelta
+
+    import factories
+    from database import SessionLocal
+    from routers.auth import create_access_token
+
+    db = SessionLocal()
+    [user_id] = factories.users(db, 1, username="bench", email="bench@example.com", hashed_password="!")
+    factories.posts(db, posts, owner_id=user_id, content="lorem ipsum " * 200)
+    db.commit()
+    return create_access_token("bench", user_id, False, timedelta(hours=1))
+
+
+def client_loop(args) -> int:
+    """Send read requests over one keep-alive connection until the deadline; return the number of successes."""
+    port, token, posts, deadline = args
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Authorization": f"Bearer {token}"}
+    done = 0
+    while time.time() < deadline:
+        path = random.choice(READ_PATHS).format(post_id=random.randint(1, posts))
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            done += 1
+    connection.close()
+    return done
+
+
+def measure(workdir, env, workers: int, clients: int, duration: float, token: str, posts: int) -> float:
+    """Run the server with ``workers`` workers and return the sustained requests per second."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--workers", str(workers), "--port", str(port)], cwd=workdir, env=env,
+    )
+    try:
+        wait_for(f"http://127.0.0.1:{port}/healthy", time.perf_counter(), 60.0)
+        time.sleep(1.0)
+        deadline = time.time() + duration
+        with multiprocessing.Pool(clients) as pool:
+            done = sum(pool.map(client_loop, [(port, token, posts, deadline)] * clients))
+    finally:
+        process.terminate()
+        process.wait()
+    return done / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--posts", type=int, default=1000)
+    args = parser.parse_args()
+
+    with scratch_app() as (workdir, env):
+        token = subprocess.check_output(
+            [sys.executable, "-c", f"from benchmarks.throughput import seed; print(seed({args.posts}))"],
+            cwd=workdir, env=env, text=True,
+        ).strip()
+
+        baseline = None
+        print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'efficiency':>11}")
+        for workers in args.workers:
+            rate = measure(workdir, env, workers, args.clients, args.duration, token, args.posts)
+            baseline = baseline or rate / workers
+            speedup = rate / baseline
+            print(f"{workers:>8} {rate:>10.0f} {speedup:>8.2f} {speedup / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
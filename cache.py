@@ -0,0 +1,176 @@
+"""
+Per-worker read caches.
+
+Single posts and the default first pages of comments and threads are kept in
+an LRU in each worker, as the same plain data :mod:`singleflight` shares between
+concurrent requests, so repeated reads of hot posts cost no query. Entries are
+grouped by post: a write calls :func:`post_changed` or :func:`comments_changed`,
+which drops every cached entry of the post in this worker and, through
+:mod:`shared_state`, in the others. Entries also expire after a while, as a
+safety net.
+
+Each post has at most one entry per cache: pages with other parameters are
+not cached, as ``limit`` and ``replies`` are unbounded and every combination
+would be another entry, so the capacity in posts bounds the memory used.
+
+A read that started before an invalidation never stores its result, so a
+cache is not refilled with data read before the write it missed.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional
+
+import shared_state
+import singleflight
+
+CAPACITY = 10_000
+TTL_SECONDS = 300.0
+
+# The variants of GET /comments/ and GET /comments/threads without query parameters.
+COMMENT_PAGE = (10, 0)
+THREAD_PAGE = (10, 0, 3, 3)
+
+MISSING = object()
+
+caches: dict[str, "ReadCache"] = {}
+
+
+class ReadCache:
+    """An LRU of plain response data, grouped by post.
+
+    :param name: The name used by invalidation events and snapshots.
+    :param capacity: The number of posts kept.
+    :param ttl: The number of seconds an entry is kept.
+    """
+
+    def __init__(self, name: str, capacity: int = CAPACITY, ttl: float = TTL_SECONDS):
+        self.name = name
+        self.capacity = capacity
+        self.ttl = ttl
+        # Incremented by every invalidation; see :meth:`put`.
+        self.generation = 0
+        self._groups: OrderedDict[Hashable, dict[Hashable, tuple[float, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        caches[name] = self
+
+    def get(self, group: Hashable, variant: Hashable = None) -> Any:
+        """Return a cached value, or :data:`MISSING`."""
+        with self._lock:
+            entries = self._groups.get(group)
+            if entries is None:
+                return MISSING
+            entry = entries.get(variant)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires <= time.monotonic():
+                del entries[variant]
+                return MISSING
+            self._groups.move_to_end(group)
+            return value
+
+    def put(self, group: Hashable, value: Any, variant: Hashable = None, generation: Optional[int] = None,
+            ttl: Optional[float] = None):
+        """Store a value.
+
+        :param group: The post the value belongs to.
+        :param value: The plain data to cache.
+        :param variant: The page within the group, e.g. ``(limit, skip)``.
+        :param generation: The :attr:`generation` read before loading the value; if the cache has been
+            invalidated since, the value may be stale and is not stored.
+        :param ttl: The number of seconds to keep the value; defaults to the cache's ``ttl``.
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._groups.setdefault(group, {})[variant] = (expires, value)
+            self._groups.move_to_end(group)
+            while len(self._groups) > self.capacity:
+                self._groups.popitem(last=False)
+
+    def discard(self, groups: Iterable[Hashable]):
+        """Drop every entry of ``groups`` in this worker."""
+        with self._lock:
+            self.generation += 1
+            for group in groups:
+                self._groups.pop(group, None)
+
+    def clear(self):
+        """Drop every entry in this worker."""
+        with self._lock:
+            self.generation += 1
+            self._groups.clear()
+
+    def entries(self) -> list[tuple[Hashable, Hashable, Any]]:
+        """Return the live ``(group, variant, value)`` entries, least recently used first."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (group, variant, value)
+                for group, entries in self._groups.items()
+                for variant, (expires, value) in entries.items()
+                if expires > now
+            ]
+
+    async def get_or_load(self, group: Hashable, variant: Hashable, flights: singleflight.Group,
+                          func: Callable, *args) -> Any:
+        """Return a cached value, or load it with ``func(*args)`` through ``flights`` and cache it.
+
+        None results, e.g. for missing posts, are returned but not cached.
+        """
+        value = self.get(group, variant)
+        if value is not MISSING:
+            return value
+        generation = self.generation
+        value = await flights.do((group, variant), func, *args)
+        if value is not None:
+            self.put(group, value, variant, generation=generation)
+        return value
+
+    def __len__(self):
+        return len(self._groups)
+
+
+posts = ReadCache("posts")
+comment_pages = ReadCache("comments")
+thread_pages = ReadCache("threads")
+
+
+def invalidate(post_id: int, targets: Iterable[ReadCache]):
+    """Drop the entries of a post from ``targets`` in every worker."""
+    names = []
+    for target in targets:
+        target.discard((post_id,))
+        names.append(target.name)
+    shared_state.publish("cache", {"pid": os.getpid(), "caches": names, "post_id": post_id})
+
+
+def post_changed(post_id: int):
+    """Call after a post is updated or deleted; its comments are dropped too, as they depend on its visibility."""
+    invalidate(post_id, (posts, comment_pages, thread_pages))
+
+
+def comments_changed(post_id: int):
+    """Call after a comment of a post is created, updated or deleted."""
+    invalidate(post_id, (comment_pages, thread_pages))
+
+
+def clear():
+    """Drop every entry of every cache in this worker."""
+    for target in caches.values():
+        target.clear()
+
+
+def _on_message(message: dict):
+    if message.get("pid") == os.getpid():
+        return
+    for name in message.get("caches", ()):
+        target = caches.get(name)
+        if target is not None:
+            target.discard((message.get("post_id"),))
+
+
+shared_state.subscribe("cache", _on_message)
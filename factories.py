@@ -0,0 +1,115 @@
+"""
+Bulk factories for seeding test and benchmark databases.
+
+Each factory inserts rows with one multi-row ``INSERT ... RETURNING`` per
+chunk, inside the caller's transaction, and returns the new IDs. Column values
+can be overridden with constants or with callables of the row index, e.g.
+``posts(db, 10_000, owner_id=1, title=lambda index: f"Post {index}")``.
+
+Passwords are hashed once per call, so seeding many users costs one hash.
+"""
+from typing import Any, Callable, Iterable, Union
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.orm import Session
+
+import passwords
+import trending
+from models import Comment, Post, User, utcnow
+from routers.comments import SEGMENT_WIDTH
+
+CHUNK_SIZE = 5000
+
+Value = Union[Any, Callable[[int], Any]]
+
+
+def _rows(count: int, defaults: dict[str, Value], overrides: dict[str, Value]) -> Iterable[dict]:
+    columns = {**defaults, **overrides}
+    for index in range(count):
+        yield {name: value(index) if callable(value) else value for name, value in columns.items()}
+
+
+def _insert(db: Session, model, rows: Iterable[dict]) -> list[int]:
+    ids = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            ids.extend(db.scalars(insert(model).returning(model.id), chunk))
+            chunk = []
+    if chunk:
+        ids.extend(db.scalars(insert(model).returning(model.id), chunk))
+    return ids
+
+
+def users(db: Session, count: int, password: str = "password", **overrides: Value) -> list[int]:
+    """Insert ``count`` active users named ``user{index}``.
+
+    :param db: The database session.
+    :param count: The number of users.
+    :param password: The password of every user.
+    :param overrides: Column values or callables of the row index.
+
+    :return: The IDs of the new users.
+    """
+    if "hashed_password" not in overrides:
+        overrides["hashed_password"] = passwords.hash_password(password)
+    defaults = {
+        "username": lambda index: f"user{index}",
+        "email": lambda index: f"user{index}@example.com",
+        "is_active": True,
+        "is_superuser": False,
+        "created_at": utcnow(),
+    }
+    return _insert(db, User, _rows(count, defaults, overrides))
+
+
+def posts(db: Session, count: int, owner_id: Value, **overrides: Value) -> list[int]:
+    """Insert ``count`` published posts.
+
+    :param db: The database session.
+    :param count: The number of posts.
+    :param owner_id: The owner, or a callable of the row index.
+    :param overrides: Column values or callables of the row index.
+
+    :return: The IDs of the new posts.
+    """
+    defaults = {
+        "title": lambda index: f"Post {index}",
+        "content": "Content",
+        "published": True,
+        "owner_id": owner_id,
+        "created_at": utcnow(),
+        "hot_score": trending.event_score("post"),
+    }
+    return _insert(db, Post, _rows(count, defaults, overrides))
+
+
+def comments(db: Session, post_ids: list[int], per_post: int, author_id: Value, **overrides: Value) -> list[int]:
+    """Insert ``per_post`` top-level comments on each post.
+
+    IDs come from the table, as in the unsharded layout; sharded comment IDs are assigned by
+    :meth:`sharding.ShardSessions.next_id`.
+
+    :param db: The database session holding the comments.
+    :param post_ids: The posts to comment on.
+    :param per_post: The number of comments per post.
+    :param author_id: The author, or a callable of the row index.
+    :param overrides: Column values or callables of the row index.
+
+    :return: The IDs of the new comments.
+    """
+    defaults = {
+        "content": lambda index: f"Comment {index}",
+        "post_id": lambda index: post_ids[index // per_post],
+        "author_id": author_id,
+        "depth": 0,
+        "created_at": utcnow(),
+    }
+    ids = _insert(db, Comment, _rows(len(post_ids) * per_post, defaults, overrides))
+    for start in range(0, len(ids), CHUNK_SIZE):
+        chunk = ids[start:start + CHUNK_SIZE]
+        db.execute(
+            update(Comment).where(Comment.id.in_(chunk)).values(path=func.printf(f"%0{SEGMENT_WIDTH}d", Comment.id))
+        )
+    return ids
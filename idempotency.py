@@ -0,0 +1,247 @@
+"""
+Idempotency keys for create endpoints.
+
+A client that retries a create request after a timeout sends the same
+``Idempotency-Key`` header each time. The first request claims the key in
+the ``idempotency_keys`` table and stores its response when it succeeds. For
+:data:`WINDOW`, retries with the same key get the stored response back
+without running the endpoint again. A duplicate that arrives while the first
+request is still running waits for its result.
+
+Keys are scoped per user and endpoint. Reusing a key with a different
+request body is rejected with ``422``. A failed request releases its key so
+the client can retry. A request that dies without releasing its key holds it
+for at most :data:`LEASE_SECONDS`; a request that runs longer than that may
+lose its key to a retry, and then fails with ``409`` instead of creating a
+duplicate.
+"""
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
+from typing import Annotated, Callable, Optional
+
+from fastapi import Depends, Header, HTTPException, Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy import delete, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from starlette import status
+from starlette.concurrency import run_in_threadpool
+
+from models import IdempotencyKey, utcnow
+
+WINDOW = timedelta(hours=24)
+LEASE_SECONDS = 30.0
+WAIT_SECONDS = 10.0
+POLL_INTERVAL_SECONDS = 0.05
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+_events: dict[tuple, asyncio.Event] = {}
+
+
+def fingerprint(request: Request, body: bytes) -> str:
+    """Return a digest of the request line and body, to detect a key reused for another request."""
+    digest = hashlib.sha256(f"{request.method} {request.url.path}?{request.url.query}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Replay(Exception):
+    """Raised by the dependency to answer a retry with the stored response; see :func:`replay_handler`."""
+
+    def __init__(self, response: Response):
+        self.response = response
+
+
+async def replay_handler(request: Request, exc: Replay) -> Response:
+    """Exception handler that sends the stored response of a replayed request."""
+    return exc.response
+
+
+class IdempotentRequest:
+    """A key claimed by the current request.
+
+    :param ident: The ``(user_id, scope, key)`` primary key.
+    :param locked_until: The lease of this claim.
+    """
+
+    def __init__(self, ident: tuple, locked_until: datetime):
+        self.ident = ident
+        self.locked_until = locked_until
+        self.completed = False
+
+    def _where(self):
+        user_id, scope, key = self.ident
+        return (IdempotencyKey.user_id == user_id, IdempotencyKey.scope == scope, IdempotencyKey.key == key,
+                IdempotencyKey.status_code.is_(None), IdempotencyKey.locked_until == self.locked_until)
+
+    def complete(self, db: Session, body: BaseModel, status_code: int = status.HTTP_201_CREATED):
+        """Store the response as part of the caller's transaction.
+
+        Call it before committing the created rows so both become visible together.
+
+        :param db: The session whose transaction creates the rows.
+        :param body: The response model.
+        :param status_code: The response status code.
+
+        :raises HTTPException: If the lease expired and a retry took the key over; the caller must not commit.
+        """
+        stored = db.execute(
+            update(IdempotencyKey).where(*self._where()).values(
+                status_code=status_code, body=body.model_dump_json(), locked_until=None
+            )
+        ).rowcount
+        if not stored:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="The Idempotency-Key was taken over by a retry of this request")
+        self.completed = True
+
+    def release(self, db: Session):
+        """Give the key up after a failed request, so a retry runs the endpoint again."""
+        db.rollback()
+        db.execute(delete(IdempotencyKey).where(*self._where()))
+        db.commit()
+
+
+def _stored_response(row: IdempotencyKey) -> Response:
+    return Response(content=row.body, status_code=row.status_code, media_type="application/json",
+                    headers={REPLAYED_HEADER: "true"})
+
+
+def _claim(db: Session, ident: tuple, digest: str) -> Optional[IdempotentRequest]:
+    """Claim a key or take over an expired claim.
+
+    :raises Replay: If a request with the key already succeeded.
+    :raises HTTPException: If the key was used for another request.
+
+    :return: The claim, or None if another request holds the key.
+    """
+    user_id, scope, key = ident
+    now = utcnow()
+    locked_until = now + timedelta(seconds=LEASE_SECONDS)
+    claimed = db.execute(
+        insert(IdempotencyKey).values(
+            user_id=user_id, scope=scope, key=key, fingerprint=digest, locked_until=locked_until, created_at=now
+        ).on_conflict_do_nothing()
+    ).rowcount
+    if not claimed:
+        # Expired responses and abandoned claims are taken over in place.
+        claimed = db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.scope == scope, IdempotencyKey.key == key,
+                   or_(IdempotencyKey.created_at < now - WINDOW, IdempotencyKey.locked_until < now))
+            .values(fingerprint=digest, status_code=None, body=None, locked_until=locked_until, created_at=now)
+        ).rowcount
+    db.commit()
+    if claimed:
+        return IdempotentRequest(ident, locked_until)
+
+    row = db.scalars(
+        select(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+    ).first()
+    db.rollback()
+    if row is None:
+        return _claim(db, ident, digest)
+    if row.fingerprint != digest:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail="Idempotency-Key was already used for a different request")
+    if row.status_code is not None:
+        raise Replay(_stored_response(row))
+    return None
+
+
+async def claim(db: Session, user_id: int, scope: str, key: str, digest: str) -> IdempotentRequest:
+    """Claim a key for this request, waiting while another request holds it.
+
+    :param db: The database session.
+    :param user_id: The ID of the current user.
+    :param scope: The endpoint name.
+    :param key: The client's ``Idempotency-Key``.
+    :param digest: The request :func:`fingerprint`.
+
+    :raises Replay: If a request with the key already succeeded.
+    :raises HTTPException: If the key was used for another request, or is still held after :data:`WAIT_SECONDS`.
+
+    :return: The claim.
+    """
+    ident = (user_id, scope, key)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WAIT_SECONDS
+    while True:
+        # In the threadpool, as the write may wait up to the busy timeout for the database lock.
+        result = await run_in_threadpool(_claim, db, ident, digest)
+        if result is not None:
+            _events[ident] = asyncio.Event()
+            return result
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                                detail="A request with this Idempotency-Key is still in progress",
+                                headers={"Retry-After": "1"})
+        # A duplicate in this worker is woken as soon as the first request finishes; others poll.
+        event = _events.get(ident)
+        try:
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout=min(remaining, LEASE_SECONDS))
+            else:
+                await asyncio.sleep(min(remaining, POLL_INTERVAL_SECONDS))
+        except asyncio.TimeoutError:
+            pass
+
+
+def _finish(result: IdempotentRequest):
+    event = _events.pop(result.ident, None)
+    if event is not None:
+        event.set()
+
+
+def guard(scope: str, get_db: Callable, get_current_user: Callable):
+    """Build a dependency that handles the ``Idempotency-Key`` header of an endpoint.
+
+    The dependency yields None when the header is absent. A retry of a request
+    that succeeded raises :class:`Replay` before the endpoint's other dependencies
+    run, so list it before them. Otherwise it yields the :class:`IdempotentRequest`,
+    and the endpoint calls :meth:`IdempotentRequest.complete` before committing.
+    The key is released if the endpoint raises or returns without completing it.
+
+    :param scope: The endpoint name keys are scoped to.
+    :param get_db: The router's database dependency; the endpoint gets the same session.
+    :param get_current_user: The authentication dependency.
+    """
+    async def dependency(request: Request, db: Annotated[Session, Depends(get_db)],
+                         user: Annotated[dict, Depends(get_current_user)],
+                         idempotency_key: Annotated[Optional[str], Header(max_length=MAX_KEY_LENGTH)] = None):
+        if idempotency_key is None or user is None:
+            yield None
+            return
+
+        result = await claim(db, user.get("id"), scope, idempotency_key, fingerprint(request, await request.body()))
+        try:
+            yield result
+        except Exception:
+            result.release(db)
+            raise
+        else:
+            if not result.completed:
+                result.release(db)
+        finally:
+            _finish(result)
+
+    return dependency
+
+
+def prune(db: Session) -> int:
+    """Delete the keys whose window has passed.
+
+    :return: The number of deleted keys.
+    """
+    now = utcnow()
+    result = db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.created_at < now - WINDOW,
+                                     or_(IdempotencyKey.locked_until.is_(None), IdempotencyKey.locked_until < now))
+    )
+    db.commit()
+    return result.rowcount
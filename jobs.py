@@ -0,0 +1,262 @@
+"""
+Background jobs.
+
+A small persistent job queue stored in the ``jobs`` table. Handlers enqueue
+work inside their own transaction and return immediately; a pool of workers
+started from the application lifespan claims due jobs, runs them in the
+threadpool and retries failures with exponential backoff.
+
+The queue is for work that must survive a restart: purging deleted posts,
+deleting unreferenced attachment blobs and rebuilding rollups. Work that only
+needs to leave the request path has cheaper homes: view counters are batched
+in memory by :mod:`trending`, activity counts are kept by :mod:`rollups`, and
+cache invalidation is fanned out through the :mod:`shared_state` event log.
+Password rehashing stays in the login request, as a job would have to store
+the plain text password in the ``jobs`` table.
+"""
+import asyncio
+import json
+import logging
+import random
+from datetime import timedelta
+from typing import Callable, Optional
+
+from sqlalchemy import delete, event, or_, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from database import SessionLocal
+from models import Job, utcnow
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 3600.0
+RETENTION = timedelta(days=7)
+PRUNE_INTERVAL_SECONDS = 3600.0
+
+_tasks: dict[str, Callable] = {}
+_wakeup: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def task(name: str):
+    """Register a function as the handler of a job name.
+
+    The handler is called as ``handler(db, **payload)`` with a fresh session.
+
+    :param name: The job name used with :func:`enqueue`.
+    """
+    def decorator(func: Callable):
+        _tasks[name] = func
+        return func
+    return decorator
+
+
+def enqueue(db: Session, name: str, payload: Optional[dict] = None, key: Optional[str] = None,
+            delay: float = 0.0, max_attempts: int = 5):
+    """Add a job to the queue as part of the caller's transaction.
+
+    The job becomes visible to workers when the caller commits, and idle workers
+    are woken up then. A job whose ``key`` is already queued or done is silently
+    ignored.
+
+    :param db: The database session.
+    :param name: The registered job name.
+    :param payload: JSON-serialisable keyword arguments for the handler.
+    :param key: An optional idempotency key.
+    :param delay: The number of seconds to wait before the job may run.
+    :param max_attempts: The number of attempts before the job is marked as failed.
+    """
+    db.execute(
+        insert(Job).values(
+            name=name,
+            payload=json.dumps(payload or {}),
+            idempotency_key=key,
+            status=QUEUED,
+            attempts=0,
+            max_attempts=max_attempts,
+            run_at=utcnow() + timedelta(seconds=delay),
+            created_at=utcnow(),
+        ).on_conflict_do_nothing(index_elements=["idempotency_key"])
+    )
+    # Woken now, workers would look before the job is committed and go back to sleep.
+    db.info["jobs_enqueued"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session: Session):
+    if session.info.pop("jobs_enqueued", False):
+        notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session: Session):
+    session.info.pop("jobs_enqueued", None)
+
+
+def notify():
+    """Wake up idle workers in this process, if any are running."""
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def claim(db: Session) -> Optional[Job]:
+    """Atomically claim the next due job.
+
+    Jobs left running past their lease (e.g. by a crashed worker) are claimed again.
+
+    :param db: The database session.
+
+    :return: The claimed job, or None if nothing is due.
+    """
+    now = utcnow()
+    next_id = (
+        select(Job.id)
+        .where(or_(Job.status == QUEUED, Job.status == RUNNING), Job.run_at <= now)
+        .where(or_(Job.locked_until.is_(None), Job.locked_until < now))
+        .order_by(Job.run_at)
+        .limit(1)
+        .scalar_subquery()
+    )
+    job_id = db.scalar(
+        update(Job)
+        .where(Job.id == next_id)
+        .values(status=RUNNING, attempts=Job.attempts + 1, locked_until=now + timedelta(seconds=LEASE_SECONDS))
+        .returning(Job.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return db.get(Job, job_id) if job_id is not None else None
+
+
+def backoff(attempts: int) -> float:
+    """Return the retry delay after ``attempts`` failed attempts, with jitter."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def run_job(db: Session, job: Job):
+    """Run a claimed job and record its outcome.
+
+    :param db: The database session.
+    :param job: A job returned by :func:`claim`.
+    """
+    handler = _tasks.get(job.name)
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job {job.name!r}")
+        handler(db, **json.loads(job.payload))
+    except Exception as exc:
+        db.rollback()
+        logger.warning("Job %s (%s) failed on attempt %d: %s", job.id, job.name, job.attempts, exc)
+        job.last_error = repr(exc)
+        job.locked_until = None
+        if job.attempts >= job.max_attempts:
+            job.status = FAILED
+        else:
+            job.status = QUEUED
+            job.run_at = utcnow() + timedelta(seconds=backoff(job.attempts))
+    else:
+        job.status = DONE
+        job.locked_until = None
+        job.last_error = None
+    db.commit()
+
+
+def run_pending(session_factory=SessionLocal, limit: Optional[int] = None) -> int:
+    """Synchronously run due jobs until the queue is drained.
+
+    :param session_factory: The session factory to use.
+    :param limit: An optional maximum number of jobs to run.
+
+    :return: The number of jobs run.
+    """
+    count = 0
+    db = session_factory()
+    try:
+        while limit is None or count < limit:
+            job = claim(db)
+            if job is None:
+                break
+            run_job(db, job)
+            count += 1
+    finally:
+        db.close()
+    return count
+
+
+def prune(db: Session, retention: timedelta = RETENTION) -> int:
+    """Delete finished jobs older than ``retention``.
+
+    Done jobs are kept for a while so their idempotency keys keep deduplicating retries.
+
+    :return: The number of deleted jobs.
+    """
+    result = db.execute(delete(Job).where(Job.status.in_((DONE, FAILED)), Job.run_at < utcnow() - retention))
+    db.commit()
+    return result.rowcount
+
+
+async def _worker(session_factory, poll_interval: float):
+    while True:
+        try:
+            ran = await run_in_threadpool(run_pending, session_factory, 1)
+        except Exception:
+            logger.exception("Job worker iteration failed")
+            ran = 0
+        if ran:
+            continue
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+def _prune_once(session_factory) -> int:
+    db = session_factory()
+    try:
+        return prune(db)
+    finally:
+        db.close()
+
+
+async def _pruner(session_factory, interval: float):
+    while True:
+        try:
+            pruned = await run_in_threadpool(_prune_once, session_factory)
+            if pruned:
+                logger.info("Pruned %d finished jobs", pruned)
+        except Exception:
+            logger.exception("Job pruning failed")
+        await asyncio.sleep(interval)
+
+
+async def run_workers(concurrency: int = 2, poll_interval: float = 1.0, session_factory=SessionLocal,
+                      prune_interval: float = PRUNE_INTERVAL_SECONDS):
+    """Run a pool of job workers, and prune finished jobs periodically, until cancelled.
+
+    :param concurrency: The number of jobs processed in parallel.
+    :param poll_interval: The maximum number of seconds an idle worker waits before polling again.
+    :param session_factory: The session factory to use.
+    :param prune_interval: The number of seconds between prunes of finished jobs.
+    """
+    global _wakeup, _loop
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    workers = [asyncio.create_task(_worker(session_factory, poll_interval)) for _ in range(concurrency)]
+    workers.append(asyncio.create_task(_pruner(session_factory, prune_interval)))
+    try:
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        _loop = _wakeup = None
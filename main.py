@@ -1,12 +1,45 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from starlette import status
 
+import idempotency
+import jobs
+import reaper
+import rollups
+import shared_state
+import snapshot
+import startup
+import trending
+from compression import CompressionMiddleware
 from database import engine
-from models import Base
-from routers import auth, users, posts, comments, admin
+from routers import auth, users, posts, comments, attachments, admin
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Check the schema, warm up in the background and run background tasks for the lifetime of the app."""
+    startup.check_schema(engine)
+    tasks = [
+        asyncio.create_task(startup.warm_up(app, engine)),
+        asyncio.create_task(jobs.run_workers()),
+        asyncio.create_task(reaper.run_reaper()),
+        asyncio.create_task(rollups.run_rollups()),
+        asyncio.create_task(shared_state.run_listener()),
+        asyncio.create_task(snapshot.run_writer()),
+        asyncio.create_task(trending.run_flusher()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
 
-app = FastAPI()
 
-Base.metadata.create_all(bind=engine)
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+app.add_exception_handler(idempotency.Replay, idempotency.replay_handler)
+app.state.ready = False
 
 
 @app.get("/healthy")
@@ -14,8 +47,16 @@ def health_check():
     return {'status': 'Healthy'}
 
 
+@app.get("/ready")
+def readiness_check():
+    if not app.state.ready:
+        return JSONResponse({'status': 'Starting'}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {'status': 'Ready'}
+
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(posts.router)
 app.include_router(comments.router)
+app.include_router(attachments.router)
 app.include_router(admin.router)
@@ -0,0 +1,68 @@
+"""soft delete and jobs
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 22:58:41.102315
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# SQLite foreign keys are unnamed; this names them so batch mode can replace them.
+naming_convention = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_posts_deleted_at'), ['deleted_at'], unique=False)
+
+    with op.batch_alter_table('comments', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_comments_deleted_at'), ['deleted_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_comments_post_id'), ['post_id'], unique=False)
+        batch_op.drop_constraint('fk_comments_post_id_posts', type_='foreignkey')
+        batch_op.create_foreign_key('fk_comments_post_id_posts', 'posts', ['post_id'], ['id'], ondelete='CASCADE')
+
+    op.create_table('jobs',
+    sa.Column('name', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('idempotency_key', sa.String(length=200), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_until', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('idempotency_key')
+    )
+    with op.batch_alter_table('jobs', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_jobs_id'), ['id'], unique=False)
+        batch_op.create_index('ix_jobs_status_run_at', ['status', 'run_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('jobs')
+
+    with op.batch_alter_table('comments', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_constraint('fk_comments_post_id_posts', type_='foreignkey')
+        batch_op.create_foreign_key('fk_comments_post_id_posts', 'posts', ['post_id'], ['id'])
+        batch_op.drop_index(batch_op.f('ix_comments_post_id'))
+        batch_op.drop_index(batch_op.f('ix_comments_deleted_at'))
+        batch_op.drop_column('deleted_at')
+
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_posts_deleted_at'))
+        batch_op.drop_column('deleted_at')
@@ -0,0 +1,44 @@
+"""threaded comments
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 09:12:03.517820
+
+Existing comments become roots of their own thread.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+naming_convention = {"fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s"}
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('comments', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('path', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('depth', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_foreign_key('fk_comments_parent_id_comments', 'comments', ['parent_id'], ['id'])
+
+    op.execute("UPDATE comments SET path = printf('%010d', id)")
+
+    with op.batch_alter_table('comments', schema=None) as batch_op:
+        batch_op.alter_column('depth', server_default=None)
+        batch_op.create_index(batch_op.f('ix_comments_path'), ['path'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('comments', schema=None, naming_convention=naming_convention) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comments_path'))
+        batch_op.drop_constraint('fk_comments_parent_id_comments', type_='foreignkey')
+        batch_op.drop_column('depth')
+        batch_op.drop_column('path')
+        batch_op.drop_column('parent_id')
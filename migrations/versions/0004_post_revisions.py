@@ -0,0 +1,38 @@
+"""post revisions
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 11:40:27.904113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('post_revisions',
+    sa.Column('post_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('is_snapshot', sa.Boolean(), nullable=False),
+    sa.Column('data', sa.LargeBinary(), nullable=False),
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['posts.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('post_id', 'version', name='uq_post_revisions_post_id_version')
+    )
+    with op.batch_alter_table('post_revisions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_post_revisions_id'), ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('post_revisions')
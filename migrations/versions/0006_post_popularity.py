@@ -0,0 +1,44 @@
+"""post popularity
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 16:20:11.418305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Mirrors trending.EPOCH, trending.TAU and the "post" weight at the time of this migration.
+EPOCH = '2024-01-01 00:00:00'
+TAU_SECONDS = 12 * 3600 / 0.6931471805599453
+POST_WEIGHT_LOG = 2.302585092994046
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('view_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('hot_score', sa.Float(), server_default='0', nullable=False))
+        batch_op.create_index(batch_op.f('ix_posts_hot_score'), ['hot_score'], unique=False)
+
+    # Existing posts start with the score they got when they were created.
+    op.execute(
+        f"UPDATE posts SET hot_score = {POST_WEIGHT_LOG} + "
+        f"(julianday(created_at) - julianday('{EPOCH}')) * 86400 / {TAU_SECONDS} "
+        "WHERE created_at IS NOT NULL"
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('posts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_posts_hot_score'))
+        batch_op.drop_column('hot_score')
+        batch_op.drop_column('view_count')
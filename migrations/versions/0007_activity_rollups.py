@@ -0,0 +1,53 @@
+"""activity rollups
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 17:02:45.118420
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Rebuild the counted tables with AUTOINCREMENT so that IDs are never reused.
+    for table in ('users', 'posts', 'comments'):
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': True}):
+            pass
+    op.create_table('activity_rollups',
+    sa.Column('period', sa.String(length=4), nullable=False),
+    sa.Column('bucket', sa.DateTime(), nullable=False),
+    sa.Column('metric', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('period', 'bucket', 'metric')
+    )
+    op.create_table('author_rollups',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('author_id', sa.Integer(), nullable=False),
+    sa.Column('posts', sa.Integer(), nullable=False),
+    sa.Column('comments', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'author_id')
+    )
+    op.create_table('rollup_watermarks',
+    sa.Column('source', sa.String(length=50), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('source')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rollup_watermarks')
+    op.drop_table('author_rollups')
+    op.drop_table('activity_rollups')
+    for table in ('users', 'posts', 'comments'):
+        with op.batch_alter_table(table, recreate='always', table_kwargs={'sqlite_autoincrement': False}):
+            pass
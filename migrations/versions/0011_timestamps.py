@@ -0,0 +1,88 @@
+"""timestamps
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 18:05:42.730164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011'
+down_revision: Union[str, None] = '0010'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+ENTITY_TABLES = ('users', 'posts', 'post_revisions', 'comments', 'jobs', 'attachments')
+# Rebuilt tables must keep the AUTOINCREMENT added in 0007, so IDs are never reused.
+AUTOINCREMENT_TABLES = ('users', 'posts', 'comments')
+BATCH_SIZE = 1000
+
+
+def backfill(table):
+    """Make ``created_at`` non-decreasing in ID order and start ``updated_at`` from it.
+
+    Rows that used the old default got the start time of the process that created
+    them, which is never later than their real creation time. Raising each row to
+    the latest time of the rows created before it (IDs are never reused) keeps the
+    correct timestamps and gives the others the closest lower bound, so listing by
+    time matches the order the rows were created in.
+    """
+    connection = op.get_bind()
+    latest = None
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.text(f"SELECT id, created_at FROM {table} WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).all()
+        if not rows:
+            break
+        changes = []
+        for row_id, created_at in rows:
+            if created_at is not None and (latest is None or created_at > latest):
+                latest = created_at
+            changes.append({"id": row_id, "created_at": latest})
+        connection.execute(
+            sa.text(f"UPDATE {table} SET created_at = COALESCE(:created_at, created_at, CURRENT_TIMESTAMP), "
+                    "updated_at = COALESCE(:created_at, created_at, CURRENT_TIMESTAMP) WHERE id = :id"),
+            changes,
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    # Recreated, as SQLite cannot add a column with a non-constant default.
+    for table in ENTITY_TABLES:
+        with op.batch_alter_table(table, schema=None, recreate='always',
+                                  table_kwargs={'sqlite_autoincrement': table in AUTOINCREMENT_TABLES}) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(),
+                                  server_default=sa.text('(CURRENT_TIMESTAMP)'))
+            if table == 'comments':
+                batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False))
+                batch_op.create_index('ix_comments_post_id_created_at', ['post_id', 'created_at'], unique=False)
+            elif table == 'posts':
+                batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False))
+                batch_op.create_index('ix_posts_owner_id_created_at', ['owner_id', 'created_at'], unique=False)
+
+    backfill('posts')
+    backfill('comments')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('posts', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_index('ix_posts_owner_id_created_at')
+        batch_op.drop_column('updated_at')
+
+    with op.batch_alter_table('comments', schema=None, table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+        batch_op.drop_index('ix_comments_post_id_created_at')
+        batch_op.drop_column('updated_at')
+
+    for table in ENTITY_TABLES:
+        with op.batch_alter_table(table, schema=None,
+                                  table_kwargs={'sqlite_autoincrement': table in AUTOINCREMENT_TABLES}) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), server_default=None)
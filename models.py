@@ -1,47 +1,195 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Boolean
+from sqlalchemy import (Column, Integer, String, Text, ForeignKey, Date, DateTime, Boolean, Float, Index, LargeBinary,
+                        Table, UniqueConstraint, func)
 from sqlalchemy.orm import relationship
 
 from database import Base
 
 
+def utcnow() -> datetime:
+    """Return the current time as a naive UTC datetime, the way timestamps are stored."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def as_utc(value: datetime) -> datetime:
+    """Convert a datetime to naive UTC for comparing with stored timestamps; naive values are taken as UTC."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 class EntityBase:
     id = Column(Integer, primary_key=True, index=True)
-    created_at = Column(DateTime, default=datetime.now(timezone.utc))
+    # Filled per row; the server default covers rows inserted outside SQLAlchemy.
+    created_at = Column(DateTime, default=utcnow, server_default=func.current_timestamp())
+
+
+class SoftDeleteMixin:
+    deleted_at = Column(DateTime, nullable=True, index=True)
+
+
+def _inserted_at(context) -> datetime:
+    # A new row was last updated when it was created.
+    return context.get_current_parameters().get("created_at") or utcnow()
+
+
+class UpdatedAtMixin:
+    # Set by every UPDATE issued through SQLAlchemy unless the statement sets it itself; see trending.flush.
+    updated_at = Column(DateTime, nullable=False, default=_inserted_at, onupdate=utcnow,
+                        server_default=func.current_timestamp())
 
 
 class User(Base, EntityBase):
     __tablename__ = "users"
+    # IDs are never reused, so rollups.py can count new rows from a watermark.
+    __table_args__ = {"sqlite_autoincrement": True}
 
     username = Column(String(50), unique=True, index=True, nullable=False)
     email = Column(String, unique=True, index=True, nullable=False)
     hashed_password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
+    # Tokens issued before this time are rejected; see user_status.py.
+    tokens_valid_after = Column(DateTime, nullable=True)
 
     posts = relationship("Post", back_populates="owner")
     comments = relationship("Comment", back_populates="author")
 
 
-class Post(Base, EntityBase):
+post_tags = Table(
+    "post_tags",
+    Base.metadata,
+    Column("post_id", Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
+)
+
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), unique=True, nullable=False)
+
+
+class Post(Base, EntityBase, SoftDeleteMixin, UpdatedAtMixin):
     __tablename__ = "posts"
+    __table_args__ = (
+        # Time-ordered listing and "since" ranges of a user's posts; see routers.posts.get_posts.
+        Index("ix_posts_owner_id_created_at", "owner_id", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
 
     title = Column(String(50), index=True, nullable=False)
     content = Column(Text, nullable=False)
     published = Column(Boolean, default=True)
     owner_id = Column(Integer, ForeignKey("users.id"))
+    view_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Log of the forward-decayed popularity; see trending.py.
+    hot_score = Column(Float, nullable=False, default=0.0, server_default="0", index=True)
 
     owner = relationship("User", back_populates="posts")
-    comments = relationship("Comment", back_populates="post")
+    comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan", passive_deletes=True)
+    tags = relationship("Tag", secondary=post_tags, order_by=Tag.name, passive_deletes=True)
+
+
+class PostRevision(Base, EntityBase):
+    __tablename__ = "post_revisions"
+
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    is_snapshot = Column(Boolean, nullable=False, default=False)
+    data = Column(LargeBinary, nullable=False)
+
+    __table_args__ = (UniqueConstraint("post_id", "version", name="uq_post_revisions_post_id_version"),)
 
 
-class Comment(Base, EntityBase):
+class Comment(Base, EntityBase, SoftDeleteMixin, UpdatedAtMixin):
     __tablename__ = 'comments'
+    __table_args__ = (
+        Index("ix_comments_post_id_created_at", "post_id", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
 
     content = Column(Text, nullable=False)
-    post_id = Column(Integer, ForeignKey('posts.id'))
+    post_id = Column(Integer, ForeignKey('posts.id', ondelete="CASCADE"), index=True)
     author_id = Column(Integer, ForeignKey('users.id'))
+    parent_id = Column(Integer, ForeignKey('comments.id'), nullable=True)
+    # Zero-padded ids of the root, every ancestor and the comment itself; see routers.comments.path_segment.
+    path = Column(String(255), nullable=True, index=True)
+    depth = Column(Integer, nullable=False, default=0)
 
     post = relationship("Post", back_populates="comments")
     author = relationship("User", back_populates="comments")
+
+
+class Job(Base, EntityBase):
+    __tablename__ = "jobs"
+
+    name = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False, default="{}")
+    idempotency_key = Column(String(200), unique=True, nullable=True)
+    status = Column(String(20), nullable=False, default="queued")
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+    __table_args__ = (Index("ix_jobs_status_run_at", "status", "run_at"),)
+
+
+class ActivityRollup(Base):
+    """Number of new users, posts or comments per hour or day; see rollups.py."""
+    __tablename__ = "activity_rollups"
+
+    period = Column(String(4), primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    metric = Column(String(20), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class AuthorRollup(Base):
+    """Number of posts and comments written by each author per day."""
+    __tablename__ = "author_rollups"
+
+    day = Column(Date, primary_key=True)
+    author_id = Column(Integer, primary_key=True)
+    posts = Column(Integer, nullable=False, default=0)
+    comments = Column(Integer, nullable=False, default=0)
+
+
+class RollupWatermark(Base):
+    """The highest row ID of each source table already counted in the rollups."""
+    __tablename__ = "rollup_watermarks"
+
+    source = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyKey(Base):
+    """A client's ``Idempotency-Key`` and the stored response of its request; see idempotency.py."""
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(Integer, primary_key=True)
+    scope = Column(String(50), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)
+    # Both are NULL while the first request is in flight.
+    status_code = Column(Integer, nullable=True)
+    body = Column(Text, nullable=True)
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+
+class Attachment(Base, EntityBase):
+    """A file attached to a post; the content is stored once per SHA-256, see attachments.py."""
+    __tablename__ = "attachments"
+
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, index=True)
+    uploader_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(100), nullable=False)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False, index=True)
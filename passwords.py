@@ -0,0 +1,219 @@
+"""
+Password hashing policy.
+
+All password hashing and verification goes through :data:`policy`, configured
+per deployment:
+
+``PASSWORD_SCHEME``
+    ``bcrypt`` (default) or ``argon2`` (requires the optional ``argon2-cffi`` package).
+``PASSWORD_BCRYPT_ROUNDS``
+    The bcrypt cost factor; every extra round doubles the work. Defaults to 12.
+``PASSWORD_ARGON2_TIME_COST``, ``PASSWORD_ARGON2_MEMORY_KIB``, ``PASSWORD_ARGON2_PARALLELISM``
+    The argon2id parameters. Default to 3 passes over 64 MiB with 4 lanes.
+
+Hashes made with other parameters or the other scheme keep verifying; a
+successful login rehashes them with the current ones. To pick a cost for the
+current hardware, run::
+
+    python passwords.py --target-ms 250
+"""
+import argparse
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Union
+
+import bcrypt
+
+try:
+    import argon2
+except ImportError:  # pragma: no cover - optional dependency
+    argon2 = None
+
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+ARGON2_PREFIX = "$argon2"
+
+
+def _text(hashed: Union[str, bytes]) -> str:
+    return hashed.decode("utf-8") if isinstance(hashed, bytes) else hashed
+
+
+class PasswordPolicy:
+    """Hashes new passwords with the configured scheme and verifies any supported hash.
+
+    :param scheme: ``"bcrypt"`` or ``"argon2"``.
+    :param bcrypt_rounds: The bcrypt cost factor (4-31).
+    :param argon2_time_cost: The number of argon2 passes.
+    :param argon2_memory_kib: The argon2 memory in KiB.
+    :param argon2_parallelism: The number of argon2 lanes.
+
+    :raises ValueError: If the scheme is unknown or argon2 is requested without ``argon2-cffi``.
+    """
+
+    def __init__(self, scheme: str = "bcrypt", bcrypt_rounds: int = 12, argon2_time_cost: int = 3,
+                 argon2_memory_kib: int = 65536, argon2_parallelism: int = 4):
+        if scheme not in ("bcrypt", "argon2"):
+            raise ValueError(f"Unknown password scheme: {scheme}")
+        if scheme == "argon2" and argon2 is None:
+            raise ValueError("The argon2 password scheme requires the argon2-cffi package")
+        if not 4 <= bcrypt_rounds <= 31:
+            raise ValueError("bcrypt rounds must be between 4 and 31")
+        self.scheme = scheme
+        self.bcrypt_rounds = bcrypt_rounds
+        self._argon2 = None
+        if argon2 is not None:
+            self._argon2 = argon2.PasswordHasher(time_cost=argon2_time_cost, memory_cost=argon2_memory_kib,
+                                                 parallelism=argon2_parallelism)
+
+    def hash(self, password: str) -> str:
+        """Hash a password with the current scheme and parameters."""
+        if self.scheme == "argon2":
+            return self._argon2.hash(password)
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=self.bcrypt_rounds)).decode("utf-8")
+
+    def verify(self, password: str, hashed: Union[str, bytes]) -> bool:
+        """Check a password against a bcrypt or argon2 hash.
+
+        :return: True if the password matches, otherwise False.
+        """
+        hashed = _text(hashed)
+        if hashed.startswith(ARGON2_PREFIX):
+            if self._argon2 is None:
+                raise ValueError("Verifying an argon2 hash requires the argon2-cffi package")
+            try:
+                return self._argon2.verify(hashed, password)
+            except argon2.exceptions.VerificationError:
+                return False
+            except argon2.exceptions.InvalidHashError:
+                return False
+        if hashed.startswith(BCRYPT_PREFIXES):
+            try:
+                return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+            except ValueError:
+                return False
+        return False
+
+    def needs_rehash(self, hashed: Union[str, bytes]) -> bool:
+        """Return True if a hash was made with another scheme or other parameters."""
+        hashed = _text(hashed)
+        if self.scheme == "argon2":
+            return not hashed.startswith(ARGON2_PREFIX) or self._argon2.check_needs_rehash(hashed)
+        if not hashed.startswith(BCRYPT_PREFIXES):
+            return True
+        try:
+            return int(hashed.split("$")[2]) != self.bcrypt_rounds
+        except (IndexError, ValueError):
+            return True
+
+
+def policy_from_env() -> PasswordPolicy:
+    """Build the policy configured by the ``PASSWORD_*`` variables."""
+    return PasswordPolicy(
+        scheme=os.getenv("PASSWORD_SCHEME", "bcrypt"),
+        bcrypt_rounds=int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12")),
+        argon2_time_cost=int(os.getenv("PASSWORD_ARGON2_TIME_COST", "3")),
+        argon2_memory_kib=int(os.getenv("PASSWORD_ARGON2_MEMORY_KIB", "65536")),
+        argon2_parallelism=int(os.getenv("PASSWORD_ARGON2_PARALLELISM", "4")),
+    )
+
+
+policy = policy_from_env()
+
+
+def hash_password(password: str) -> str:
+    """Hash a password with the configured policy."""
+    return policy.hash(password)
+
+
+def verify_password(password: str, hashed: Union[str, bytes]) -> bool:
+    """Check a password with the configured policy."""
+    return policy.verify(password, hashed)
+
+
+def needs_rehash(hashed: Union[str, bytes]) -> bool:
+    """Return True if a hash should be replaced on the next successful login."""
+    return policy.needs_rehash(hashed)
+
+
+@lru_cache(maxsize=None)
+def get_hash_pool() -> ThreadPoolExecutor:
+    """Return the pool that bulk password hashing runs on; bcrypt and argon2 release the GIL while hashing."""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="password-hash")
+
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    """Hash many passwords in parallel on the hash pool without blocking the event loop.
+
+    :param passwords: The plain text passwords.
+
+    :return: The hashed passwords, in the same order.
+    """
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(loop.run_in_executor(get_hash_pool(), hash_password, password)
+                                  for password in passwords))
+
+
+def _time_verification(candidate: PasswordPolicy, samples: int = 3) -> float:
+    hashed = candidate.hash("calibration password")
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        candidate.verify("calibration password", hashed)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def calibrate(target_seconds: float, scheme: str = "bcrypt", argon2_memory_kib: int = 65536,
+              argon2_parallelism: int = 4) -> tuple[dict, float]:
+    """Find the highest cost whose verification stays within ``target_seconds`` on this machine.
+
+    bcrypt's cost factor is raised one round at a time; for argon2 the memory and
+    lanes are fixed and the number of passes is raised.
+
+    :param target_seconds: The acceptable verification time.
+    :param scheme: ``"bcrypt"`` or ``"argon2"``.
+    :param argon2_memory_kib: The argon2 memory in KiB.
+    :param argon2_parallelism: The number of argon2 lanes.
+
+    :return: The ``PASSWORD_*`` settings and the measured verification time in seconds.
+    """
+    best: Optional[tuple[dict, float]] = None
+    cost = 4 if scheme == "bcrypt" else 1
+    while cost <= (31 if scheme == "bcrypt" else 100):
+        if scheme == "bcrypt":
+            settings = {"PASSWORD_SCHEME": "bcrypt", "PASSWORD_BCRYPT_ROUNDS": cost}
+            candidate = PasswordPolicy("bcrypt", bcrypt_rounds=cost)
+        else:
+            settings = {"PASSWORD_SCHEME": "argon2", "PASSWORD_ARGON2_TIME_COST": cost,
+                        "PASSWORD_ARGON2_MEMORY_KIB": argon2_memory_kib,
+                        "PASSWORD_ARGON2_PARALLELISM": argon2_parallelism}
+            candidate = PasswordPolicy("argon2", argon2_time_cost=cost, argon2_memory_kib=argon2_memory_kib,
+                                       argon2_parallelism=argon2_parallelism)
+        elapsed = _time_verification(candidate)
+        if elapsed > target_seconds and best is not None:
+            break
+        best = (settings, elapsed)
+        if elapsed > target_seconds:
+            break
+        cost += 1
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick the password hashing cost for this machine.")
+    parser.add_argument("--target-ms", type=float, default=250.0, help="The acceptable verification time.")
+    parser.add_argument("--scheme", choices=("bcrypt", "argon2"), default="bcrypt")
+    parser.add_argument("--memory-kib", type=int, default=65536, help="The argon2 memory in KiB.")
+    parser.add_argument("--parallelism", type=int, default=4, help="The number of argon2 lanes.")
+    args = parser.parse_args()
+
+    settings, elapsed = calibrate(args.target_ms / 1000, args.scheme, args.memory_kib, args.parallelism)
+    for name, value in settings.items():
+        print(f"{name}={value}")
+    print(f"# verification takes {elapsed * 1000:.0f} ms on this machine")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Access policy for posts and comments.
+
+Who may read or change a row is expressed as SQL predicates, so handlers put
+the check into the query that loads the row, or into a guarded ``UPDATE``,
+instead of loading the row first and checking it in Python:
+
+* a post is visible to its owner, to everyone once published, and to admins;
+* a post is editable by its owner and by admins;
+* a comment is editable by its author and by admins.
+
+Deleted rows are neither visible nor editable. A row that exists but fails the
+policy is reported exactly like a missing one, so its existence never leaks.
+"""
+from typing import Annotated
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import and_, insert, literal, or_, select, true
+from starlette import status
+
+from models import Comment, Post
+from routers.auth import get_current_user
+
+
+def authenticated(user: Annotated[dict, Depends(get_current_user)]) -> dict:
+    """Dependency that provides the current user and rejects anonymous requests.
+
+    :raises HTTPException: If there is no authenticated user.
+
+    :return: The current user.
+    """
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
+    return user
+
+
+def is_admin(user: dict) -> bool:
+    """Return True if the user may read and change every post and comment."""
+    return bool(user.get("is_superuser"))
+
+
+def visible_posts(user: dict):
+    """Build the predicate matching the posts ``user`` may read."""
+    if is_admin(user):
+        return Post.deleted_at.is_(None)
+    return and_(Post.deleted_at.is_(None), or_(Post.owner_id == user.get("id"), Post.published.is_(True)))
+
+
+def editable_posts(user: dict):
+    """Build the predicate matching the posts ``user`` may change or delete."""
+    return and_(Post.deleted_at.is_(None), true() if is_admin(user) else Post.owner_id == user.get("id"))
+
+
+def editable_comments(user: dict):
+    """Build the predicate matching the comments ``user`` may change or delete."""
+    return and_(Comment.deleted_at.is_(None), true() if is_admin(user) else Comment.author_id == user.get("id"))
+
+
+def can_read_post(user: dict, owner_id: int, published: bool) -> bool:
+    """Apply :func:`visible_posts` to a live post that is already loaded, e.g. by a shared query."""
+    return is_admin(user) or owner_id == user.get("id") or bool(published)
+
+
+def insert_where(model, values: dict, *criteria):
+    """Build an ``INSERT ... SELECT`` of ``values`` that inserts nothing unless ``criteria`` match a row.
+
+    The check and the insert are one statement, e.g. ``insert_where(Comment, values, Post.id == post_id,
+    visible_posts(user))``. The statement returns the new row's ID, or no row when the check fails.
+    """
+    row = select(*(literal(value, model.__table__.c[name].type) for name, value in values.items()))
+    return insert(model).from_select(list(values), row.where(*criteria)).returning(model.id)
@@ -0,0 +1,241 @@
+"""
+Rate limiting.
+
+Token buckets keyed by user id or client IP. Each route declares its own
+:class:`RateLimit` and adds it as a dependency, so a request is rejected
+before any expensive work (such as a bcrypt verification) is done.
+
+``RATE_LIMIT_SCALE`` multiplies every limit, e.g. for load tests that should
+measure the server rather than the limits; ``0`` turns rate limiting off.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Request
+from starlette import status
+
+import shared_state
+
+RATE_LIMIT_SCALE = float(os.getenv("RATE_LIMIT_SCALE", "1"))
+
+
+class MemoryBucketStore:
+    """In-process token buckets with LRU eviction.
+
+    Each bucket is stored as a ``(tokens, updated_at)`` tuple, so a full store
+    of ``max_keys`` buckets stays in the low megabytes.
+
+    :param max_keys: The maximum number of buckets to keep before evicting the least recently used.
+    :param clock: The time source in seconds.
+    """
+
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Take tokens from a bucket.
+
+        :param key: The bucket key.
+        :param rate: The refill rate in tokens per second.
+        :param capacity: The bucket size, i.e. the allowed burst.
+        :param cost: The number of tokens to take.
+
+        :return: 0 if the tokens were taken, otherwise the number of seconds until they are available.
+        """
+        with self._lock:
+            now = self.clock()
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        """Drop all buckets."""
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """Token buckets shared between processes through a SQLite file.
+
+    Every ``take`` runs in a ``BEGIN IMMEDIATE`` transaction, so workers on the
+    same host see a single consistent bucket per key.
+
+    :param path: The path of the SQLite file.
+    :param ttl: Buckets untouched for this many seconds are purged.
+    :param clock: The time source in seconds; must be shared between processes.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600.0, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self._local = threading.local()
+        self._last_purge = 0.0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL) WITHOUT ROWID"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Take tokens from a bucket. See :meth:`MemoryBucketStore.take`."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            now = self.clock()
+            row = connection.execute("SELECT tokens, updated_at FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated_at = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated_at) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / rate
+            connection.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            if now - self._last_purge > self.ttl:
+                connection.execute("DELETE FROM rate_buckets WHERE updated_at < ?", (now - self.ttl,))
+                self._last_purge = now
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+    def clear(self):
+        """Drop all buckets."""
+        self._connection().execute("DELETE FROM rate_buckets")
+
+
+class SharedBucketStore:
+    """Token buckets kept in the :mod:`shared_state` broker of a multi-worker server."""
+
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Take tokens from a bucket. See :meth:`MemoryBucketStore.take`."""
+        return shared_state.get_state().take(f"bucket:{key}", rate, capacity, cost)
+
+    def clear(self):
+        """Drop all buckets."""
+        shared_state.get_state().clear_buckets()
+
+
+def _store_from_env():
+    """Build the bucket store configured by ``RATE_LIMIT_STORE``.
+
+    ``memory`` (the default) keeps buckets per process; ``shared`` uses the
+    broker started by ``server.py``; ``sqlite:///path`` shares them through a file.
+    """
+    url = os.getenv("RATE_LIMIT_STORE", "memory")
+    if url.startswith("sqlite:///"):
+        return SQLiteBucketStore(url[len("sqlite:///"):])
+    if url == "shared":
+        return SharedBucketStore()
+    return MemoryBucketStore()
+
+
+store = _store_from_env()
+
+
+def client_ip(request: Request) -> str:
+    """Return the client address of a request.
+
+    :param request: The incoming request.
+
+    :return: The client IP, or ``"unknown"`` if the server did not provide one.
+    """
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimit:
+    """A per-route token-bucket limit.
+
+    :param name: The route name, used as the bucket key prefix.
+    :param rate: The sustained number of requests per ``per`` seconds.
+    :param per: The period of ``rate`` in seconds.
+    :param burst: The bucket capacity; defaults to ``rate``.
+    :param global_rate: An optional limit shared by all clients, per ``per`` seconds.
+    :param scale: The factor applied to all of the above; 0 disables the limit.
+    """
+
+    def __init__(self, name: str, rate: float, per: float = 60.0, burst: Optional[float] = None,
+                 global_rate: Optional[float] = None, scale: float = RATE_LIMIT_SCALE):
+        self.name = name
+        self.enabled = scale > 0
+        self.rate = rate * scale / per
+        self.capacity = (burst if burst is not None else rate) * scale
+        self.global_rate = global_rate * scale / per if global_rate else None
+        self.global_capacity = global_rate * scale if global_rate else None
+
+    def hit(self, key: str):
+        """Consume one token for ``key``.
+
+        :param key: The client key, e.g. ``"ip:127.0.0.1"`` or ``"user:1"``.
+
+        :raises HTTPException: If the client or the route as a whole is over its limit.
+        """
+        if not self.enabled:
+            return
+        wait = store.take(f"{self.name}:{key}", self.rate, self.capacity)
+        if not wait and self.global_rate:
+            wait = store.take(f"{self.name}:*", self.global_rate, self.global_capacity)
+        if wait:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    def per_ip(self):
+        """Build a dependency that limits by client IP."""
+        async def dependency(request: Request):
+            self.hit(f"ip:{client_ip(request)}")
+        return dependency
+
+    def per_user(self, user_dependency):
+        """Build a dependency that limits by the authenticated user, falling back to the client IP.
+
+        :param user_dependency: The annotated current-user dependency of the router.
+        """
+        async def dependency(request: Request, user: user_dependency):
+            if user and user.get("id") is not None:
+                self.hit(f"user:{user.get('id')}")
+            else:
+                self.hit(f"ip:{client_ip(request)}")
+        return dependency
+
+
+login_limit = RateLimit("login", rate=10, burst=10, global_rate=3000)
+create_post_limit = RateLimit("create_post", rate=30, burst=20)
+create_comment_limit = RateLimit("create_comment", rate=60, burst=30)
+upload_attachment_limit = RateLimit("upload_attachment", rate=20, burst=10)
@@ -0,0 +1,128 @@
+"""
+Reaper for soft-deleted posts and comments.
+
+Deleting a post only stamps ``deleted_at`` and enqueues a ``purge_post`` job;
+this module hard-deletes the rows later in small batches, each in its own
+short transaction, so a post with a huge comment tree never holds the SQLite
+write lock for long. Each pass also deletes expired idempotency keys.
+"""
+import asyncio
+import logging
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import attachments
+import idempotency
+import jobs
+import tagging
+from database import SessionLocal
+from sharding import comment_sessions
+from models import Attachment, Comment, Post, PostRevision, Tag, post_tags
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+INTERVAL_SECONDS = 60.0
+
+
+def _delete_batch(db: Session, model, *criteria, batch_size: int) -> int:
+    """Delete up to ``batch_size`` rows of ``model`` matching ``criteria`` and commit.
+
+    :return: The number of deleted rows.
+    """
+    ids = select(model.id).where(*criteria).limit(batch_size).scalar_subquery()
+    result = db.execute(delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+    db.commit()
+    return result.rowcount
+
+
+def _delete_all(db: Session, model, *criteria, batch_size: int) -> int:
+    """Delete all rows of ``model`` matching ``criteria``, one batch per transaction.
+
+    :return: The number of deleted rows.
+    """
+    deleted = 0
+    while True:
+        count = _delete_batch(db, model, *criteria, batch_size=batch_size)
+        deleted += count
+        if count < batch_size:
+            return deleted
+
+
+@jobs.task("purge_post")
+def purge_post(db: Session, post_id: int, batch_size: int = BATCH_SIZE) -> int:
+    """Hard-delete a soft-deleted post and all of its comments.
+
+    Comments, revisions and attachments are removed in batches first, then the post's tag links and the post
+    row itself. The attachments' files are deleted later by ``delete_attachment_blob`` jobs.
+
+    :param db: The database session.
+    :param post_id: The ID of the soft-deleted post.
+    :param batch_size: The maximum number of rows deleted per transaction.
+
+    :return: The number of deleted rows, comments included.
+    """
+    with comment_sessions(db) as shards:
+        deleted = _delete_all(shards.for_post(post_id), Comment, Comment.post_id == post_id, batch_size=batch_size)
+    deleted += _delete_all(db, PostRevision, PostRevision.post_id == post_id, batch_size=batch_size)
+    # The jobs are committed with the first batch of attachments; each deletes its file only once it is unused.
+    for sha256 in db.scalars(select(Attachment.sha256).where(Attachment.post_id == post_id).distinct()).all():
+        attachments.schedule_delete(db, sha256)
+    deleted += _delete_all(db, Attachment, Attachment.post_id == post_id, batch_size=batch_size)
+
+    deleted_post = select(Post.id).where(Post.id == post_id, Post.deleted_at.isnot(None))
+    names = db.scalars(
+        select(Tag.name).join(post_tags, post_tags.c.tag_id == Tag.id).where(post_tags.c.post_id.in_(deleted_post))
+    ).all()
+    db.execute(delete(post_tags).where(post_tags.c.post_id.in_(deleted_post)))
+    deleted += _delete_batch(db, Post, Post.id == post_id, Post.deleted_at.isnot(None), batch_size=1)
+    tagging.index.apply(post_id, removed=names)
+    return deleted
+
+
+def purge_deleted(db: Session, batch_size: int = BATCH_SIZE, max_posts: int = 100) -> int:
+    """Hard-delete soft-deleted comments and up to ``max_posts`` soft-deleted posts.
+
+    :param db: The database session.
+    :param batch_size: The maximum number of rows deleted per transaction.
+    :param max_posts: The maximum number of posts purged in one pass.
+
+    :return: The number of deleted rows.
+    """
+    deleted = 0
+    with comment_sessions(db) as shards:
+        for comment_db in shards.all():
+            deleted += _delete_all(comment_db, Comment, Comment.deleted_at.isnot(None), batch_size=batch_size)
+
+    post_ids = db.scalars(select(Post.id).where(Post.deleted_at.isnot(None)).limit(max_posts)).all()
+    for post_id in post_ids:
+        deleted += purge_post(db, post_id, batch_size=batch_size)
+    return deleted
+
+
+def _purge_once(batch_size: int) -> int:
+    db = SessionLocal()
+    try:
+        return purge_deleted(db, batch_size=batch_size) + idempotency.prune(db)
+    finally:
+        db.close()
+
+
+async def run_reaper(interval: float = INTERVAL_SECONDS, batch_size: int = BATCH_SIZE):
+    """Periodically purge soft-deleted rows until cancelled.
+
+    This sweeps up anything the ``purge_post`` jobs missed, such as deleted comments.
+
+    :param interval: The number of seconds between passes.
+    :param batch_size: The maximum number of rows deleted per transaction.
+    """
+    while True:
+        try:
+            deleted = await run_in_threadpool(_purge_once, batch_size)
+            if deleted:
+                logger.info("Reaper purged %d rows", deleted)
+        except Exception:
+            logger.exception("Reaper pass failed")
+        await asyncio.sleep(interval)
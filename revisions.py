@@ -0,0 +1,145 @@
+"""
+Post revision history.
+
+Every version of a post is stored in ``post_revisions`` as a zlib-compressed
+JSON document. Most revisions hold only a word-level diff against the previous
+version; every :data:`SNAPSHOT_INTERVAL` versions a full snapshot is stored, so
+rebuilding any version replays at most ``SNAPSHOT_INTERVAL - 1`` diffs.
+"""
+import json
+import re
+import zlib
+from difflib import SequenceMatcher
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from models import Post, PostRevision
+
+SNAPSHOT_INTERVAL = 10
+
+_TOKEN = re.compile(r"\s+|[^\s]+")
+
+
+def document(post: Post) -> dict:
+    """Return the versioned fields of a post."""
+    return {"title": post.title, "content": post.content, "published": post.published}
+
+
+def _tokens(text: str) -> list[str]:
+    return _TOKEN.findall(text)
+
+
+def _pack(value) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _unpack(data: bytes):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+def diff(old: dict, new: dict) -> dict:
+    """Build a delta that turns ``old`` into ``new``.
+
+    ``content`` is diffed on word and whitespace tokens; only the changed token
+    ranges and their replacement text are kept. Other fields are stored only if they changed.
+
+    :param old: The previous document.
+    :param new: The new document.
+
+    :return: The delta.
+    """
+    old_tokens = _tokens(old["content"])
+    new_tokens = _tokens(new["content"])
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    ops = [
+        [i1, i2, "".join(new_tokens[j1:j2])]
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+    delta = {"ops": ops}
+    for field in ("title", "published"):
+        if old[field] != new[field]:
+            delta[field] = new[field]
+    return delta
+
+
+def patch(old: dict, delta: dict) -> dict:
+    """Apply a delta produced by :func:`diff`.
+
+    :param old: The document the delta was computed against.
+    :param delta: The delta.
+
+    :return: The new document.
+    """
+    tokens = _tokens(old["content"])
+    parts = []
+    position = 0
+    for start, end, replacement in delta["ops"]:
+        parts.extend(tokens[position:start])
+        parts.append(replacement)
+        position = end
+    parts.extend(tokens[position:])
+    return {
+        "title": delta.get("title", old["title"]),
+        "content": "".join(parts),
+        "published": delta.get("published", old["published"]),
+    }
+
+
+def latest_version(db: Session, post_id: int) -> Optional[int]:
+    """Return the latest stored version of a post, or None if it has no history."""
+    return db.scalar(select(func.max(PostRevision.version)).where(PostRevision.post_id == post_id))
+
+
+def record(db: Session, post: Post, previous: Optional[dict] = None) -> int:
+    """Store the current state of ``post`` as a new revision, in the caller's transaction.
+
+    :param db: The database session.
+    :param post: The post in its new state; must have an ID.
+    :param previous: The document before the change; required unless this is the first revision.
+
+    :return: The new version number.
+    """
+    latest = latest_version(db, post.id)
+    if latest is None and previous is not None:
+        # Posts created before revisions existed get their pre-edit state as version 1.
+        db.add(PostRevision(post_id=post.id, version=1, is_snapshot=True, data=_pack(previous)))
+        latest = 1
+
+    version = (latest or 0) + 1
+    current = document(post)
+    if version % SNAPSHOT_INTERVAL == 1 or previous is None:
+        db.add(PostRevision(post_id=post.id, version=version, is_snapshot=True, data=_pack(current)))
+    else:
+        db.add(PostRevision(post_id=post.id, version=version, is_snapshot=False, data=_pack(diff(previous, current))))
+    return version
+
+
+def reconstruct(db: Session, post_id: int, version: int) -> Optional[dict]:
+    """Rebuild a version of a post from the nearest snapshot and the following diffs.
+
+    :param db: The database session.
+    :param post_id: The ID of the post.
+    :param version: The version to rebuild.
+
+    :return: The document, or None if the version does not exist.
+    """
+    snapshot = (
+        select(func.max(PostRevision.version))
+        .where(PostRevision.post_id == post_id, PostRevision.is_snapshot, PostRevision.version <= version)
+        .scalar_subquery()
+    )
+    rows = db.execute(
+        select(PostRevision.version, PostRevision.is_snapshot, PostRevision.data)
+        .where(PostRevision.post_id == post_id, PostRevision.version >= snapshot, PostRevision.version <= version)
+        .order_by(PostRevision.version)
+    ).all()
+    if not rows or rows[-1].version != version:
+        return None
+
+    current = _unpack(rows[0].data)
+    for row in rows[1:]:
+        current = patch(current, _unpack(row.data))
+    return current
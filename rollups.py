@@ -0,0 +1,181 @@
+"""
+Activity rollups.
+
+New users, posts and comments are counted per hour and per day in
+``activity_rollups``, and posts and comments per author per day in
+``author_rollups``, so admin statistics never group the raw tables.
+
+The counts are maintained by a background task that reads the rows added
+since the last pass, in ID order from a per-table watermark. A first pass
+on an empty ``rollup_watermarks`` table counts all existing rows, so
+:func:`rebuild` only has to clear the rollups and start over.
+
+Every worker runs passes, and the ``rebuild_rollups`` job may run alongside
+them, so a batch is only counted by the pass that moves its watermark from
+the value it read: the move is a compare-and-set in the same transaction as
+the counts, and a pass that loses it rolls back and reads the watermark again.
+"""
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import jobs
+from database import SessionLocal
+from models import ActivityRollup, AuthorRollup, Comment, Post, RollupWatermark, User
+from sharding import comment_sessions
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 5000
+INTERVAL_SECONDS = 60.0
+
+
+def _buckets(created_at) -> tuple[datetime, datetime]:
+    created_at = created_at or datetime.now(timezone.utc).replace(tzinfo=None)
+    hour = created_at.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    return hour, hour.replace(hour=0)
+
+
+def _watermark(db: Session, source: str) -> int:
+    return db.scalar(select(RollupWatermark.last_id).where(RollupWatermark.source == source)) or 0
+
+
+def _move_watermark(db: Session, source: str, seen: int, last_id: int) -> bool:
+    """Move a watermark from ``seen`` to ``last_id``; return False if another pass moved or cleared it first."""
+    if seen == 0:
+        statement = insert(RollupWatermark).values(source=source, last_id=last_id).on_conflict_do_nothing()
+    else:
+        statement = (
+            update(RollupWatermark)
+            .where(RollupWatermark.source == source, RollupWatermark.last_id == seen)
+            .values(last_id=last_id)
+        )
+    return db.execute(statement).rowcount == 1
+
+
+def _add_counts(db: Session, activity: Counter, authors: Counter):
+    """Add counted rows to the rollup tables with upserts."""
+    if activity:
+        statement = insert(ActivityRollup)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["period", "bucket", "metric"],
+                set_={"count": ActivityRollup.count + statement.excluded.count},
+            ),
+            [{"period": period, "bucket": bucket, "metric": metric, "count": count}
+             for (period, bucket, metric), count in activity.items()],
+        )
+    if authors:
+        statement = insert(AuthorRollup)
+        db.execute(
+            statement.on_conflict_do_update(
+                index_elements=["day", "author_id"],
+                set_={"posts": AuthorRollup.posts + statement.excluded.posts,
+                      "comments": AuthorRollup.comments + statement.excluded.comments},
+            ),
+            [{"day": day, "author_id": author_id, "posts": count if metric == "posts" else 0,
+              "comments": count if metric == "comments" else 0}
+             for (day, author_id, metric), count in authors.items()],
+        )
+
+
+def _roll_up_source(db: Session, source_db: Session, source: str, model, author_column, metric: str,
+                    batch_size: int) -> int:
+    """Count the rows of one source table added since its watermark, one batch per transaction.
+
+    :return: The number of counted rows.
+    """
+    counted = 0
+    while True:
+        last_id = _watermark(db, source)
+        columns = [model.id, model.created_at] + ([author_column] if author_column is not None else [])
+        rows = source_db.execute(
+            select(*columns).where(model.id > last_id).order_by(model.id).limit(batch_size)
+        ).all()
+        source_db.rollback()
+        # Also ends the read of the watermark, so the compare-and-set below sees other passes' commits.
+        db.rollback()
+        if not rows:
+            return counted
+
+        activity = Counter()
+        authors = Counter()
+        for row in rows:
+            hour, day = _buckets(row.created_at)
+            activity["hour", hour, metric] += 1
+            activity["day", day, metric] += 1
+            if author_column is not None and row[2] is not None:
+                authors[day.date(), row[2], metric] += 1
+
+        if not _move_watermark(db, source, last_id, rows[-1].id):
+            db.rollback()
+            continue
+        _add_counts(db, activity, authors)
+        db.commit()
+        counted += len(rows)
+        if len(rows) < batch_size:
+            return counted
+
+
+def update_rollups(db: Session, batch_size: int = BATCH_SIZE) -> int:
+    """Count the users, posts and comments added since the previous pass.
+
+    :param db: The database session.
+    :param batch_size: The maximum number of rows counted per transaction.
+
+    :return: The number of counted rows.
+    """
+    counted = _roll_up_source(db, db, "users", User, None, "users", batch_size)
+    counted += _roll_up_source(db, db, "posts", Post, Post.owner_id, "posts", batch_size)
+    with comment_sessions(db) as shards:
+        sessions = shards.all()
+        for shard, comment_db in enumerate(sessions):
+            source = f"comments:{shard}" if len(sessions) > 1 else "comments"
+            counted += _roll_up_source(db, comment_db, source, Comment, Comment.author_id, "comments", batch_size)
+    return counted
+
+
+@jobs.task("rebuild_rollups")
+def rebuild(db: Session, batch_size: int = BATCH_SIZE) -> int:
+    """Clear the rollups and count every existing row again.
+
+    :param db: The database session.
+    :param batch_size: The maximum number of rows counted per transaction.
+
+    :return: The number of counted rows.
+    """
+    db.execute(delete(ActivityRollup))
+    db.execute(delete(AuthorRollup))
+    db.execute(delete(RollupWatermark))
+    db.commit()
+    return update_rollups(db, batch_size=batch_size)
+
+
+def _update_once(batch_size: int) -> int:
+    db = SessionLocal()
+    try:
+        return update_rollups(db, batch_size=batch_size)
+    finally:
+        db.close()
+
+
+async def run_rollups(interval: float = INTERVAL_SECONDS, batch_size: int = BATCH_SIZE):
+    """Periodically bring the rollups up to date until cancelled.
+
+    :param interval: The number of seconds between passes.
+    :param batch_size: The maximum number of rows counted per transaction.
+    """
+    while True:
+        try:
+            counted = await run_in_threadpool(_update_once, batch_size)
+            if counted:
+                logger.info("Rolled up %d rows", counted)
+        except Exception:
+            logger.exception("Rollup pass failed")
+        await asyncio.sleep(interval)
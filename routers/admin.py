@@ -1,16 +1,24 @@
 """
 Admins router.
 """
-from typing import Annotated
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import bindparam, func, select, update
 from sqlalchemy.orm import Session
 from starlette import status
 
+import jobs
+import singleflight
+import user_status
 from database import SessionLocal
-from models import User
+from models import ActivityRollup, AuthorRollup, User, as_utc
+from passwords import hash_passwords
 from .auth import get_current_user, get_password_hash
-from schemas import CreateSuperUserRequest
+from schemas import (ActivityStatsResponse, BulkUsersRequest, BulkUsersResponse, CoalescingStatsResponse,
+                     CreateSuperUserRequest, PasswordResetResponse, TopAuthorResponse)
 
 router = APIRouter(
     prefix="/admin",
@@ -33,6 +41,9 @@ def get_db():
 db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
+BULK_CHUNK_SIZE = 500
+TEMPORARY_PASSWORD_BYTES = 12
+
 
 def get_current_superuser(user: user_dependency):
     """Ensure the current user is a superuser.
@@ -78,3 +89,196 @@ async def create_superuser(
     db.add(create_user_model)
     db.commit()
     db.refresh(create_user_model)
+
+
+@router.get("/stats/activity", response_model=list[ActivityStatsResponse], status_code=status.HTTP_200_OK)
+async def get_activity_stats(
+        db: db_dependency,
+        current_user: User = Depends(get_current_superuser),
+        period: Literal["hour", "day"] = "day",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+):
+    """Retrieve the number of new users, posts and comments per hour or day.
+
+    Counts come from the rollup tables and lag the live data by up to a minute.
+
+    :param db: The database session.
+    :param current_user: The current authenticated superuser.
+    :param period: ``day`` (default) or ``hour``.
+    :param start: The first bucket to include; defaults to 30 days or 48 hours ago.
+    :param end: The last bucket to include; defaults to now.
+
+    :return: One entry per bucket with activity, oldest first.
+    """
+    end = as_utc(end or datetime.now(timezone.utc))
+    start = (as_utc(start) if start else
+             end - (timedelta(days=30) if period == "day" else timedelta(hours=48)))
+
+    rows = db.execute(
+        select(ActivityRollup.bucket, ActivityRollup.metric, ActivityRollup.count)
+        .where(ActivityRollup.period == period, ActivityRollup.bucket >= start, ActivityRollup.bucket <= end)
+        .order_by(ActivityRollup.bucket)
+    ).all()
+    buckets = {}
+    for row in rows:
+        buckets.setdefault(row.bucket, {"bucket": row.bucket})[row.metric] = row.count
+    return list(buckets.values())
+
+
+@router.get("/stats/top_authors", response_model=list[TopAuthorResponse], status_code=status.HTTP_200_OK)
+async def get_top_authors(
+        db: db_dependency,
+        current_user: User = Depends(get_current_superuser),
+        days: int = Query(30, ge=1, le=366),
+        limit: int = Query(10, ge=1, le=100),
+):
+    """Retrieve the authors with the most posts and comments over the last days.
+
+    :param db: The database session.
+    :param current_user: The current authenticated superuser.
+    :param days: The number of days to look back (default is 30).
+    :param limit: The maximum number of authors to return (default is 10).
+
+    :return: The authors, most active first.
+    """
+    since = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    posts = func.sum(AuthorRollup.posts).label("posts")
+    comments = func.sum(AuthorRollup.comments).label("comments")
+    rows = db.execute(
+        select(AuthorRollup.author_id, posts, comments)
+        .where(AuthorRollup.day >= since)
+        .group_by(AuthorRollup.author_id)
+        .order_by((posts + comments).desc(), AuthorRollup.author_id)
+        .limit(limit)
+    ).all()
+    usernames = dict(db.execute(
+        select(User.id, User.username).where(User.id.in_([row.author_id for row in rows]))
+    ).all())
+    return [{**row._asdict(), "username": usernames.get(row.author_id)} for row in rows]
+
+
+@router.post("/stats/rebuild", status_code=status.HTTP_202_ACCEPTED)
+async def rebuild_stats(db: db_dependency, current_user: User = Depends(get_current_superuser)):
+    """Recount the rollups from the raw tables in a background job.
+
+    :param db: The database session.
+    :param current_user: The current authenticated superuser.
+
+    :return: None
+    """
+    jobs.enqueue(db, "rebuild_rollups")
+    db.commit()
+
+
+@router.get("/stats/coalescing", response_model=dict[str, CoalescingStatsResponse], status_code=status.HTTP_200_OK)
+async def coalescing_stats(current_user: User = Depends(get_current_superuser)):
+    """Report how many concurrent reads each coalesced query absorbed in this worker.
+
+    :param current_user: The current authenticated superuser.
+
+    :return: The counts of each read path, by name.
+    """
+    return singleflight.stats()
+
+
+def _chunks(user_ids: list[int]):
+    user_ids = list(dict.fromkeys(user_ids))
+    for start in range(0, len(user_ids), BULK_CHUNK_SIZE):
+        yield user_ids[start:start + BULK_CHUNK_SIZE]
+
+
+def _set_active(db: Session, user_ids: list[int], is_active: bool) -> int:
+    """Activate or deactivate users with one UPDATE per chunk and refresh every worker's status cache.
+
+    Deactivating also revokes the users' tokens.
+
+    :return: The number of updated users.
+    """
+    values = {"is_active": is_active}
+    if not is_active:
+        values["tokens_valid_after"] = user_status.revocation_time()
+
+    updated = 0
+    for chunk in _chunks(user_ids):
+        result = db.execute(update(User).where(User.id.in_(chunk)).values(**values)
+                            .execution_options(synchronize_session=False))
+        updated += result.rowcount
+    db.commit()
+    user_status.changed(db, user_ids)
+    return updated
+
+
+@router.post("/users/deactivate", response_model=BulkUsersResponse, status_code=status.HTTP_200_OK)
+async def deactivate_users(request: BulkUsersRequest, db: db_dependency,
+                           current_user: User = Depends(get_current_superuser)):
+    """Deactivate users and revoke their tokens immediately.
+
+    :param request: The IDs of the users.
+    :param db: The database session.
+    :param current_user: The current authenticated superuser.
+
+    :raises HTTPException: If the current user is in the list.
+
+    :return: The number of deactivated users.
+    """
+    if current_user.get("id") in request.user_ids:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="You cannot deactivate yourself.")
+    return {"updated": _set_active(db, request.user_ids, False)}
+
+
+@router.post("/users/reactivate", response_model=BulkUsersResponse, status_code=status.HTTP_200_OK)
+async def reactivate_users(request: BulkUsersRequest, db: db_dependency,
+                           current_user: User = Depends(get_current_superuser)):
+    """Reactivate users; tokens revoked on deactivation stay invalid.
+
+    :param request: The IDs of the users.
+    :param db: The database session.
+    :param current_user: The current authenticated superuser.
+
+    :return: The number of reactivated users.
+    """
+    return {"updated": _set_active(db, request.user_ids, True)}
+
+
+@router.post("/users/reset_passwords", response_model=PasswordResetResponse, status_code=status.HTTP_200_OK)
+async def reset_passwords(request: BulkUsersRequest, db: db_dependency,
+                          current_user: User = Depends(get_current_superuser)):
+    """Replace users' passwords with random temporary ones and revoke their tokens.
+
+    Every password is hashed first, in parallel on the hash pool, and then all of
+    them are written in one transaction with one batched UPDATE per chunk. A
+    failure therefore changes no password, and no user ends up with a password
+    that was never returned.
+
+    The temporary passwords are returned in plain text, once, to the calling
+    admin, who has to hand them to the users; they are not stored anywhere else.
+    This is deliberate, as the application has no other channel (such as email)
+    to deliver a reset, but the response must be treated as a secret.
+
+    :param request: The IDs of the users.
+    :param db: The database session.
+    :param current_user: The current authenticated superuser.
+
+    :return: The number of updated users and their temporary passwords.
+    """
+    user_ids = []
+    for chunk in _chunks(request.user_ids):
+        user_ids.extend(db.scalars(select(User.id).where(User.id.in_(chunk))))
+    # Not held open while hashing, which takes far longer than the writes.
+    db.rollback()
+    temporary = [secrets.token_urlsafe(TEMPORARY_PASSWORD_BYTES) for _ in user_ids]
+    hashed = await hash_passwords(temporary)
+
+    revoked_at = user_status.revocation_time()
+    rows = [{"user_id": user_id, "password_hash": password_hash} for user_id, password_hash in zip(user_ids, hashed)]
+    for start in range(0, len(rows), BULK_CHUNK_SIZE):
+        db.execute(
+            update(User.__table__)
+            .where(User.__table__.c.id == bindparam("user_id"))
+            .values(hashed_password=bindparam("password_hash"), tokens_valid_after=revoked_at),
+            rows[start:start + BULK_CHUNK_SIZE],
+        )
+    db.commit()
+    user_status.changed(db, user_ids)
+    return {"updated": len(user_ids), "passwords": dict(zip(user_ids, temporary))}
@@ -0,0 +1,168 @@
+"""
+Attachments router.
+"""
+from pathlib import PurePosixPath
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from starlette import status
+
+import attachments
+import policy
+from database import SessionLocal
+from models import Attachment, Post, utcnow
+from ratelimit import upload_attachment_limit
+from schemas import AttachmentResponse
+
+router = APIRouter(
+    prefix="/attachments",
+    tags=["attachments"]
+)
+
+
+def get_db():
+    """Dependency that provides a database session.
+
+    :return: A generator that yields a database session.
+    """
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+db_dependency = Annotated[Session, Depends(get_db)]
+user_dependency = Annotated[dict, Depends(policy.authenticated)]
+
+
+@router.post("/upload", response_model=AttachmentResponse, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(upload_attachment_limit.per_user(user_dependency))])
+async def upload_attachment(request: Request, post_id: int, user: user_dependency, db: db_dependency,
+                            filename: str = Query(min_length=1, max_length=255)):
+    """Attach the request body as a file to a post of the current user.
+
+    The body is the raw file content, typed by the ``Content-Type`` header. It is
+    streamed to disk in chunks, so uploads of any size use constant memory.
+
+    :param request: The incoming request.
+    :param post_id: The ID of the post.
+    :param user: The current authenticated user.
+    :param db: The database session.
+    :param filename: The name of the file, without directories.
+
+    :raises HTTPException: If the user is not authenticated, the post is not found, the filename is empty
+        or the file is too large.
+
+    :return: The created attachment.
+    """
+    filename = PurePosixPath(filename.replace("\\", "/")).name
+    if not filename:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid filename")
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > attachments.MAX_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Attachment is too large")
+    if db.query(Post.id).filter(Post.id == post_id, policy.editable_posts(user)).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    # End the read transaction, so no connection is held while the body streams in.
+    db.rollback()
+
+    sha256, size = await attachments.store(request.stream())
+    values = {
+        "post_id": post_id,
+        "uploader_id": user.get("id"),
+        "filename": filename,
+        "content_type": request.headers.get("content-type", "application/octet-stream").split(";")[0].strip()[:100],
+        "size": size,
+        "sha256": sha256,
+        "created_at": utcnow(),
+    }
+    try:
+        # The post may have been deleted while the body was uploading.
+        attachment_id = db.scalar(
+            policy.insert_where(Attachment, values, Post.id == post_id, policy.editable_posts(user))
+        )
+        if attachment_id is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+        db.commit()
+    except BaseException:
+        db.rollback()
+        attachments.schedule_delete(db, sha256)
+        db.commit()
+        raise
+
+    return AttachmentResponse(id=attachment_id, **values)
+
+
+@router.get("/", response_model=list[AttachmentResponse], status_code=status.HTTP_200_OK)
+async def get_attachments(post_id: int, user: user_dependency, db: db_dependency):
+    """Retrieve the attachments of a post visible to the current user.
+
+    :param post_id: The ID of the post.
+    :param user: The current authenticated user.
+    :param db: The database session.
+
+    :raises HTTPException: If the user is not authenticated or the post is not found.
+
+    :return: The attachments, oldest first.
+    """
+    if db.query(Post.id).filter(Post.id == post_id, policy.visible_posts(user)).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    return db.query(Attachment).filter(Attachment.post_id == post_id).order_by(Attachment.id).all()
+
+
+@router.get("/{attachment_id}", response_class=attachments.BlobResponse, status_code=status.HTTP_200_OK)
+async def download_attachment(attachment_id: int, request: Request, user: user_dependency, db: db_dependency):
+    """Download an attachment of a post visible to the current user.
+
+    A ``Range`` header with a single byte range gets a ``206 Partial Content``
+    response with just those bytes, so interrupted downloads can be resumed and
+    media can be seeked.
+
+    :param attachment_id: The ID of the attachment.
+    :param request: The incoming request.
+    :param user: The current authenticated user.
+    :param db: The database session.
+
+    :raises HTTPException: If the user is not authenticated, the attachment is not found or the range is not
+        satisfiable.
+
+    :return: The file content.
+    """
+    attachment = (
+        db.query(Attachment)
+        .join(Post, Post.id == Attachment.post_id)
+        .filter(Attachment.id == attachment_id, policy.visible_posts(user))
+        .first()
+    )
+    if attachment is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    return attachments.BlobResponse(attachment, request.headers.get("range"), request.headers.get("if-range"))
+
+
+@router.delete("/{attachment_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_attachment(attachment_id: int, user: user_dependency, db: db_dependency):
+    """Delete an attachment of a post of the current user.
+
+    The file is removed by a background job once no other attachment refers to it.
+
+    :param attachment_id: The ID of the attachment.
+    :param user: The current authenticated user.
+    :param db: The database session.
+
+    :raises HTTPException: If the user is not authenticated or the attachment is not found.
+
+    :return: None
+    """
+    editable = select(Post.id).where(policy.editable_posts(user))
+    sha256 = db.scalar(
+        delete(Attachment)
+        .where(Attachment.id == attachment_id, Attachment.post_id.in_(editable))
+        .returning(Attachment.sha256)
+    )
+    if sha256 is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Attachment not found")
+    attachments.schedule_delete(db, sha256)
+    db.commit()
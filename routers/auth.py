@@ -2,17 +2,20 @@
 Authentication router.
 """
 from datetime import datetime, timedelta, timezone
-from typing import Annotated, Type
+from typing import Annotated, Type, Union
 
-import bcrypt
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import jwt, JWTError
 from sqlalchemy.orm import Session
 from starlette import status
+from starlette.concurrency import run_in_threadpool
 
+import passwords
+import user_status
 from database import SessionLocal
 from models import User
+from ratelimit import login_limit
 from schemas import CreateUserRequest, Token
 
 router = APIRouter(
@@ -41,20 +44,17 @@ def get_db():
 db_dependency: Type[Session] = Annotated[Session, Depends(get_db)]
 
 
-def get_password_hash(password: str) -> bytes:
+def get_password_hash(password: str) -> str:
     """Generate a hashed password from a plain text password.
 
     :param password: The plain text password to hash.
 
-    :return: The hashed password as bytes.
+    :return: The hash, made with the configured password policy.
     """
-    pwd_bytes = password.encode("utf-8")
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(password=pwd_bytes, salt=salt)
-    return hashed_password
+    return passwords.hash_password(password)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+def verify_password(plain_password: str, hashed_password: Union[str, bytes]) -> bool:
     """Verify a plain text password against a hashed password.
 
     :param plain_password: The plain text password to verify.
@@ -62,10 +62,7 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
     :return: True if the passwords match, otherwise False.
     """
-    pwd_bytes = plain_password.encode("utf-8")
-    if isinstance(hashed_password, str):
-        hashed_password = hashed_password.encode("utf-8")
-    return bcrypt.checkpw(password=pwd_bytes, hashed_password=hashed_password)
+    return passwords.verify_password(plain_password, hashed_password)
 
 
 def authenticate_user(username: str, password: str, db):
@@ -78,10 +75,15 @@ def authenticate_user(username: str, password: str, db):
     :return: The authenticated user object if successful; otherwise False.
     """
     user = db.query(User).filter(User.username == username).first()
-    if not user:
+    if not user or user.is_active is False:
         return False
     if not verify_password(password, user.hashed_password):
         return False
+    if passwords.needs_rehash(user.hashed_password):
+        # The password is known only now, so hashes made under an older policy are upgraded at login.
+        # Not a background job: its payload would be the plain text password, persisted in the jobs table.
+        user.hashed_password = get_password_hash(password)
+        db.commit()
     return user
 
 
@@ -95,8 +97,10 @@ def create_access_token(username: str, user_id: int, is_superuser: bool, expires
 
     :return: A JWT access token as a string.
     """
-    encode = {"sub": username, "id": user_id, "is_superuser": is_superuser}
-    expires = datetime.now(timezone.utc) + expires_delta
+    now = datetime.now(timezone.utc)
+    # A fractional "iat" lets tokens issued right after a revocation be told apart from older ones.
+    encode = {"sub": username, "id": user_id, "is_superuser": is_superuser, "iat": now.timestamp()}
+    expires = now + expires_delta
     encode.update({"exp": expires})
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
@@ -106,7 +110,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
 
     :param token: The JWT access token.
 
-    :raises HTTPException: If the token is invalid or expired.
+    :raises HTTPException: If the token is invalid, expired or revoked, or the user is inactive.
 
     :return: A dictionary containing the current user's information.
     """
@@ -117,6 +121,13 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
         is_superuser: str = payload.get("is_superuser")
         if username is None or user_id is None:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user")
+        if user_status.cache.loaded:
+            allowed = user_status.cache.allows(user_id, payload.get("iat"))
+        else:
+            # A query, until this worker has loaded the cache.
+            allowed = await run_in_threadpool(user_status.cache.allows, user_id, payload.get("iat"))
+        if not allowed:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user")
         return {"username": username, "id": user_id, "is_superuser": is_superuser}
     except JWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user")
@@ -154,7 +165,7 @@ async def create_user(db: db_dependency, create_user_request: CreateUserRequest)
     db.refresh(create_user_model)
 
 
-@router.post("/token", response_model=Token)
+@router.post("/token", response_model=Token, dependencies=[Depends(login_limit.per_ip())])
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()], db: db_dependency):
     """Login and obtain an access token for a user.
 
@@ -165,7 +176,7 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
 
     :return: A dictionary containing the access token and its type.
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await run_in_threadpool(authenticate_user, form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate user")
     token = create_access_token(user.username, user.id, user.is_superuser, timedelta(minutes=20))
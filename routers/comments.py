@@ -1,17 +1,25 @@
 """
 Comments router.
 """
-from typing import Annotated
+from datetime import datetime
+from typing import Annotated, Callable, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, func, insert, select, update
+from sqlalchemy.orm import Session, aliased
 from starlette import status
 
+import cache
+import idempotency
+import policy
+import singleflight
+import trending
 from database import SessionLocal
-from models import Post, Comment
+from models import Post, Comment, as_utc, utcnow
+from sharding import CommentShards, ShardSessions, comment_sessions
+from ratelimit import create_comment_limit
 from routers.auth import get_current_user
-from routers.posts import get_post
-from schemas import CommentCreate, CommentUpdate, CommentResponse
+from schemas import CommentCreate, CommentUpdate, CommentResponse, CommentThreadResponse
 
 router = APIRouter(
     prefix="/comments",
@@ -32,130 +40,435 @@ def get_db():
 
 
 db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
-post_dependency = Annotated[dict, Depends(get_post)]
+
+
+def get_comment_sessions(db: db_dependency):
+    """Dependency that provides the comment shard sessions.
+
+    :return: A generator that yields the shard sessions; unsharded, every shard is ``db``.
+    """
+    with comment_sessions(db) as sessions:
+        yield sessions
+
+
+shards_dependency = Annotated[ShardSessions, Depends(get_comment_sessions)]
+user_dependency = Annotated[dict, Depends(policy.authenticated)]
+create_comment_guard = idempotency.guard("create_comment", get_db, get_current_user)
+idempotency_dependency = Annotated[Optional[idempotency.IdempotentRequest], Depends(create_comment_guard)]
+
+SEGMENT_WIDTH = 10
+MAX_DEPTH = 20
+
+
+def path_segment(comment_id: int) -> str:
+    """Return the materialized-path segment of a comment.
+
+    Segments are fixed-width so that sorting by path yields a depth-first walk of
+    each thread and a whole subtree is the index range ``[path, path + ":")``.
+    """
+    return f"{comment_id:0{SEGMENT_WIDTH}d}"
+
+
+def subtree(column, path):
+    """Build the predicate matching ``path`` and all of its descendants."""
+    return and_(column >= path, column < path + ":")
+
+
+def post_is_visible(db: Session, user: dict, post_id: int) -> bool:
+    """Return True if the post exists and ``user`` may read it, and so its comments."""
+    return db.query(Post.id).filter(Post.id == post_id, policy.visible_posts(user)).first() is not None
+
+
+def post_access(db: Session, post_id: int) -> Optional[tuple[int, bool]]:
+    """Return the owner and published flag of a live post, for :func:`policy.can_read_post`."""
+    row = db.query(Post.owner_id, Post.published).filter(Post.id == post_id, Post.deleted_at.is_(None)).first()
+    return None if row is None else (row.owner_id, row.published)
+
+
+def build_tree(comments: list[Comment]) -> list[dict]:
+    """Nest comments sorted by path under their parents.
+
+    Comments whose parent is not part of ``comments`` become roots.
+
+    :param comments: The comments, sorted by path.
+
+    :return: The top-level comments with their ``replies``.
+    """
+    nodes = {}
+    roots = []
+    for comment in comments:
+        node = CommentThreadResponse.model_validate(comment).model_dump(mode="json")
+        nodes[comment.id] = node
+        parent = nodes.get(comment.parent_id)
+        if parent is None:
+            roots.append(node)
+        else:
+            parent["replies"].append(node)
+    return roots
+
+
+comment_reads = singleflight.Group("comments")
+thread_reads = singleflight.Group("threads")
+
+
+def detached(func: Callable, db: Session, shards: ShardSessions, *args):
+    """Run ``func(db, shards, *args)`` in sessions of its own, on the same databases as ``db`` and ``shards``.
+
+    Shared reads use this: a flight keeps running for the other requests when the
+    client that started it disconnects, after that request's sessions are closed.
+    """
+    with Session(bind=db.get_bind()) as own_db, comment_sessions(own_db, shards.shards) as own_shards:
+        return func(own_db, own_shards, *args)
+
+
+def check_before_loading(db: Session, user: dict, post_id: int, target: Optional[cache.ReadCache],
+                         variant: tuple, flights: singleflight.Group):
+    """Check that ``user`` may read the post before a page query is started for them.
+
+    Pages served from the cache, or by joining a flight already running, are checked
+    against the post access they carry instead, so this costs a query only when the
+    request would start a page query itself.
+
+    :raises HTTPException: If the post is not found or not visible to ``user``.
+    """
+    if target is not None and target.get(post_id, variant) is not cache.MISSING:
+        return
+    if flights.running((post_id, variant)):
+        return
+    if not post_is_visible(db, user, post_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+
+def read_comments(db: Session, shards: ShardSessions, post_id: int, limit: int, skip: int,
+                  since: Optional[datetime] = None) -> Optional[tuple]:
+    """Load a page of a post's comments as plain data that concurrent requests and the cache can share.
+
+    :return: The :func:`post_access` of the post and its comments, or None if the post is not found.
+    """
+    access = post_access(db, post_id)
+    if access is None:
+        return None
+    query = shards.for_post(post_id).query(Comment).filter(Comment.post_id == post_id, Comment.deleted_at.is_(None))
+    if since is not None:
+        query = query.filter(Comment.created_at >= since)
+    comments = query.order_by(Comment.created_at, Comment.id).offset(skip).limit(limit).all()
+    return access, [CommentResponse.model_validate(comment).model_dump(mode="json") for comment in comments]
 
 
 @router.get("/", response_model=list[CommentResponse], status_code=status.HTTP_200_OK)
-async def get_comments(post_id: int, user: user_dependency, db: db_dependency, limit: int = 10, skip: int = 0):
-    """Retrieve comments for a specific post.
+async def get_comments(post_id: int, user: user_dependency, db: db_dependency, shards: shards_dependency,
+                       limit: int = 10, skip: int = 0, since: Optional[datetime] = None):
+    """Retrieve comments for a specific post, oldest first.
+
+    Comments are listed from the ``(post_id, created_at)`` index, so ``since`` is an
+    index range scan. The default first page is served from this worker's cache
+    when possible, and concurrent requests for the same page share one query; each
+    request then applies the access policy of the post to the result. A request that
+    would start the query checks the policy first; see :func:`check_before_loading`.
 
     :param post_id: The ID of the post.
     :param user: The current authenticated user.
     :param db: The database session.
+    :param shards: The comment shard sessions.
     :param limit: The maximum number of comments to return (default is 10).
     :param skip: The number of comments to skip (default is 0).
+    :param since: Only return comments created at or after this time; without an offset it is taken as UTC.
 
     :raises HTTPException: If the user is not authenticated or the post is not found.
 
     :return: A list of comments related to the post.
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
+    if (limit, skip) == cache.COMMENT_PAGE and since is None:
+        check_before_loading(db, user, post_id, cache.comment_pages, cache.COMMENT_PAGE, comment_reads)
+        page = await cache.comment_pages.get_or_load(post_id, cache.COMMENT_PAGE, comment_reads, detached,
+                                                     read_comments, db, shards, post_id, *cache.COMMENT_PAGE)
+    else:
+        since = None if since is None else as_utc(since)
+        check_before_loading(db, user, post_id, None, (limit, skip, since), comment_reads)
+        page = await comment_reads.do((post_id, (limit, skip, since)), detached, read_comments,
+                                      db, shards, post_id, limit, skip, since)
+    if page is None or not policy.can_read_post(user, *page[0]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    return page[1]
+
+
+def read_threads(db: Session, shards: ShardSessions, post_id: int, limit: int, skip: int, replies: int,
+                 max_depth: int) -> Optional[tuple]:
+    """Load the threads of a post in one query; see :func:`get_threads`.
+
+    :return: The :func:`post_access` of the post and its threads, or None if the post is not found.
+    """
+    access = post_access(db, post_id)
+    if access is None:
+        return None
+
+    roots = (
+        select(Comment.path)
+        .where(Comment.post_id == post_id, Comment.parent_id.is_(None), Comment.deleted_at.is_(None))
+        .order_by(Comment.id)
+        .offset(skip)
+        .limit(limit)
+        .cte("roots")
+    )
+    ranked = (
+        select(
+            Comment,
+            func.row_number().over(
+                partition_by=func.substr(Comment.path, 1, SEGMENT_WIDTH), order_by=Comment.path
+            ).label("position"),
+        )
+        .join(roots, subtree(Comment.path, roots.c.path))
+        .where(Comment.depth <= max_depth, Comment.deleted_at.is_(None))
+        .subquery()
+    )
+    thread_comment = aliased(Comment, ranked)
+    comments = (
+        shards.for_post(post_id).query(thread_comment)
+        .filter(ranked.c.position <= replies + 1)
+        .order_by(ranked.c.path)
+        .all()
+    )
+    return access, build_tree(comments)
+
+
+@router.get("/threads", response_model=list[CommentThreadResponse], status_code=status.HTTP_200_OK)
+async def get_threads(post_id: int, user: user_dependency, db: db_dependency, shards: shards_dependency,
+                      limit: int = 10, skip: int = 0,
+                      replies: int = Query(3, ge=0), max_depth: int = Query(3, ge=0, le=MAX_DEPTH)):
+    """Retrieve the top-level threads of a post, each with its first replies.
+
+    Threads and replies are loaded in a single query: the roots are selected in a
+    CTE, their subtrees are matched by path range and a window function keeps the
+    first ``replies`` comments of each thread in depth-first order. The default first
+    page is cached like that of :func:`get_comments`, and concurrent requests for the same
+    page share that query and apply the access policy to its result; the request that
+    starts the query checks the policy before it.
+
+    :param post_id: The ID of the post.
+    :param user: The current authenticated user.
+    :param db: The database session.
+    :param shards: The comment shard sessions.
+    :param limit: The maximum number of threads to return (default is 10).
+    :param skip: The number of threads to skip (default is 0).
+    :param replies: The maximum number of replies per thread (default is 3).
+    :param max_depth: The maximum reply depth (default is 3).
 
-    db_post = db.query(Post).filter(Post.id == post_id).first()
-    if db_post is None:
+    :raises HTTPException: If the user is not authenticated or the post is not found.
+
+    :return: The threads with nested replies.
+    """
+    variant = (limit, skip, replies, max_depth)
+    if variant == cache.THREAD_PAGE:
+        check_before_loading(db, user, post_id, cache.thread_pages, variant, thread_reads)
+        page = await cache.thread_pages.get_or_load(post_id, variant, thread_reads, detached, read_threads,
+                                                    db, shards, post_id, *variant)
+    else:
+        check_before_loading(db, user, post_id, None, variant, thread_reads)
+        page = await thread_reads.do((post_id, variant), detached, read_threads, db, shards, post_id, *variant)
+    if page is None or not policy.can_read_post(user, *page[0]):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    return page[1]
+
+
+@router.get("/{comment_id}/thread", response_model=CommentThreadResponse, status_code=status.HTTP_200_OK)
+async def get_thread(comment_id: int, user: user_dependency, db: db_dependency, shards: shards_dependency,
+                     max_depth: int = Query(3, ge=0, le=MAX_DEPTH), limit: int = Query(500, ge=1, le=5000)):
+    """Retrieve a comment and its replies as a nested tree.
+
+    The whole subtree is one index range scan on ``path``.
+
+    :param comment_id: The ID of the comment at the top of the subtree.
+    :param user: The current authenticated user.
+    :param db: The database session.
+    :param shards: The comment shard sessions.
+    :param max_depth: The maximum depth below the comment (default is 3).
+    :param limit: The maximum number of comments to load (default is 500).
+
+    :raises HTTPException: If the user is not authenticated or the comment is not found.
 
-    comments = db.query(Comment).filter(Comment.post_id == post_id).offset(skip).limit(limit).all()
-    return comments
+    :return: The comment with nested replies.
+    """
+    comment_db = shards.locate(comment_id)
+    if comment_db is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
+
+    top = (
+        select(Comment.path, Comment.depth)
+        .where(Comment.id == comment_id, Comment.deleted_at.is_(None))
+        .cte("top")
+    )
+    comments = (
+        comment_db.query(Comment)
+        .join(top, subtree(Comment.path, top.c.path))
+        .filter(Comment.depth <= top.c.depth + max_depth, Comment.deleted_at.is_(None))
+        .order_by(Comment.path)
+        .limit(limit)
+        .all()
+    )
+    if not comments or not post_is_visible(db, user, comments[0].post_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
+
+    return build_tree(comments)[0]
 
 
 @router.get("/{comment_id}", response_model=CommentResponse, status_code=status.HTTP_200_OK)
-async def get_comment(comment_id: int, user: user_dependency, db: db_dependency):
+async def get_comment(comment_id: int, user: user_dependency, db: db_dependency, shards: shards_dependency):
     """Retrieve a specific comment by its ID.
 
     :param comment_id: The ID of the comment.
     :param user: The current authenticated user.
     :param db: The database session.
+    :param shards: The comment shard sessions.
 
     :raises HTTPException: If the user is not authenticated or the comment is not found.
 
     :return: The requested comment.
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
-    db_comment = db.query(Comment).filter(Comment.id == comment_id).first()
-    if db_comment is None:
+    comment_db = shards.locate(comment_id)
+    db_comment = None
+    if comment_db is not None:
+        db_comment = comment_db.query(Comment).filter(Comment.id == comment_id, Comment.deleted_at.is_(None)).first()
+    if db_comment is None or not post_is_visible(db, user, db_comment.post_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
 
     return db_comment
 
 
-@router.post("/create_comment", response_model=CommentResponse, status_code=status.HTTP_201_CREATED)
-async def create_comment(comment: CommentCreate, post: post_dependency, user: user_dependency, db: db_dependency):
-    """Create a new comment on a post.
+# The guard comes first, so a replayed retry is answered before it is charged against the rate limit.
+@router.post("/create_comment", response_model=CommentResponse, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(create_comment_guard), Depends(create_comment_limit.per_user(user_dependency))])
+async def create_comment(post_id: int, comment: CommentCreate, idempotent: idempotency_dependency,
+                         user: user_dependency, shards: shards_dependency):
+    """Create a new comment on a post visible to the current user.
+
+    Unsharded, the comment is inserted with ``INSERT ... SELECT`` from the post
+    filtered by the access policy, so checking the post costs no extra query.
+    With an ``Idempotency-Key`` header, a retry of a request that already
+    succeeded gets the same response back.
 
-    :param comment: The comment data to create.
-    :param post: The associated post data.
+    :param post_id: The ID of the post.
+    :param comment: The comment data to create; ``parent_id`` makes it a reply.
+    :param idempotent: The claimed idempotency key, if the request has one.
     :param user: The current authenticated user.
-    :param db: The database session.
+    :param shards: The comment shard sessions.
 
-    :raises HTTPException: If the user is not authenticated.
+    :raises HTTPException: If the user is not authenticated, the post or the parent comment is not found,
+        or the thread is too deep.
 
     :return: The created comment.
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
+    comment_db = shards.for_post(post_id)
+    parent = None
+    if comment.parent_id is not None:
+        parent = comment_db.query(Comment).filter(
+            Comment.id == comment.parent_id, Comment.post_id == post_id, Comment.deleted_at.is_(None)
+        ).first()
+        if parent is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Parent comment not found")
+        if parent.depth >= MAX_DEPTH:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Thread is too deep")
+
+    now = utcnow()
+    values = {
+        "content": comment.content,
+        "post_id": post_id,
+        "author_id": user.get("id"),
+        "parent_id": comment.parent_id,
+        "depth": parent.depth + 1 if parent else 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    comment_id = None
+    if comment_db is shards.db:
+        comment_id = comment_db.scalar(
+            policy.insert_where(Comment, values, Post.id == post_id, policy.visible_posts(user))
+        )
+    elif post_is_visible(shards.db, user, post_id):
+        values["id"] = shards.next_id(post_id)
+        comment_id = comment_db.scalar(insert(Comment).values(values).returning(Comment.id))
+    if comment_id is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
 
-    db_comment = Comment(
-        content=comment.content,
-        post_id=post.id,
-        author_id=user.get("id")
+    comment_db.execute(
+        update(Comment)
+        .where(Comment.id == comment_id)
+        .values(path=(parent.path if parent else "") + path_segment(comment_id), updated_at=now)
     )
+    created = CommentResponse(id=comment_id, content=comment.content, post_id=post_id, author_id=user.get("id"),
+                              parent_id=comment.parent_id, created_at=now, updated_at=now)
+    if idempotent is not None:
+        # Unsharded, the comment and the stored response are committed together.
+        idempotent.complete(shards.db, created)
+    comment_db.commit()
+    if idempotent is not None and shards.db is not comment_db:
+        shards.db.commit()
+    cache.comments_changed(post_id)
+    trending.record(post_id, "comment")
 
-    db.add(db_comment)
-    db.commit()
-    db.refresh(db_comment)
-
-    return db_comment
+    return created
 
 
 @router.put("/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def update_comment(comment_id: int, comment: CommentUpdate, user: user_dependency, db: db_dependency):
-    """Update an existing comment by its ID.
+async def update_comment(comment_id: int, comment: CommentUpdate, user: user_dependency, shards: shards_dependency):
+    """Update a comment of the current user by its ID with one guarded UPDATE.
 
     :param comment_id: The ID of the comment to update.
     :param comment: The updated comment data.
     :param user: The current authenticated user.
-    :param db: The database session.
+    :param shards: The comment shard sessions.
 
     :raises HTTPException: If the user is not authenticated or the comment does not exist.
 
     :return: None
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
-    db_comment = db.query(Comment).filter(Comment.id == comment_id, Comment.author_id == user.get("id")).first()
-    if db_comment is None:
+    comment_db = shards.locate(comment_id)
+    post_id = None
+    if comment_db is not None:
+        post_id = comment_db.scalar(
+            update(Comment)
+            .where(Comment.id == comment_id, policy.editable_comments(user))
+            .values(content=comment.content)
+            .returning(Comment.post_id)
+            .execution_options(synchronize_session=False)
+        )
+    if post_id is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
-
-    db_comment.content = comment.content
-
-    db.commit()
-    db.refresh(db_comment)
+    comment_db.commit()
+    cache.comments_changed(post_id)
 
 
 @router.delete("/{comment_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_comment(comment_id: int, user: user_dependency, db: db_dependency):
-    """Delete a specific comment by its ID.
+async def delete_comment(comment_id: int, user: user_dependency, shards: shards_dependency):
+    """Delete a comment of the current user by its ID, together with its replies.
+
+    One UPDATE soft-deletes the subtree below the comment's path, found by a subquery
+    that applies the access policy.
 
     :param comment_id: The ID of the comment to delete.
     :param user: The current authenticated user.
-    :param db: The database session.
+    :param shards: The comment shard sessions.
 
     :raises HTTPException: If the user is not authenticated or the comment does not exist.
 
     :return: None
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
-    db_comment = db.query(Comment).filter(Comment.id == comment_id, Comment.author_id == user.get("id")).first()
-    if db_comment is None:
+    comment_db = shards.locate(comment_id)
+    post_ids = []
+    if comment_db is not None:
+        target = (
+            select(Comment.path)
+            .where(Comment.id == comment_id, policy.editable_comments(user))
+            .correlate_except(Comment)
+            .scalar_subquery()
+        )
+        post_ids = comment_db.scalars(
+            update(Comment)
+            .where(subtree(Comment.path, target), Comment.deleted_at.is_(None))
+            .values(deleted_at=utcnow())
+            .returning(Comment.post_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+    if not post_ids:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Comment not found")
-
-    db.delete(db_comment)
-    db.commit()
+    comment_db.commit()
+    cache.comments_changed(post_ids[0])
@@ -1,16 +1,28 @@
 """
 Posts router.
 """
-from typing import Annotated, Optional
+from datetime import datetime, timezone
+from typing import Annotated, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select, update
 from sqlalchemy.orm import Session
 from starlette import status
 
+import cache
+import idempotency
+import jobs
+import policy
+import revisions
+import singleflight
+import tagging
+import trending
 from database import SessionLocal
-from models import Post
+from models import Post, PostRevision, Tag, as_utc, post_tags, utcnow
+from ratelimit import create_post_limit
 from routers.auth import get_current_user
-from schemas import PostRequest, PostResponse, UpdatePostRequest
+from schemas import (HotPostResponse, PostRequest, PostResponse, PostPartialResponse, PostRevisionResponse,
+                     PostVersionResponse, UpdatePostRequest)
 
 router = APIRouter(
     prefix="/posts",
@@ -31,40 +43,181 @@ def get_db():
 
 
 db_dependency = Annotated[Session, Depends(get_db)]
-user_dependency = Annotated[dict, Depends(get_current_user)]
+user_dependency = Annotated[dict, Depends(policy.authenticated)]
+create_post_guard = idempotency.guard("create_post", get_db, get_current_user)
+idempotency_dependency = Annotated[Optional[idempotency.IdempotentRequest], Depends(create_post_guard)]
 
+EXCERPT_LENGTH = 200
+# Tag filters matching at most this many posts in total are sent as an ID list.
+TAG_INLINE_IDS = 500
 
-@router.get("/", response_model=list[PostResponse], status_code=status.HTTP_200_OK)
-async def get_posts(user: user_dependency, db: db_dependency, limit: int = 10, skip: int = 0, search: Optional[str] = ""):
-    """Retrieve a list of posts for the current user.
+POST_COLUMNS = {
+    "id": Post.id,
+    "title": Post.title,
+    "content": Post.content,
+    "excerpt": func.substr(Post.content, 1, EXCERPT_LENGTH).label("excerpt"),
+    "published": Post.published,
+    "owner_id": Post.owner_id,
+    "view_count": Post.view_count,
+    "created_at": Post.created_at,
+    "updated_at": Post.updated_at,
+}
+
+SUMMARY_FIELDS = ("id", "title", "excerpt", "published", "owner_id")
+
+
+def select_post_columns(view: str, fields: Optional[str]) -> list:
+    """Resolve the ``view``/``fields`` query parameters into SQL columns.
+
+    :param view: ``"full"`` or ``"summary"``.
+    :param fields: An optional comma-separated list of column names; takes precedence over ``view``.
+
+    :raises HTTPException: If an unknown field is requested.
+
+    :return: The columns to select.
+    """
+    if fields:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in names if name not in POST_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=f"Unknown fields: {', '.join(unknown)}")
+    elif view == "summary":
+        names = SUMMARY_FIELDS
+    else:
+        names = [name for name in POST_COLUMNS if name not in ("excerpt", "view_count")]
+    return [POST_COLUMNS[name] for name in dict.fromkeys(names)]
+
+
+def tag_filter(db: Session, names: list[str], match: str):
+    """Build the predicate selecting posts with any or all of the tags.
+
+    Rare tags are resolved by the in-memory tag index into a short list of post IDs.
+    Otherwise each of the owner's posts, walked in time order, is checked against the
+    ``post_tags`` primary key, so the cost depends on the owner's posts rather than
+    on how many posts of all users carry the tag.
+
+    :param db: The database session used for cold tags.
+    :param names: The normalised tag names.
+    :param match: ``any`` for posts with at least one of the tags, ``all`` for posts with every tag.
+
+    :return: The SQL predicate.
+    """
+    postings = [tagging.index.postings(db, name) for name in names]
+    sizes = [len(posting) for posting in postings]
+    if (min(sizes) if match == "all" else sum(sizes)) <= TAG_INLINE_IDS:
+        post_ids = tagging.intersect(postings) if match == "all" else tagging.union(postings)
+        return Post.id.in_(post_ids.tolist())
+
+    tagged = select(post_tags.c.post_id).where(
+        post_tags.c.post_id == Post.id, post_tags.c.tag_id.in_(select(Tag.id).where(Tag.name.in_(names)))
+    )
+    if match == "any":
+        return tagged.exists()
+    return tagged.with_only_columns(func.count()).scalar_subquery() == len(names)
+
+
+@router.get("/", response_model=list[PostPartialResponse], response_model_exclude_unset=True,
+            status_code=status.HTTP_200_OK)
+async def get_posts(user: user_dependency, db: db_dependency, limit: int = 10, skip: int = 0, search: Optional[str] = "",
+                    view: Literal["full", "summary"] = "full", fields: Optional[str] = None,
+                    tags: Optional[list[str]] = Query(default=None), match: Literal["any", "all"] = "any",
+                    since: Optional[datetime] = None):
+    """Retrieve a list of posts for the current user, oldest first.
+
+    Posts are listed by creation time from the ``(owner_id, created_at)`` index, so
+    ``since`` is an index range scan and no sort is needed.
+
+    Only the requested columns are selected from the database: ``view=summary`` returns
+    a short ``excerpt`` instead of the full content, and ``fields=id,title`` returns exactly those columns.
+
+    With ``tags``, the filter is part of the same query; see :func:`tag_filter`.
 
     :param user: The current authenticated user.
     :param db: The database session.
     :param limit: The maximum number of posts to return (default is 10).
     :param skip: The number of posts to skip (default is 0).
     :param search: An optional search term to filter posts by title.
+    :param view: ``full`` (default) for complete posts or ``summary`` for an excerpt.
+    :param fields: An optional comma-separated list of columns to return.
+    :param tags: Optional tags to filter by; repeat the parameter for several tags.
+    :param match: ``any`` (default) for posts with at least one of the tags, ``all`` for posts with every tag.
+    :param since: Only return posts created at or after this time; without an offset it is taken as UTC.
 
     :raises HTTPException: If the user is not authenticated.
 
     :return: A list of posts owned by the current user.
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
-    query = db.query(Post).filter(Post.owner_id == user.get("id"))
+    columns = select_post_columns(view, fields)
+    query = db.query(*columns).filter(Post.owner_id == user.get("id"), Post.deleted_at.is_(None))
 
     if search:
         query = query.filter(Post.title.contains(search))
+    if since is not None:
+        query = query.filter(Post.created_at >= as_utc(since))
+
+    if tags:
+        query = query.filter(tag_filter(db, tagging.normalize_all(tags), match))
+
+    rows = query.order_by(Post.created_at, Post.id).offset(skip).limit(limit).all()
+    return [row._asdict() for row in rows]
+
+
+@router.get("/hot", response_model=list[HotPostResponse], status_code=status.HTTP_200_OK)
+async def get_hot_posts(user: user_dependency, db: db_dependency, limit: int = Query(10, ge=1, le=100),
+                        skip: int = Query(0, ge=0)):
+    """Retrieve the published posts with the highest time-decayed popularity.
+
+    The ranking is kept in memory by :mod:`trending`, so only the returned posts are read from the database.
+
+    :param user: The current authenticated user.
+    :param db: The database session.
+    :param limit: The maximum number of posts to return (default is 10).
+    :param skip: The number of posts to skip (default is 0).
+
+    :raises HTTPException: If the user is not authenticated.
+
+    :return: The posts, hottest first, with their current score.
+    """
+    if not trending.ranking.loaded:
+        trending.refill(db)
+
+    ranked = trending.ranking.top(limit, skip)
+    rows = db.query(Post.id, Post.title, Post.owner_id, Post.view_count).filter(
+        Post.id.in_([post_id for post_id, _ in ranked]), Post.published.is_(True), Post.deleted_at.is_(None)
+    ).all()
+    posts_by_id = {row.id: row for row in rows}
+    now = datetime.now(timezone.utc).timestamp()
+    return [
+        {**posts_by_id[post_id]._asdict(), "score": trending.current_score(score, now)}
+        for post_id, score in ranked
+        if post_id in posts_by_id
+    ]
+
+
+post_reads = singleflight.Group("posts")
 
-    posts = query.offset(skip).limit(limit).all()
-    return posts
+
+def read_post(db: Session, post_id: int) -> Optional[dict]:
+    """Load a live post as plain data that concurrent requests and the cache can share."""
+    post_model = db.query(Post).filter(Post.id == post_id, Post.deleted_at.is_(None)).first()
+    return None if post_model is None else PostResponse.model_validate(post_model).model_dump(mode="json")
+
+
+def read_post_detached(bind, post_id: int) -> Optional[dict]:
+    """Run :func:`read_post` in a session of its own, as a shared read can outlive the request that started it."""
+    with Session(bind=bind) as db:
+        return read_post(db, post_id)
 
 
 @router.get("/{post_id}", response_model=PostResponse, status_code=status.HTTP_200_OK)
 async def get_post(post_id: int, user: user_dependency, db: db_dependency):
-    """Retrieve a specific post by its ID.
+    """Retrieve a post visible to the current user by its ID and count the view.
 
-    :param post_id: The ID of the post to retrieve.
+    The post is served from this worker's cache when possible, and concurrent requests
+    that miss it share one query; each request then applies the access policy to the result.
+
+    :param post_id: The ID of the post.
     :param user: The current authenticated user.
     :param db: The database session.
 
@@ -72,20 +225,23 @@ async def get_post(post_id: int, user: user_dependency, db: db_dependency):
 
     :return: The requested post.
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
-    post_model = db.query(Post).filter(Post.id == post_id, Post.owner_id == user.get("id")).first()
-
-    if post_model is not None:
-        return post_model
-    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    post = await cache.posts.get_or_load(post_id, None, post_reads, read_post_detached, db.get_bind(), post_id)
+    if post is None or not policy.can_read_post(user, post["owner_id"], post["published"]):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    trending.record(post_id, "view")
+    return post
 
 
-@router.post("/create_post", response_model=PostResponse, status_code=status.HTTP_201_CREATED)
-async def create_post(create_post_request: PostRequest, user: user_dependency, db: db_dependency):
+# The guard comes first, so a replayed retry is answered before it is charged against the rate limit.
+@router.post("/create_post", response_model=PostResponse, status_code=status.HTTP_201_CREATED,
+             dependencies=[Depends(create_post_guard), Depends(create_post_limit.per_user(user_dependency))])
+async def create_post(idempotent: idempotency_dependency, create_post_request: PostRequest, user: user_dependency,
+                      db: db_dependency):
     """Create a new post for the current user.
 
+    With an ``Idempotency-Key`` header, a retry of a request that already succeeded gets the same response back.
+
+    :param idempotent: The claimed idempotency key, if the request has one.
     :param create_post_request: The request object containing the new post's details.
     :param user: The current authenticated user.
     :param db: The database session.
@@ -94,29 +250,52 @@ async def create_post(create_post_request: PostRequest, user: user_dependency, d
 
     :return: The created post.
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
     db_post = Post(
         title=create_post_request.title,
         content=create_post_request.content,
         published=create_post_request.published,
-        owner_id=user.get("id")
+        owner_id=user.get("id"),
+        hot_score=trending.event_score("post"),
     )
 
     db.add(db_post)
+    db.flush()
+    revisions.record(db, db_post)
+    added, removed = tagging.set_post_tags(db, db_post, create_post_request.tags or ())
+    if idempotent is not None:
+        idempotent.complete(db, PostResponse.model_validate(db_post))
     db.commit()
+    tagging.index.apply(db_post.id, added, removed)
     db.refresh(db_post)
+    if db_post.published:
+        trending.publish_scores({db_post.id: db_post.hot_score})
 
     return db_post
 
 
+def apply_update(db: Session, db_post: Post, title: str, content: str, published: Optional[bool]):
+    """Update a post's fields and record the change as a new revision.
+
+    :param db: The database session.
+    :param db_post: The post to update.
+    :param title: The new title.
+    :param content: The new content.
+    :param published: The new published flag.
+    """
+    previous = revisions.document(db_post)
+    db_post.title = title
+    db_post.content = content
+    db_post.published = published
+    if revisions.document(db_post) != previous:
+        revisions.record(db, db_post, previous)
+
+
 @router.put("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def update_post(post_id: int, post: UpdatePostRequest, user: user_dependency, db: db_dependency):
     """Update an existing post by its ID.
 
     :param post_id: The ID of the post to update.
-    :param post: The updated post data.
+    :param post: The updated post data; ``tags`` replaces the post's tags unless omitted.
     :param user: The current authenticated user.
     :param db: The database session.
 
@@ -124,25 +303,28 @@ async def update_post(post_id: int, post: UpdatePostRequest, user: user_dependen
 
     :return: None
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
-
-    db_post = db.query(Post).filter(Post.id == post_id, Post.owner_id == user.get("id")).first()
+    db_post = db.query(Post).filter(Post.id == post_id, policy.editable_posts(user)).first()
     if db_post is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
 
-    db_post.title = post.title
-    db_post.content = post.content
-    db_post.published = post.published
-
+    apply_update(db, db_post, post.title, post.content, post.published)
+    added, removed = (), ()
+    if post.tags is not None:
+        added, removed = tagging.set_post_tags(db, db_post, post.tags)
     db.commit()
-    db.refresh(db_post)
+    tagging.index.apply(post_id, added, removed)
+    cache.post_changed(post_id)
+    if not db_post.published:
+        trending.remove(post_id)
 
 
 @router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_post(post_id: int, user: user_dependency, db: db_dependency):
     """Delete a specific post by its ID.
 
+    The post is soft-deleted and hidden immediately by one guarded UPDATE; a ``purge_post``
+    job removes it and its comments in the background.
+
     :param post_id: The ID of the post to delete.
     :param user: The current authenticated user.
     :param db: The database session.
@@ -151,12 +333,94 @@ async def delete_post(post_id: int, user: user_dependency, db: db_dependency):
 
     :return: None
     """
-    if user is None:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
+    deleted = db.execute(
+        update(Post)
+        .where(Post.id == post_id, policy.editable_posts(user))
+        .values(deleted_at=utcnow())
+    ).rowcount
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+    jobs.enqueue(db, "purge_post", {"post_id": post_id}, key=f"purge_post:{post_id}")
+    db.commit()
+    cache.post_changed(post_id)
+    trending.remove(post_id)
+
+
+@router.get("/{post_id}/revisions", response_model=list[PostRevisionResponse], status_code=status.HTTP_200_OK)
+async def get_revisions(post_id: int, user: user_dependency, db: db_dependency, limit: int = 50, skip: int = 0):
+    """List the stored revisions of a post, newest first.
+
+    :param post_id: The ID of the post.
+    :param user: The current authenticated user.
+    :param db: The database session.
+    :param limit: The maximum number of revisions to return (default is 50).
+    :param skip: The number of revisions to skip (default is 0).
+
+    :raises HTTPException: If the user is not authenticated or the post is not found.
+
+    :return: The revisions with their stored size in bytes.
+    """
+    if db.query(Post.id).filter(Post.id == post_id, policy.editable_posts(user)).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+
+    rows = (
+        db.query(PostRevision.version, PostRevision.is_snapshot, func.length(PostRevision.data).label("size"),
+                 PostRevision.created_at)
+        .filter(PostRevision.post_id == post_id)
+        .order_by(PostRevision.version.desc())
+        .offset(skip)
+        .limit(limit)
+        .all()
+    )
+    return [row._asdict() for row in rows]
+
+
+@router.get("/{post_id}/revisions/{version}", response_model=PostVersionResponse, status_code=status.HTTP_200_OK)
+async def get_revision(post_id: int, version: int, user: user_dependency, db: db_dependency):
+    """Retrieve a post as it was at a given version.
+
+    :param post_id: The ID of the post.
+    :param version: The version number.
+    :param user: The current authenticated user.
+    :param db: The database session.
+
+    :raises HTTPException: If the user is not authenticated or the post or version is not found.
+
+    :return: The post's fields at that version.
+    """
+    if db.query(Post.id).filter(Post.id == post_id, policy.editable_posts(user)).first() is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
 
-    db_post = db.query(Post).filter(Post.id == post_id, Post.owner_id == user.get("id")).first()
+    document = revisions.reconstruct(db, post_id, version)
+    if document is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Revision not found")
+    return {"version": version, **document}
+
+
+@router.post("/{post_id}/revisions/{version}/restore", status_code=status.HTTP_204_NO_CONTENT)
+async def restore_revision(post_id: int, version: int, user: user_dependency, db: db_dependency):
+    """Restore a post to a previous version; the restore itself becomes a new revision.
+
+    :param post_id: The ID of the post.
+    :param version: The version to restore.
+    :param user: The current authenticated user.
+    :param db: The database session.
+
+    :raises HTTPException: If the user is not authenticated or the post or version is not found.
+
+    :return: None
+    """
+    db_post = db.query(Post).filter(Post.id == post_id, policy.editable_posts(user)).first()
     if db_post is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
 
-    db.delete(db_post)
+    document = revisions.reconstruct(db, post_id, version)
+    if document is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Revision not found")
+
+    apply_update(db, db_post, document["title"], document["content"], document["published"])
     db.commit()
+    cache.post_changed(post_id)
+    if not db_post.published:
+        trending.remove(post_id)
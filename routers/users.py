@@ -4,11 +4,11 @@ Users router.
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException
-from passlib.context import CryptContext
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from starlette import status
 
+import passwords
 from routers.auth import get_current_user
 from database import SessionLocal
 from models import User
@@ -33,7 +33,6 @@ def get_db():
 
 db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 
 class UserVerification(BaseModel):
@@ -78,9 +77,9 @@ async def change_password(user: user_dependency, db: db_dependency, user_verific
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Authentication Failed")
     user_model = db.query(User).filter(User.id == user.get("id")).first()
 
-    if not bcrypt_context.verify(user_verification.password, user_model.hashed_password):
+    if not passwords.verify_password(user_verification.password, user_model.hashed_password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Error on password change")
-    user_model.hashed_password = bcrypt_context.hash(user_verification.new_password)
+    user_model.hashed_password = passwords.hash_password(user_verification.new_password)
     db.add(user_model)
     db.commit()
 
@@ -1,6 +1,15 @@
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Annotated, Optional
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import AfterValidator, BaseModel, EmailStr, Field, field_validator
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+# Timestamps are stored as naive UTC; responses carry the offset.
+UTCDateTime = Annotated[datetime, AfterValidator(_as_utc)]
 
 
 class CreateSuperUserRequest(BaseModel):
@@ -22,8 +31,56 @@ class Token(BaseModel):
     token_type: str
 
 
+class BulkUsersRequest(BaseModel):
+    user_ids: list[int] = Field(min_length=1, max_length=10000)
+
+
+class BulkUsersResponse(BaseModel):
+    updated: int
+
+
+class PasswordResetResponse(BulkUsersResponse):
+    passwords: dict[int, str]
+
+
+class ActivityStatsResponse(BaseModel):
+    bucket: datetime
+    users: int = 0
+    posts: int = 0
+    comments: int = 0
+
+
+class TopAuthorResponse(BaseModel):
+    author_id: int
+    username: Optional[str] = None
+    posts: int
+    comments: int
+
+
+class CoalescingStatsResponse(BaseModel):
+    """Coalesced reads of one path in one worker; see singleflight.py."""
+    flights: int
+    absorbed: int
+    max_absorbed: int
+    in_flight: int
+    histogram: dict[str, int]
+
+
+class AttachmentResponse(BaseModel):
+    id: int
+    post_id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+    class Config:
+        from_attributes = True
+
+
 class CommentCreate(BaseModel):
     content: str = Field(min_length=1, max_length=300)
+    parent_id: Optional[int] = None
 
 
 class CommentUpdate(BaseModel):
@@ -35,24 +92,76 @@ class CommentResponse(BaseModel):
     content: str = Field(min_length=1, max_length=300)
     post_id: int = Field(gt=0)
     author_id: int = Field(gt=0)
+    parent_id: Optional[int] = None
+    created_at: Optional[UTCDateTime] = None
+    updated_at: Optional[UTCDateTime] = None
 
     class Config:
         from_attributes = True
 
 
+class CommentThreadResponse(CommentResponse):
+    depth: int = 0
+    replies: list["CommentThreadResponse"] = []
+
+
 class PostRequest(BaseModel):
     title: str = Field(min_length=1, max_length=50)
     content: str = Field(min_length=1, max_length=5000)
     published: Optional[bool] = True
+    tags: Optional[list[str]] = Field(default=None, max_length=20)
 
 
 class PostResponse(PostRequest):
     id: int
     owner_id: int
+    tags: list[str] = []
+    created_at: Optional[UTCDateTime] = None
+    updated_at: Optional[UTCDateTime] = None
+
+    @field_validator("tags", mode="before")
+    @classmethod
+    def tag_names(cls, value):
+        return [getattr(tag, "name", tag) for tag in value or ()]
 
     class Config:
         from_attributes = True
 
 
+class PostPartialResponse(BaseModel):
+    """A post restricted to the columns requested with ``fields=`` or ``view=summary``."""
+    id: Optional[int] = None
+    title: Optional[str] = None
+    content: Optional[str] = None
+    excerpt: Optional[str] = None
+    published: Optional[bool] = None
+    owner_id: Optional[int] = None
+    view_count: Optional[int] = None
+    created_at: Optional[UTCDateTime] = None
+    updated_at: Optional[UTCDateTime] = None
+
+
+class HotPostResponse(BaseModel):
+    id: int
+    title: str
+    owner_id: int
+    view_count: int
+    score: float
+
+
+class PostRevisionResponse(BaseModel):
+    version: int
+    is_snapshot: bool
+    size: int
+    created_at: Optional[UTCDateTime] = None
+
+
+class PostVersionResponse(BaseModel):
+    version: int
+    title: str
+    content: str
+    published: Optional[bool] = True
+
+
 class UpdatePostRequest(PostRequest):
     ...
@@ -0,0 +1,77 @@
+"""
+Multi-worker server entry point.
+
+Starts the shared-state broker, then serves ``main:app`` with one worker per
+CPU core. Gunicorn (with uvicorn workers) is used when installed so the app
+can be preloaded once and forked; otherwise uvicorn's own process manager is
+used.
+
+Usage::
+
+    python server.py --workers 4 --port 8000
+"""
+import argparse
+import importlib
+import os
+
+import shared_state
+
+
+def default_workers() -> int:
+    """Return one worker per core available to this process."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_gunicorn(host: str, port: int, workers: int, preload: bool, app: str = "main:app"):
+    """Serve with gunicorn and uvicorn workers."""
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            self.cfg.set("preload_app", preload)
+            self.cfg.set("graceful_timeout", 10)
+
+        def load(self):
+            module, attribute = app.split(":")
+            return getattr(importlib.import_module(module), attribute)
+
+    Application().run()
+
+
+def run_uvicorn(host: str, port: int, workers: int, app: str = "main:app"):
+    """Serve with uvicorn's process manager; each worker imports the app itself."""
+    import uvicorn
+
+    uvicorn.run(app, host=host, port=port, workers=workers, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the blog API with several worker processes.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Import the app in every worker instead of once before forking.")
+    parser.add_argument("--app", default="main:app",
+                        help="The application as module:attribute, e.g. benchmarks.chaos:app for soak tests.")
+    args = parser.parse_args()
+
+    broker = shared_state.start_broker()
+    try:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            run_uvicorn(args.host, args.port, args.workers, args.app)
+        else:
+            run_gunicorn(args.host, args.port, args.workers, args.preload, args.app)
+    finally:
+        broker.shutdown()
+
+
+if __name__ == "__main__":
+    main()
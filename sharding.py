@@ -0,0 +1,307 @@
+"""
+Comment shards.
+
+Comments can be partitioned over several SQLite files, so that writes to
+comments on different posts take different write locks. A post's comments
+(and therefore whole threads) always live in one shard, chosen by a jump
+consistent hash of ``post_id``: growing from N to M shards only moves the
+posts that hash to the new shards.
+
+``COMMENT_SHARDS`` sets the number of shards. With the default of 1, comments
+stay in the main database and nothing changes. With more, shard ``i`` is
+``COMMENT_SHARD_URL`` formatted with ``shard=i``. Shards hold the ``comments``
+table only, so foreign keys to posts and users are not enforced there, and
+each shard allocates comment IDs from its own sequence, interleaved with the
+other shards so they stay globally unique.
+
+After changing ``COMMENT_SHARDS``, stop the server and move the comments with::
+
+    python sharding.py --from-shards 1 --to-shards 4
+"""
+import argparse
+import os
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from sqlalchemy import (Column, Integer, MetaData, Table, create_engine, delete, event, func, inspect, select, text,
+                        update)
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import SessionLocal, set_sqlite_pragmas
+from models import Comment
+
+DEFAULT_SHARD_URL = "sqlite:///./blogapp-comments-{shard}.db"
+# Comment IDs are ``sequence * ID_STRIDE + shard``, so up to ID_STRIDE shards never collide.
+ID_STRIDE = 64
+MOVE_BATCH_SIZE = 1000
+
+shard_metadata = MetaData()
+
+comment_sequence = Table(
+    "comment_sequence",
+    shard_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("next_value", Integer, nullable=False),
+)
+
+
+def upgrade_shard(engine):
+    """Bring the ``comments`` table of a shard created by an older version up to the model.
+
+    Shards are not managed by the migrations, so columns and indexes added to
+    comments since are added here when the shard is opened.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("comments")}
+    if "updated_at" not in columns:
+        with engine.begin() as connection:
+            # SQLite cannot add a column with a non-constant default; the model sets it on every write.
+            connection.execute(text("ALTER TABLE comments ADD COLUMN updated_at DATETIME"))
+            connection.execute(text("UPDATE comments SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)"))
+    for index in Comment.__table__.indexes:
+        index.create(engine, checkfirst=True)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Map ``key`` to one of ``buckets`` with Lamping and Veach's jump consistent hash.
+
+    :param key: A non-negative integer key.
+    :param buckets: The number of buckets.
+
+    :return: The bucket index in ``range(buckets)``.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+class CommentShards:
+    """A layout of comment shards.
+
+    :param count: The number of shards; 1 keeps comments in the main database.
+    :param url: The shard URL template, formatted with ``shard=i``.
+    """
+
+    def __init__(self, count: int = 1, url: str = DEFAULT_SHARD_URL):
+        if not 1 <= count <= ID_STRIDE:
+            raise ValueError(f"The number of comment shards must be between 1 and {ID_STRIDE}")
+        self.count = count
+        self.url = url
+        self._factories: dict[int, sessionmaker] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def sharded(self) -> bool:
+        """Whether comments live outside the main database."""
+        return self.count > 1
+
+    def shard_for(self, post_id: int) -> int:
+        """Return the shard holding the comments of a post."""
+        return jump_hash(post_id, self.count)
+
+    def shard_url(self, shard: int) -> str:
+        """Return the database URL of a shard."""
+        return self.url.format(shard=shard)
+
+    def session_factory(self, shard: int) -> sessionmaker:
+        """Return the session factory of a shard, creating its engine and schema on first use."""
+        with self._lock:
+            factory = self._factories.get(shard)
+            if factory is None:
+                engine = create_engine(self.shard_url(shard), connect_args={"check_same_thread": False})
+                event.listen(engine, "connect", set_sqlite_pragmas)
+                Comment.__table__.create(engine, checkfirst=True)
+                upgrade_shard(engine)
+                shard_metadata.create_all(engine)
+                with engine.begin() as connection:
+                    connection.execute(
+                        insert(comment_sequence).values(id=0, next_value=1).on_conflict_do_nothing()
+                    )
+                factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+                self._factories[shard] = factory
+            return factory
+
+    def dispose(self):
+        """Close the connection pools of all shards."""
+        with self._lock:
+            for factory in self._factories.values():
+                factory.kw["bind"].dispose()
+            self._factories.clear()
+
+
+class ShardSessions:
+    """The comment sessions of one request or job, opened on demand.
+
+    Unsharded, every shard is the main database session ``db``.
+
+    :param shards: The shard layout.
+    :param db: The main database session.
+    """
+
+    def __init__(self, shards: CommentShards, db: Session):
+        self.shards = shards
+        self.db = db
+        self._sessions: dict[int, Session] = {}
+
+    def shard(self, shard: int) -> Session:
+        """Return the session of a shard."""
+        if not self.shards.sharded:
+            return self.db
+        session = self._sessions.get(shard)
+        if session is None:
+            session = self._sessions[shard] = self.shards.session_factory(shard)()
+        return session
+
+    def for_post(self, post_id: int) -> Session:
+        """Return the session holding the comments of a post."""
+        return self.shard(self.shards.shard_for(post_id))
+
+    def all(self) -> list[Session]:
+        """Return the sessions of every shard."""
+        return [self.shard(shard) for shard in range(self.shards.count)]
+
+    def locate(self, comment_id: int) -> Optional[Session]:
+        """Return the session of the shard holding a comment, or None if no shard has it.
+
+        Unsharded this is the main session, without a query.
+        """
+        if not self.shards.sharded:
+            return self.db
+        preferred = comment_id % ID_STRIDE
+        order = sorted(range(self.shards.count), key=lambda shard: shard != preferred)
+        for shard in order:
+            session = self.shard(shard)
+            if session.scalar(select(Comment.id).where(Comment.id == comment_id)) is not None:
+                return session
+        return None
+
+    def next_id(self, post_id: int) -> Optional[int]:
+        """Allocate a comment ID in the shard of a post, within that shard's transaction.
+
+        :return: The new ID, or None when unsharded and the database assigns it.
+        """
+        if not self.shards.sharded:
+            return None
+        shard = self.shards.shard_for(post_id)
+        sequence = self.shard(shard).scalar(
+            update(comment_sequence)
+            .where(comment_sequence.c.id == 0)
+            .values(next_value=comment_sequence.c.next_value + 1)
+            .returning(comment_sequence.c.next_value - 1)
+        )
+        return sequence * ID_STRIDE + shard
+
+    def close(self):
+        """Close the shard sessions; the main session is left to its owner."""
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+
+comment_shards = CommentShards(int(os.getenv("COMMENT_SHARDS", "1")), os.getenv("COMMENT_SHARD_URL", DEFAULT_SHARD_URL))
+
+
+@contextmanager
+def comment_sessions(db: Session, shards: Optional[CommentShards] = None):
+    """Open the comment sessions for ``db`` and close them afterwards.
+
+    :param db: The main database session.
+    :param shards: The shard layout; defaults to the configured one.
+    """
+    sessions = ShardSessions(shards or comment_shards, db)
+    try:
+        yield sessions
+    finally:
+        sessions.close()
+
+
+def _move_post(source: Session, target: Session, post_id: int, batch_size: int) -> int:
+    """Copy a post's comments to ``target``, then delete them from ``source``.
+
+    Copies are upserts, so an interrupted move can simply be run again.
+    """
+    table = Comment.__table__
+    moved = 0
+    last_id = 0
+    while True:
+        rows = source.execute(
+            select(table).where(table.c.post_id == post_id, table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).mappings().all()
+        if not rows:
+            break
+        target.execute(insert(table).values([dict(row) for row in rows]).on_conflict_do_nothing())
+        target.commit()
+        last_id = rows[-1]["id"]
+        moved += len(rows)
+    source.execute(delete(table).where(table.c.post_id == post_id))
+    source.commit()
+    return moved
+
+
+def rebalance(db: Session, source: CommentShards, target: CommentShards, batch_size: int = MOVE_BATCH_SIZE) -> int:
+    """Move comments from the ``source`` layout to the ``target`` layout.
+
+    Run it while the server is stopped. Posts already in the right place are not
+    touched; afterwards every shard's ID sequence is moved past the largest ID,
+    so new comments never reuse the ID of a moved one.
+
+    :param db: The main database session, which holds the comments of an unsharded layout.
+    :param source: The current layout.
+    :param target: The new layout.
+    :param batch_size: The number of comments copied per transaction.
+
+    :return: The number of moved comments.
+    """
+    moved = 0
+    largest_id = 0
+    with comment_sessions(db, source) as old, comment_sessions(db, target) as new:
+        for shard, session in enumerate(old.all()):
+            source_url = source.shard_url(shard) if source.sharded else None
+            largest_id = max(largest_id, session.scalar(select(func.max(Comment.id))) or 0)
+            post_ids = session.scalars(select(Comment.post_id).distinct()).all()
+            for post_id in post_ids:
+                destination = target.shard_for(post_id)
+                destination_url = target.shard_url(destination) if target.sharded else None
+                if destination_url != source_url:
+                    moved += _move_post(session, new.shard(destination), post_id, batch_size)
+
+        if target.sharded:
+            floor = largest_id // ID_STRIDE + 1
+            for session in new.all():
+                largest = session.scalar(select(func.max(Comment.id))) or 0
+                session.execute(
+                    update(comment_sequence)
+                    .where(comment_sequence.c.id == 0)
+                    .values(next_value=func.max(comment_sequence.c.next_value, floor, largest // ID_STRIDE + 1))
+                )
+                session.commit()
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move comments between shard layouts.")
+    parser.add_argument("--from-shards", type=int, required=True, help="The current COMMENT_SHARDS.")
+    parser.add_argument("--to-shards", type=int, required=True, help="The new COMMENT_SHARDS.")
+    parser.add_argument("--url", default=os.getenv("COMMENT_SHARD_URL", DEFAULT_SHARD_URL),
+                        help="The shard URL template, with a {shard} placeholder.")
+    args = parser.parse_args()
+
+    source = CommentShards(args.from_shards, args.url)
+    target = CommentShards(args.to_shards, args.url)
+    db = SessionLocal()
+    try:
+        moved = rebalance(db, source, target)
+    finally:
+        db.close()
+        source.dispose()
+        target.dispose()
+    print(f"Moved {moved} comments from {source.count} to {target.count} shards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+State shared between worker processes.
+
+Counters, sets (e.g. token revocation lists), token buckets and an
+invalidation event log. With a single process everything lives in a
+:class:`SharedStore` in memory; ``server.py`` starts the same store in a
+broker process and workers reach it over a local Unix socket through a
+:mod:`multiprocessing.managers` proxy, so every worker sees the same values.
+
+Invalidation is poll-based: :func:`publish` appends to a bounded event log and
+each worker's :func:`run_listener` task dispatches new events to the callbacks
+registered with :func:`subscribe`.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from multiprocessing.managers import BaseManager
+from typing import Callable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_ENV = "SHARED_STATE_ADDRESS"
+AUTHKEY_ENV = "SHARED_STATE_AUTHKEY"
+EVENT_LOG_SIZE = 10_000
+MAX_BUCKETS = 100_000
+
+
+class SharedStore:
+    """The state itself; used directly in-process or served by the broker.
+
+    :param event_log_size: The number of invalidation events kept for slow listeners.
+    """
+
+    def __init__(self, event_log_size: int = EVENT_LOG_SIZE):
+        self._lock = threading.Lock()
+        self._counters: dict[str, int] = defaultdict(int)
+        self._sets: dict[str, set] = defaultdict(set)
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._events: deque = deque(maxlen=event_log_size)
+        self._sequence = 0
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        """Add ``amount`` to a counter and return its new value."""
+        with self._lock:
+            self._counters[key] += amount
+            return self._counters[key]
+
+    def get(self, key: str) -> int:
+        """Return the value of a counter."""
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def sadd(self, key: str, member) -> bool:
+        """Add ``member`` to a set; return True if it was not there yet."""
+        with self._lock:
+            members = self._sets[key]
+            if member in members:
+                return False
+            members.add(member)
+            return True
+
+    def srem(self, key: str, member) -> bool:
+        """Remove ``member`` from a set; return True if it was there."""
+        with self._lock:
+            members = self._sets.get(key)
+            if not members or member not in members:
+                return False
+            members.discard(member)
+            return True
+
+    def sismember(self, key: str, member) -> bool:
+        """Return True if ``member`` is in the set."""
+        with self._lock:
+            return member in self._sets.get(key, ())
+
+    def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Token-bucket take, see :meth:`ratelimit.MemoryBucketStore.take`."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+            if not wait:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def publish(self, channel: str, message) -> int:
+        """Append an event to the log and return its sequence number."""
+        with self._lock:
+            self._sequence += 1
+            self._events.append((self._sequence, channel, message))
+            return self._sequence
+
+    def last_sequence(self) -> int:
+        """Return the sequence number of the latest event."""
+        with self._lock:
+            return self._sequence
+
+    def events_since(self, sequence: int) -> tuple[int, list]:
+        """Return the latest sequence number and the events published after ``sequence``."""
+        with self._lock:
+            return self._sequence, [event for event in self._events if event[0] > sequence]
+
+    def clear_buckets(self):
+        """Drop all token buckets, keeping counters and sets."""
+        with self._lock:
+            self._buckets.clear()
+
+    def clear(self):
+        """Drop all state."""
+        with self._lock:
+            self._counters.clear()
+            self._sets.clear()
+            self._buckets.clear()
+
+
+_served_store: Optional[SharedStore] = None
+
+
+def _get_served_store() -> SharedStore:
+    global _served_store
+    if _served_store is None:
+        _served_store = SharedStore()
+    return _served_store
+
+
+class StateManager(BaseManager):
+    """Multiprocessing manager exposing the broker's :class:`SharedStore`."""
+
+
+StateManager.register("get_store", callable=_get_served_store)
+
+
+def _exit_with_parent(parent_pid: int):
+    """Stop the broker process once the server that started it is gone."""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1.0)
+        os._exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def start_broker(address: Optional[str] = None) -> StateManager:
+    """Start the broker process and export its address for worker processes.
+
+    :param address: The Unix socket path; a temporary one is used by default.
+
+    :return: The running manager; call ``shutdown()`` when the server exits.
+    """
+    address = address or os.path.join(tempfile.mkdtemp(prefix="blog-state-"), "state.sock")
+    authkey = secrets.token_bytes(32)
+    manager = StateManager(address=address, authkey=authkey)
+    manager.start(initializer=_exit_with_parent, initargs=(os.getpid(),))
+    os.environ[ADDRESS_ENV] = address
+    os.environ[AUTHKEY_ENV] = authkey.hex()
+    return manager
+
+
+_state = None
+_state_pid: Optional[int] = None
+
+
+def get_state():
+    """Return the shared store for this process.
+
+    Connects to the broker if ``SHARED_STATE_ADDRESS`` is set, otherwise falls
+    back to an in-process store. Reconnects after a fork.
+    """
+    global _state, _state_pid
+    if _state is None or _state_pid != os.getpid():
+        address = os.getenv(ADDRESS_ENV)
+        if address:
+            manager = StateManager(address=address, authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+            manager.connect()
+            _state = manager.get_store()
+        else:
+            _state = SharedStore()
+        _state_pid = os.getpid()
+    return _state
+
+
+_subscribers: dict[str, list[Callable]] = defaultdict(list)
+
+
+def subscribe(channel: str, callback: Callable):
+    """Call ``callback(message)`` for every event published on ``channel`` by any worker."""
+    _subscribers[channel].append(callback)
+
+
+def publish(channel: str, message):
+    """Publish an invalidation event to all workers, this one included."""
+    get_state().publish(channel, message)
+
+
+def dispatch_pending(sequence: int) -> int:
+    """Dispatch events published after ``sequence`` and return the new position."""
+    sequence, events = get_state().events_since(sequence)
+    for _, channel, message in events:
+        for callback in _subscribers.get(channel, ()):
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("Subscriber for %s failed", channel)
+    return sequence
+
+
+async def run_listener(interval: float = 0.2):
+    """Poll the event log and dispatch invalidation events until cancelled.
+
+    :param interval: The number of seconds between polls.
+    """
+    sequence = await run_in_threadpool(get_state().last_sequence)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            sequence = await run_in_threadpool(dispatch_pending, sequence)
+        except Exception:
+            logger.exception("Shared state listener failed")
@@ -0,0 +1,111 @@
+"""
+Request coalescing for hot reads.
+
+When many requests for the same key arrive together, as when a post goes
+viral, only the first one runs the query; the others wait for it and share its
+result. A :class:`Group` runs each query in the threadpool, so the event loop
+keeps accepting requests, which then join the flight instead of queueing for
+the database.
+
+Keys must include everything that decides the result, including the
+authorization scope: a post only its owner may read is keyed by the owner too.
+Results are shared between requests, so query functions return plain data
+(response models or dictionaries), never ORM objects bound to the leader's
+session. An exception is shared the same way. The query also outlives the
+request that started it if that client disconnects, so it must open its own
+sessions rather than use that request's, which are closed when it ends.
+
+Each group counts its flights and how many requests each one absorbed; see
+:meth:`Group.stats`. The counts are per worker process.
+"""
+import asyncio
+import threading
+from typing import Any, Callable, Hashable
+
+from starlette.concurrency import run_in_threadpool
+
+# Upper bounds of the "absorbed requests per flight" histogram buckets; the last bucket is open.
+HISTOGRAM_BOUNDS = (0, 1, 4, 16, 64)
+
+groups: dict[str, "Group"] = {}
+
+
+class Group:
+    """Coalesces concurrent calls with equal keys.
+
+    :param name: The name reported in :func:`stats`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[Hashable, list] = {}
+        self._lock = threading.Lock()
+        self.flights = 0
+        self.absorbed = 0
+        self.max_absorbed = 0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        groups[name] = self
+
+    async def do(self, key: Hashable, func: Callable, *args) -> Any:
+        """Return ``func(*args)``, run once in the threadpool for all concurrent callers with ``key``.
+
+        :param key: The identity of the call, including its authorization scope.
+        :param func: The blocking function to run.
+        :param args: The arguments of the first caller; later callers' arguments are ignored.
+
+        :return: The result, shared with the other callers.
+        """
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight[1] += 1
+            return await asyncio.shield(flight[0])
+
+        task = asyncio.ensure_future(run_in_threadpool(func, *args))
+        flight = self._flights[key] = [task, 0]
+        try:
+            # Shielded so that a disconnecting first caller does not cancel the query for the others.
+            return await asyncio.shield(task)
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            self._record(flight[1])
+
+    def running(self, key: Hashable) -> bool:
+        """Return True if a call with ``key`` is in flight, so a call now would join it."""
+        return key in self._flights
+
+    def _record(self, absorbed: int):
+        with self._lock:
+            self.flights += 1
+            self.absorbed += absorbed
+            self.max_absorbed = max(self.max_absorbed, absorbed)
+            bucket = next((index for index, bound in enumerate(HISTOGRAM_BOUNDS) if absorbed <= bound),
+                          len(HISTOGRAM_BOUNDS))
+            self.histogram[bucket] += 1
+
+    def stats(self) -> dict:
+        """Return the flight counts of this worker.
+
+        ``histogram`` maps the upper bound of each bucket of absorbed requests
+        per flight (``">64"`` for the last) to the number of flights in it.
+        """
+        with self._lock:
+            labels = [str(bound) for bound in HISTOGRAM_BOUNDS] + [f">{HISTOGRAM_BOUNDS[-1]}"]
+            return {
+                "flights": self.flights,
+                "absorbed": self.absorbed,
+                "max_absorbed": self.max_absorbed,
+                "in_flight": len(self._flights),
+                "histogram": dict(zip(labels, self.histogram)),
+            }
+
+    def reset(self):
+        """Clear the counts."""
+        with self._lock:
+            self.flights = self.absorbed = self.max_absorbed = 0
+            self.histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+
+
+def stats() -> dict[str, dict]:
+    """Return the counts of every group, by name."""
+    return {name: group.stats() for name, group in groups.items()}
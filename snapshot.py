@@ -0,0 +1,228 @@
+"""
+Read-cache snapshots.
+
+After a restart every worker's :mod:`cache` is empty and the database takes
+the whole read load until it warms up. To avoid that, a background task
+periodically writes the hottest posts, with the first page of their comments
+and threads, to a snapshot file, and workers load it into their caches during
+the startup warm-up, before they report ready.
+
+The file is an index of fixed-size records followed by compact JSON
+documents::
+
+    header  magic, format version, schema revision, taken at, entry count
+    index   one (cache, post id, offset, length) record per entry
+    data    one [variant, value] document per entry
+
+It is read through ``mmap``: the index is unpacked straight from the mapping
+and each document is decoded from its own slice, so the file is never read
+into a buffer as a whole and the pages are shared by all workers.
+
+Snapshots older than :data:`MAX_AGE_SECONDS` or written for another schema
+are ignored. A snapshot is stamped with the time it started reading, and when
+it is loaded the entries of posts deleted, unpublished or updated since then
+are dropped, as are the comment pages of posts whose comments were created,
+edited or deleted since. Loaded entries expire after
+:data:`LOADED_TTL_SECONDS`.
+"""
+import asyncio
+import json
+import logging
+import mmap
+import os
+import random
+import struct
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import cache
+from database import SCHEMA_REVISION, SessionLocal
+from models import Comment, Post
+from sharding import comment_sessions
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = Path(os.getenv("SNAPSHOT_PATH", "blogapp-snapshot.bin"))
+INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "60"))
+SNAPSHOT_POSTS = int(os.getenv("SNAPSHOT_POSTS", "200"))
+MAX_AGE_SECONDS = 600.0
+LOADED_TTL_SECONDS = 60.0
+
+MAGIC = b"BLOGSNAP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sH8sdI")
+ENTRY = struct.Struct("<BqII")
+CACHE_NAMES = ("posts", "comments", "threads")
+
+
+def collect(db: Session, limit: int = SNAPSHOT_POSTS) -> list[tuple[str, int, Any, Any]]:
+    """Load the entries of a snapshot with the same functions that fill the caches.
+
+    :param db: The database session.
+    :param limit: The number of posts, hottest first.
+
+    :return: ``(cache name, post id, variant, value)`` tuples.
+    """
+    from routers import comments, posts
+
+    post_ids = db.scalars(
+        select(Post.id)
+        .where(Post.published.is_(True), Post.deleted_at.is_(None))
+        .order_by(Post.hot_score.desc())
+        .limit(limit)
+    ).all()
+    entries = []
+    with comment_sessions(db) as shards:
+        for post_id in post_ids:
+            post = posts.read_post(db, post_id)
+            if post is None:
+                continue
+            entries.append(("posts", post_id, None, post))
+            entries.append(("comments", post_id, cache.COMMENT_PAGE,
+                            comments.read_comments(db, shards, post_id, *cache.COMMENT_PAGE)))
+            entries.append(("threads", post_id, cache.THREAD_PAGE,
+                            comments.read_threads(db, shards, post_id, *cache.THREAD_PAGE)))
+    # A post deleted while it was being read has no comment pages.
+    return [entry for entry in entries if entry[3] is not None]
+
+
+def write(db: Session, path: Path = SNAPSHOT_PATH, limit: int = SNAPSHOT_POSTS) -> int:
+    """Write a snapshot of the hottest posts, replacing the previous one atomically.
+
+    :param db: The database session.
+    :param path: The snapshot file.
+    :param limit: The number of posts.
+
+    :return: The number of entries written.
+    """
+    index = bytearray()
+    data = bytearray()
+    # Anything changed after this may be missing from the entries; see load().
+    taken_at = time.time()
+    entries = collect(db, limit)
+    for name, post_id, variant, value in entries:
+        document = json.dumps([variant, value], separators=(",", ":")).encode()
+        index += ENTRY.pack(CACHE_NAMES.index(name), post_id, len(data), len(document))
+        data += document
+
+    temp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temp, "wb") as file:
+        file.write(HEADER.pack(MAGIC, FORMAT_VERSION, SCHEMA_REVISION.encode(), taken_at, len(entries)))
+        file.write(index)
+        file.write(data)
+    os.replace(temp, path)
+    return len(entries)
+
+
+def _unchanged_posts(db: Session, post_ids: set[int], since: datetime) -> set[int]:
+    post_ids = list(post_ids)
+    unchanged = set()
+    for start in range(0, len(post_ids), 500):
+        unchanged.update(db.scalars(
+            select(Post.id).where(
+                Post.id.in_(post_ids[start:start + 500]), Post.published.is_(True), Post.deleted_at.is_(None),
+                Post.updated_at <= since,
+            )
+        ))
+    return unchanged
+
+
+def _commented_posts(db: Session, post_ids: set[int], since: datetime) -> set[int]:
+    # Creating, editing and deleting a comment all set its updated_at.
+    post_ids = list(post_ids)
+    changed = set()
+    with comment_sessions(db) as shards:
+        for shard in shards.all():
+            for start in range(0, len(post_ids), 500):
+                changed.update(shard.scalars(
+                    select(Comment.post_id)
+                    .where(Comment.post_id.in_(post_ids[start:start + 500]))
+                    .group_by(Comment.post_id)
+                    .having(func.max(Comment.updated_at) > since)
+                ))
+    return changed
+
+
+def load(db: Session, path: Path = SNAPSHOT_PATH, max_age: float = MAX_AGE_SECONDS,
+         ttl: float = LOADED_TTL_SECONDS) -> int:
+    """Fill this worker's caches from a snapshot, if a recent one exists.
+
+    :param db: The database session, used to drop entries changed since the snapshot was taken.
+    :param path: The snapshot file.
+    :param max_age: Older snapshots are ignored.
+    :param ttl: The number of seconds the loaded entries are kept.
+
+    :return: The number of loaded entries.
+    """
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return 0
+    with file:
+        if os.fstat(file.fileno()).st_size < HEADER.size:
+            return 0
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping, memoryview(mapping) as view:
+            magic, version, revision, written_at, count = HEADER.unpack_from(view)
+            if (magic, version, revision.rstrip(b"\0")) != (MAGIC, FORMAT_VERSION, SCHEMA_REVISION.encode()):
+                logger.info("Ignoring snapshot %s written for another format or schema", path)
+                return 0
+            if time.time() - written_at > max_age:
+                logger.info("Ignoring snapshot %s written %.0f seconds ago", path, time.time() - written_at)
+                return 0
+
+            data_start = HEADER.size + count * ENTRY.size
+            records = list(ENTRY.iter_unpack(view[HEADER.size:data_start]))
+            since = datetime.fromtimestamp(written_at, timezone.utc).replace(tzinfo=None)
+            fresh = _unchanged_posts(db, {post_id for _, post_id, _, _ in records}, since)
+            commented = _commented_posts(db, fresh, since)
+            targets = [cache.caches[name] for name in CACHE_NAMES]
+            generations = [target.generation for target in targets]
+            loaded = 0
+            for cache_index, post_id, offset, length in records:
+                if post_id not in fresh or (CACHE_NAMES[cache_index] != "posts" and post_id in commented):
+                    continue
+                start = data_start + offset
+                variant, value = json.loads(view[start:start + length].tobytes())
+                if isinstance(variant, list):
+                    variant = tuple(variant)
+                targets[cache_index].put(post_id, value, variant, generation=generations[cache_index], ttl=ttl)
+                loaded += 1
+            return loaded
+
+
+def _write_if_due(interval: float, path: Path = SNAPSHOT_PATH) -> Optional[int]:
+    try:
+        if time.time() - path.stat().st_mtime < interval / 2:
+            # Another worker has just written one.
+            return None
+    except FileNotFoundError:
+        pass
+    db = SessionLocal()
+    try:
+        return write(db, path)
+    finally:
+        db.close()
+
+
+async def run_writer(interval: float = INTERVAL_SECONDS):
+    """Write a snapshot about every ``interval`` seconds until cancelled.
+
+    Every worker runs this task; one that finds a fresh snapshot skips its turn.
+
+    :param interval: The number of seconds between snapshots.
+    """
+    while True:
+        # Jittered, so workers started together do not all write at once.
+        await asyncio.sleep(interval * random.uniform(0.8, 1.2))
+        try:
+            written = await run_in_threadpool(_write_if_due, interval)
+            if written is not None:
+                logger.debug("Wrote a snapshot of %d cache entries", written)
+        except Exception:
+            logger.exception("Snapshot failed")
@@ -0,0 +1,134 @@
+"""
+Application startup.
+
+Startup only verifies that the database is at the expected migration instead
+of inspecting and creating the schema, then warms caches, connections and
+crypto in the background while ``/ready`` reports 503.
+"""
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+from fastapi import FastAPI
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import OperationalError
+from starlette.concurrency import run_in_threadpool
+
+from database import SCHEMA_REVISION
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_INI = Path(__file__).with_name("alembic.ini")
+
+
+def current_revision(engine: Engine) -> Optional[str]:
+    """Return the Alembic revision the database is stamped with.
+
+    :param engine: The database engine.
+
+    :return: The revision, or None if the database has never been migrated.
+    """
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+    except OperationalError:
+        return None
+
+
+def upgrade(engine: Engine):
+    """Run all pending Alembic migrations against ``engine``."""
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.attributes["configure_logger"] = False
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "head")
+
+
+def check_schema(engine: Engine, auto_migrate: Optional[bool] = None):
+    """Make sure the database schema matches the models.
+
+    :param engine: The database engine.
+    :param auto_migrate: Run pending migrations instead of failing; defaults to the ``AUTO_MIGRATE`` variable.
+
+    :raises RuntimeError: If the database is not at :data:`database.SCHEMA_REVISION`.
+    """
+    if auto_migrate is None:
+        auto_migrate = os.getenv("AUTO_MIGRATE", "") == "1"
+
+    revision = current_revision(engine)
+    if revision == SCHEMA_REVISION:
+        return
+    if auto_migrate:
+        logger.info("Migrating database from %s to %s", revision, SCHEMA_REVISION)
+        upgrade(engine)
+        return
+    raise RuntimeError(
+        f"Database schema is at revision {revision}, expected {SCHEMA_REVISION}. "
+        f"Run `alembic upgrade head` or start with AUTO_MIGRATE=1."
+    )
+
+
+def warm_pool(engine: Engine):
+    """Open the pool's connections up front so the first requests don't pay for them."""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    connections = [engine.connect() for _ in range(size)]
+    try:
+        for connection in connections:
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def warm_tokens():
+    """Run one JWT round trip so the crypto backends are imported and initialised."""
+    from jose import jwt
+
+    from routers.auth import ALGORITHM, SECRET_KEY, create_access_token
+
+    token = create_access_token("warmup", 0, False, timedelta(seconds=30))
+    jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+
+def load_user_status(engine: Engine):
+    """Load the cached list of inactive users and revoked tokens."""
+    from sqlalchemy.orm import Session
+
+    import user_status
+
+    with Session(engine) as db:
+        user_status.cache.load(db)
+
+
+def load_snapshot(engine: Engine):
+    """Fill the read caches from the latest snapshot, if there is a recent one."""
+    from sqlalchemy.orm import Session
+
+    import snapshot
+
+    with Session(engine) as db:
+        loaded = snapshot.load(db)
+    if loaded:
+        logger.info("Loaded %d cache entries from %s", loaded, snapshot.SNAPSHOT_PATH)
+
+
+async def warm_up(app: FastAPI, engine: Engine):
+    """Load the account status cache, warm the read caches, connection pool and token layer, then mark the app as ready.
+
+    :param app: The application; ``app.state.ready`` is set when done.
+    :param engine: The database engine.
+    """
+    # Not part of the optional warm-up: without the cache, deactivated users would be let in.
+    await run_in_threadpool(load_user_status, engine)
+    try:
+        await run_in_threadpool(load_snapshot, engine)
+        await run_in_threadpool(warm_pool, engine)
+        await run_in_threadpool(warm_tokens)
+    except Exception:
+        logger.exception("Warm-up failed; serving cold")
+    app.state.ready = True
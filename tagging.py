@@ -0,0 +1,225 @@
+"""
+Post tags.
+
+Tags are normalised names in the ``tags`` table, linked to posts through
+``post_tags``. :data:`index` keeps, per tag, the sorted array of tagged post
+ids, loaded lazily from the ``(tag_id, post_id)`` index and updated in place
+on writes, so multi-tag filters are answered by intersecting or merging
+sorted arrays instead of grouping ``post_tags`` rows in SQL.
+"""
+import heapq
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Iterable
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from starlette import status
+
+import shared_state
+from models import Post, Tag, post_tags
+
+MAX_TAG_LENGTH = 50
+INDEX_CAPACITY = 50_000_000
+
+_VALID_TAG = re.compile(r"^[\w][\w\- ]*$")
+
+
+def normalize(name: str) -> str:
+    """Normalise a tag name: lowercase, trimmed, inner whitespace collapsed.
+
+    :param name: The raw tag name.
+
+    :raises HTTPException: If the tag is empty, too long or contains unsupported characters.
+
+    :return: The normalised name.
+    """
+    normalized = " ".join(name.lower().split())
+    if not normalized or len(normalized) > MAX_TAG_LENGTH or not _VALID_TAG.match(normalized):
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"Invalid tag: {name!r}")
+    return normalized
+
+
+def normalize_all(names: Iterable[str]) -> list[str]:
+    """Normalise and deduplicate tag names, keeping their order."""
+    return list(dict.fromkeys(normalize(name) for name in names))
+
+
+def set_post_tags(db: Session, post: Post, names: Iterable[str]) -> tuple[set[str], set[str]]:
+    """Replace the tags of a post, creating missing tags, in the caller's transaction.
+
+    Call :meth:`TagIndex.apply` with the result after committing.
+
+    :param db: The database session.
+    :param post: The post; must have an ID.
+    :param names: The new tag names.
+
+    :return: The added and removed tag names.
+    """
+    names = normalize_all(names)
+    current = set(db.scalars(
+        select(Tag.name).join(post_tags, post_tags.c.tag_id == Tag.id).where(post_tags.c.post_id == post.id)
+    ))
+    added = set(names) - current
+    removed = current - set(names)
+
+    if added:
+        db.execute(insert(Tag).values([{"name": name} for name in added]).on_conflict_do_nothing())
+        tag_ids = db.scalars(select(Tag.id).where(Tag.name.in_(added))).all()
+        db.execute(insert(post_tags).values([{"post_id": post.id, "tag_id": tag_id} for tag_id in tag_ids]))
+    if removed:
+        tag_ids = select(Tag.id).where(Tag.name.in_(removed)).scalar_subquery()
+        db.execute(delete(post_tags).where(post_tags.c.post_id == post.id, post_tags.c.tag_id.in_(tag_ids)))
+    db.expire(post, ["tags"])
+    return added, removed
+
+
+def intersect(postings: list[array]) -> array:
+    """Intersect sorted id arrays, smallest first, galloping through the larger ones.
+
+    :return: The sorted ids present in every array.
+    """
+    if not postings:
+        return array("q")
+    postings = sorted(postings, key=len)
+    result = postings[0]
+    for other in postings[1:]:
+        matched = array("q")
+        low = 0
+        for post_id in result:
+            low = bisect_left(other, post_id, low)
+            if low == len(other):
+                break
+            if other[low] == post_id:
+                matched.append(post_id)
+        result = matched
+        if not result:
+            break
+    return result
+
+
+def union(postings: list[array]) -> array:
+    """Merge sorted id arrays into one sorted array without duplicates."""
+    result = array("q")
+    last = None
+    for post_id in heapq.merge(*postings):
+        if post_id != last:
+            result.append(post_id)
+            last = post_id
+    return result
+
+
+class TagIndex:
+    """In-memory tag -> sorted post id arrays with LRU eviction.
+
+    :param capacity: The maximum total number of post ids kept across all tags.
+    """
+
+    def __init__(self, capacity: int = INDEX_CAPACITY):
+        self.capacity = capacity
+        self._postings: OrderedDict[str, array] = OrderedDict()
+        self._size = 0
+        # Bumped on every change of a tag, so postings loaded across a change are not installed.
+        self._generations: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, db: Session, name: str) -> array:
+        ids = db.scalars(
+            select(post_tags.c.post_id)
+            .join(Tag, Tag.id == post_tags.c.tag_id)
+            .where(Tag.name == name)
+            .order_by(post_tags.c.post_id)
+        ).all()
+        return array("q", ids)
+
+    def postings(self, db: Session, name: str) -> array:
+        """Return the sorted ids of the posts tagged ``name``, loading them if needed.
+
+        A posting whose tag changed while it was being loaded may miss the change,
+        so it is discarded and loaded again.
+        """
+        while True:
+            with self._lock:
+                posting = self._postings.get(name)
+                if posting is not None:
+                    self._postings.move_to_end(name)
+                    return posting
+                generation = self._generations.get(name, 0)
+
+            posting = self._load(db, name)
+            with self._lock:
+                if self._generations.get(name, 0) != generation:
+                    continue
+                if name not in self._postings:
+                    self._postings[name] = posting
+                    self._size += len(posting)
+                    while self._size > self.capacity and len(self._postings) > 1:
+                        _, evicted = self._postings.popitem(last=False)
+                        self._size -= len(evicted)
+                return self._postings[name]
+
+    def match(self, db: Session, names: list[str], mode: str = "any") -> array:
+        """Return the sorted ids of posts with any or all of the tags.
+
+        :param db: The database session used for cold tags.
+        :param names: The normalised tag names.
+        :param mode: ``"any"`` for a union, ``"all"`` for an intersection.
+        """
+        postings = [self.postings(db, name) for name in names]
+        return intersect(postings) if mode == "all" else union(postings)
+
+    def apply(self, post_id: int, added: Iterable[str] = (), removed: Iterable[str] = (), publish: bool = True):
+        """Update the loaded postings after a post's tags changed and tell other workers.
+
+        :param post_id: The ID of the post.
+        :param added: The tag names added to the post.
+        :param removed: The tag names removed from the post.
+        :param publish: Whether to invalidate the tags in other worker processes.
+        """
+        added, removed = list(added), list(removed)
+        with self._lock:
+            for name in added + removed:
+                self._generations[name] = self._generations.get(name, 0) + 1
+            for name in added:
+                posting = self._postings.get(name)
+                if posting is not None:
+                    position = bisect_left(posting, post_id)
+                    if position == len(posting) or posting[position] != post_id:
+                        insort(posting, post_id)
+                        self._size += 1
+            for name in removed:
+                posting = self._postings.get(name)
+                if posting is not None:
+                    position = bisect_left(posting, post_id)
+                    if position < len(posting) and posting[position] == post_id:
+                        del posting[position]
+                        self._size -= 1
+        if publish and (added or removed):
+            shared_state.publish("tags", {"pid": os.getpid(), "names": added + removed})
+
+    def invalidate(self, message: dict):
+        """Drop postings changed by another worker; they are reloaded on next use."""
+        if message.get("pid") == os.getpid():
+            return
+        with self._lock:
+            for name in message.get("names", ()):
+                self._generations[name] = self._generations.get(name, 0) + 1
+                posting = self._postings.pop(name, None)
+                if posting is not None:
+                    self._size -= len(posting)
+
+    def clear(self):
+        """Drop all postings."""
+        with self._lock:
+            self._postings.clear()
+            self._size = 0
+
+
+index = TagIndex()
+shared_state.subscribe("tags", index.invalidate)
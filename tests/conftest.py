@@ -0,0 +1,31 @@
+"""
+Shared test configuration.
+"""
+import os
+import tempfile
+
+import pytest
+
+# Hash test passwords at bcrypt's minimum cost; the production default takes a few hundred milliseconds per hash.
+os.environ.setdefault("PASSWORD_BCRYPT_ROUNDS", "4")
+# Keep attachments and cache snapshots in a throwaway directory.
+_scratch = tempfile.mkdtemp(prefix="blogapp-tests-")
+os.environ.setdefault("ATTACHMENT_DIR", os.path.join(_scratch, "attachments"))
+os.environ.setdefault("SNAPSHOT_PATH", os.path.join(_scratch, "snapshot.bin"))
+
+
+@pytest.fixture(autouse=True)
+def empty_read_caches():
+    """Start every test with empty read caches, as many tests change rows directly in the database."""
+    import cache
+
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def user_status_from_test_database(monkeypatch):
+    """Look up account status in the test database while the status cache is not loaded."""
+    import user_status
+    from .utils import TestingSessionLocal
+
+    monkeypatch.setattr(user_status, "SessionLocal", TestingSessionLocal)
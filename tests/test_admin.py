@@ -1,9 +1,18 @@
 """
 Test admin router.
 """
+from datetime import timedelta
+
+from jose import jwt
+from sqlalchemy import event
 from starlette import status
 
+import rollups
+import user_status
+from models import Comment
+from routers import admin
 from routers.admin import get_db, get_current_superuser
+from routers.auth import ALGORITHM, SECRET_KEY, authenticate_user, create_access_token
 from .utils import *
 
 app.dependency_overrides[get_db] = override_get_db
@@ -43,3 +52,187 @@ def test_create_superuser_as_non_superuser(test_user):
 
     assert response.status_code == status.HTTP_403_FORBIDDEN
     assert response.json()["detail"] == "Only admins can create admin users."
+
+
+@pytest.fixture
+def activity(test_user, test_post):
+    """Fixture that adds a second user with a post and two comments, and clears the rollups around the test."""
+    db = TestingSessionLocal()
+    author = User(username="writer", email="writer@example.com", hashed_password="x", is_superuser=False)
+    db.add(author)
+    db.flush()
+    post = Post(title="Another", content="Content", owner_id=author.id)
+    db.add(post)
+    db.flush()
+    db.add_all([Comment(content="First", post_id=post.id, author_id=author.id, depth=0),
+                Comment(content="Second", post_id=post.id, author_id=test_user.id, depth=0)])
+    db.commit()
+    author_id = author.id
+    db.close()
+    yield author_id
+    with engine.connect() as connection:
+        for table in ("activity_rollups", "author_rollups", "rollup_watermarks", "comments"):
+            connection.execute(text(f"DELETE FROM {table};"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'comments';"))
+        connection.commit()
+
+
+def test_activity_stats(activity):
+    """Test that rollups count existing rows once and pick up new rows incrementally."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+
+    db = TestingSessionLocal()
+    assert rollups.update_rollups(db) == 6
+    assert rollups.update_rollups(db) == 0
+
+    response = client.get("/admin/stats/activity", params={"start": "2000-01-01T00:00:00"})
+    assert response.status_code == status.HTTP_200_OK
+    assert [(day["users"], day["posts"], day["comments"]) for day in response.json()] == [(2, 2, 2)]
+
+    db.add(Post(title="Third", content="Content", owner_id=activity))
+    db.commit()
+    assert rollups.update_rollups(db) == 1
+    response = client.get("/admin/stats/activity", params={"period": "hour", "start": "2000-01-01T00:00:00"})
+    assert sum(hour["posts"] for hour in response.json()) == 3
+
+    assert rollups.rebuild(db) == 7
+    response = client.get("/admin/stats/activity", params={"start": "2000-01-01T00:00:00"})
+    assert [(day["users"], day["posts"], day["comments"]) for day in response.json()] == [(2, 3, 2)]
+    db.close()
+
+
+def test_overlapping_passes_count_rows_once(activity, monkeypatch):
+    """Test that a pass overtaken by another worker's pass does not count the same rows again."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+    original_move = rollups._move_watermark
+    overtaken = []
+
+    def overtaken_move(db, source, seen, last_id):
+        if source not in overtaken:
+            overtaken.append(source)
+            other = TestingSessionLocal()
+            rollups.update_rollups(other)
+            other.close()
+        return original_move(db, source, seen, last_id)
+
+    monkeypatch.setattr(rollups, "_move_watermark", overtaken_move)
+    db = TestingSessionLocal()
+    assert rollups.update_rollups(db) == 0
+    db.close()
+
+    response = client.get("/admin/stats/activity", params={"start": "2000-01-01T00:00:00"})
+    assert [(day["users"], day["posts"], day["comments"]) for day in response.json()] == [(2, 2, 2)]
+
+
+def test_top_authors(activity):
+    """Test that the most active authors are listed first."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+    rollups.update_rollups(TestingSessionLocal())
+
+    response = client.get("/admin/stats/top_authors", params={"days": 366})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {"author_id": 1, "username": "dartrisen", "posts": 1, "comments": 1},
+        {"author_id": activity, "username": "writer", "posts": 1, "comments": 1},
+    ]
+
+
+def test_stats_require_superuser(test_user):
+    """Test that statistics are only available to superusers."""
+    app.dependency_overrides[get_current_superuser] = lambda: get_current_superuser(override_get_current_non_superuser())
+
+    response = client.get("/admin/stats/activity")
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.fixture
+def status_cache():
+    """Fixture that starts from a loaded, empty account status cache."""
+    user_status.cache.load(TestingSessionLocal())
+    yield user_status.cache
+    user_status.cache.clear()
+
+
+def test_deactivate_and_reactivate_users(test_user, status_cache):
+    """Test that deactivation blocks login and existing tokens without a query per request."""
+    app.dependency_overrides[get_current_superuser] = lambda: {"username": "admin", "id": 99, "is_superuser": True}
+    token = create_access_token(test_user.username, test_user.id, False, timedelta(minutes=5))
+
+    response = client.post("/admin/users/deactivate", json={"user_ids": [test_user.id, 12345]})
+    assert response.json() == {"updated": 1}
+    assert not status_cache.allows(test_user.id, jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["iat"])
+    assert authenticate_user(test_user.username, "testpassword", TestingSessionLocal()) is False
+
+    response = client.post("/admin/users/reactivate", json={"user_ids": [test_user.id]})
+    assert response.json() == {"updated": 1}
+    assert not status_cache.allows(test_user.id, jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["iat"])
+    new_token = create_access_token(test_user.username, test_user.id, False, timedelta(minutes=5))
+    assert status_cache.allows(test_user.id, jwt.decode(new_token, SECRET_KEY, algorithms=[ALGORITHM])["iat"])
+
+
+def test_status_is_queried_until_the_cache_is_loaded(test_user):
+    """Test that a worker which has not loaded the status cache yet still rejects deactivated users."""
+    user_status.cache.clear()
+    token = create_access_token(test_user.username, test_user.id, False, timedelta(minutes=5))
+    issued_at = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["iat"]
+    assert user_status.cache.allows(test_user.id, issued_at)
+
+    db = TestingSessionLocal()
+    db.query(User).filter(User.id == test_user.id).update({"is_active": False})
+    db.commit()
+    db.close()
+    assert not user_status.cache.allows(test_user.id, issued_at)
+    assert user_status.cache.allows(12345, issued_at)
+
+
+def test_cannot_deactivate_self(test_user):
+    """Test that an admin cannot lock themselves out."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+
+    response = client.post("/admin/users/deactivate", json={"user_ids": [1]})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_reset_passwords(test_user, status_cache):
+    """Test that reset passwords replace the old ones and revoke tokens."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+
+    response = client.post("/admin/users/reset_passwords", json={"user_ids": [test_user.id, 12345]})
+    assert response.status_code == status.HTTP_200_OK
+    body = response.json()
+    assert body["updated"] == 1
+    temporary = body["passwords"][str(test_user.id)]
+
+    db = TestingSessionLocal()
+    assert authenticate_user(test_user.username, "testpassword", db) is False
+    assert authenticate_user(test_user.username, temporary, db).id == test_user.id
+    assert not status_cache.allows(test_user.id, 0)
+
+
+def test_failed_reset_changes_no_password(test_user, status_cache, monkeypatch):
+    """Test that a reset failing in a later chunk leaves every password, including earlier chunks', unchanged."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+    monkeypatch.setattr(admin, "BULK_CHUNK_SIZE", 1)
+    db = TestingSessionLocal()
+    other = User(username="second", email="second@example.com", hashed_password=test_user.hashed_password)
+    db.add(other)
+    db.commit()
+    updates = []
+
+    def fail_second_chunk(connection, cursor, statement, parameters, context, executemany):
+        if statement.startswith("UPDATE users"):
+            updates.append(statement)
+            if len(updates) == 2:
+                raise RuntimeError("disk full")
+
+    event.listen(engine, "before_cursor_execute", fail_second_chunk)
+    try:
+        with pytest.raises(RuntimeError):
+            client.post("/admin/users/reset_passwords", json={"user_ids": [test_user.id, other.id]})
+    finally:
+        event.remove(engine, "before_cursor_execute", fail_second_chunk)
+
+    assert len(updates) == 2
+    assert authenticate_user(test_user.username, "testpassword", db).id == test_user.id
+    assert authenticate_user("second", "testpassword", db).id == other.id
+    db.close()
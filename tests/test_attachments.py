@@ -0,0 +1,154 @@
+"""
+Test attachments router.
+"""
+import asyncio
+import os
+import time
+
+from starlette import status
+
+import attachments
+import ratelimit
+from models import Attachment, Job
+from routers import attachments as attachments_router
+from routers.auth import get_current_user
+from .utils import *
+
+app.dependency_overrides[attachments_router.get_db] = override_get_db
+
+CONTENT = bytes(range(256)) * 40
+
+
+def other_user():
+    """Override the dependency to return a user who does not own the test post."""
+    return {"username": "other", "id": 2, "is_superuser": False}
+
+
+@pytest.fixture(autouse=True)
+def as_owner():
+    """Act as the non-admin owner of the test post, and delete attachments and jobs after each test."""
+    ratelimit.store.clear()
+    app.dependency_overrides[get_current_user] = override_get_current_non_superuser
+    yield
+    app.dependency_overrides[get_current_user] = override_get_current_user
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM attachments;"))
+        connection.execute(text("DELETE FROM jobs;"))
+        connection.commit()
+
+
+def upload(post_id, content=CONTENT, filename="data.bin", content_type="application/octet-stream"):
+    """Upload ``content`` as an attachment of a post."""
+    return client.post(f"/attachments/upload?post_id={post_id}&filename={filename}", content=content,
+                       headers={"Content-Type": content_type})
+
+
+def test_upload_and_download(test_post):
+    """Test that an uploaded file is stored once per content and downloaded unchanged."""
+    first = upload(test_post.id)
+    second = upload(test_post.id, filename="../copy.bin")
+
+    assert first.status_code == second.status_code == status.HTTP_201_CREATED
+    assert second.json()["filename"] == "copy.bin"
+    assert first.json()["sha256"] == second.json()["sha256"]
+    assert first.json()["size"] == len(CONTENT)
+    assert attachments.blob_path(first.json()["sha256"]).read_bytes() == CONTENT
+    assert not list((attachments.STORAGE_DIR / "tmp").iterdir())
+
+    response = client.get(f"/attachments/{first.json()['id']}")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"] == f'"{first.json()["sha256"]}"'
+    assert len(client.get(f"/attachments/?post_id={test_post.id}").json()) == 2
+
+
+def test_download_range(test_post):
+    """Test single byte ranges, suffix ranges, If-Range and unsatisfiable ranges."""
+    attachment = upload(test_post.id, content=b"0123456789", content_type="text/plain").json()
+    url = f"/attachments/{attachment['id']}"
+
+    response = client.get(url, headers={"Range": "bytes=2-5", "Accept-Encoding": "gzip"})
+    assert response.status_code == status.HTTP_206_PARTIAL_CONTENT
+    assert response.content == b"2345"
+    assert response.headers["content-range"] == "bytes 2-5/10"
+    assert "content-encoding" not in response.headers
+
+    assert client.get(url, headers={"Range": "bytes=-3"}).content == b"789"
+    assert client.get(url, headers={"Range": "bytes=7-"}).content == b"789"
+    assert client.get(url, headers={"Range": "bytes=8-100"}).content == b"89"
+    assert client.get(url, headers={"Range": "bytes=0-1,4-5"}).status_code == status.HTTP_200_OK
+    assert client.get(url, headers={"Range": "bytes=2-5", "If-Range": '"stale"'}).content == b"0123456789"
+
+    response = client.get(url, headers={"Range": "bytes=10-"})
+    assert response.status_code == status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+    assert response.headers["content-range"] == "bytes */10"
+
+
+def test_upload_size_limit(test_post, monkeypatch):
+    """Test that uploads over the limit are rejected, with or without a Content-Length, and leave no files."""
+    monkeypatch.setattr(attachments, "MAX_BYTES", 1000)
+
+    assert upload(test_post.id).status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    chunked = client.post(f"/attachments/upload?post_id={test_post.id}&filename=big.bin",
+                          content=iter([CONTENT[:800], CONTENT[800:1600]]))
+    assert chunked.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    assert not list((attachments.STORAGE_DIR / "tmp").iterdir())
+    assert TestingSessionLocal().query(Attachment).count() == 0
+
+
+def test_access_policy(test_post):
+    """Test that other users may download but not add or delete attachments of a published post."""
+    attachment = upload(test_post.id).json()
+
+    app.dependency_overrides[get_current_user] = other_user
+    assert client.get(f"/attachments/{attachment['id']}").content == CONTENT
+    assert upload(test_post.id).status_code == status.HTTP_404_NOT_FOUND
+    assert client.delete(f"/attachments/{attachment['id']}").status_code == status.HTTP_404_NOT_FOUND
+
+    db = TestingSessionLocal()
+    db.query(Post).filter(Post.id == test_post.id).update({"published": False})
+    db.commit()
+    assert client.get(f"/attachments/{attachment['id']}").status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_delete_removes_unused_file(test_post):
+    """Test that deleting the last attachment of a file removes it once the grace period has passed."""
+    first = upload(test_post.id).json()
+    second = upload(test_post.id).json()
+    path = attachments.blob_path(first["sha256"])
+
+    assert client.delete(f"/attachments/{first['id']}").status_code == status.HTTP_204_NO_CONTENT
+    db = TestingSessionLocal()
+    assert db.query(Job).filter(Job.name == "delete_attachment_blob").count() == 1
+    assert not attachments.delete_blob(db, first["sha256"])
+    assert path.exists()
+
+    client.delete(f"/attachments/{second['id']}")
+    assert not attachments.delete_blob(db, first["sha256"])
+    assert path.exists(), "a recently written file may belong to an upload that has not committed yet"
+
+    old = time.time() - attachments.GRACE_SECONDS - 1
+    os.utime(path, (old, old))
+    assert attachments.delete_blob(db, first["sha256"])
+    assert not path.exists()
+    assert not list(path.parent.iterdir())
+
+
+def test_zero_copy_send(test_post):
+    """Test that servers offering the zero-copy extension are handed the open file and the range."""
+    attachment = upload(test_post.id).json()
+    response = attachments.BlobResponse(TestingSessionLocal().get(Attachment, attachment["id"]), "bytes=100-199")
+    messages = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            message = {**message, "data": os.pread(message["file"].fileno(), message["count"], message["offset"])}
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "extensions": {"http.response.zerocopysend": {}}}
+    asyncio.run(response(scope, None, send))
+
+    assert messages[0]["status"] == status.HTTP_206_PARTIAL_CONTENT
+    assert messages[1]["offset"] == 100 and messages[1]["count"] == 100
+    assert messages[1]["data"] == CONTENT[100:200]
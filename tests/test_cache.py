@@ -0,0 +1,88 @@
+"""
+Test the read caches.
+"""
+import asyncio
+
+from starlette import status
+
+import cache
+import singleflight
+from routers import comments, posts
+from .utils import *
+
+app.dependency_overrides[posts.get_db] = override_get_db
+app.dependency_overrides[comments.get_db] = override_get_db
+app.dependency_overrides[posts.get_current_user] = override_get_current_user
+
+
+@pytest.fixture(autouse=True)
+def clean_comments():
+    """Delete the comments created by a test."""
+    yield
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM comments;"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'comments';"))
+        connection.commit()
+
+
+def test_reads_are_cached_until_written(test_post, monkeypatch):
+    """Test that repeated reads hit the cache and that updates and comments invalidate it."""
+    assert client.get(f"/posts/{test_post.id}").json()["title"] == "Test Title"
+    assert client.get(f"/comments/?post_id={test_post.id}").json() == []
+
+    def no_query(*args):
+        raise AssertionError("served from the database")
+
+    monkeypatch.setattr(posts, "read_post", no_query)
+    monkeypatch.setattr(comments, "read_comments", no_query)
+    assert client.get(f"/posts/{test_post.id}").json()["title"] == "Test Title"
+    assert client.get(f"/comments/?post_id={test_post.id}").json() == []
+    monkeypatch.undo()
+
+    client.put(f"/posts/{test_post.id}", json={"title": "Edited", "content": "New content", "published": True})
+    client.post(f"/comments/create_comment?post_id={test_post.id}", json={"content": "Fresh"})
+    assert client.get(f"/posts/{test_post.id}").json()["title"] == "Edited"
+    assert [comment["content"] for comment in client.get(f"/comments/?post_id={test_post.id}").json()] == ["Fresh"]
+
+    client.delete(f"/posts/{test_post.id}")
+    assert client.get(f"/posts/{test_post.id}").status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_read_racing_a_write_is_not_stored():
+    """Test that a value loaded before an invalidation is returned but not cached."""
+    target = cache.ReadCache("test-race")
+    flights = singleflight.Group("test-race")
+
+    def stale_read():
+        target.discard((1,))
+        return {"title": "stale"}
+
+    assert asyncio.run(target.get_or_load(1, None, flights, stale_read)) == {"title": "stale"}
+    assert target.get(1) is cache.MISSING
+    assert asyncio.run(target.get_or_load(1, None, flights, lambda: {"title": "fresh"})) == {"title": "fresh"}
+    assert target.get(1) == {"title": "fresh"}
+
+
+def test_invalidation_from_other_workers():
+    """Test that invalidation events of other processes drop the post's entries."""
+    cache.posts.put(7, {"id": 7})
+    cache.comment_pages.put(7, [[1, True], []], (10, 0))
+
+    cache._on_message({"pid": -1, "caches": ["posts", "comments"], "post_id": 7})
+
+    assert cache.posts.get(7) is cache.MISSING
+    assert cache.comment_pages.get(7, (10, 0)) is cache.MISSING
+
+
+def test_only_default_pages_are_cached(test_post):
+    """Test that pages with other parameters are not cached, so each post has one entry per cache."""
+    for limit in (1, 2, -1):
+        client.get(f"/comments/?post_id={test_post.id}&limit={limit}")
+        client.get(f"/comments/threads?post_id={test_post.id}&limit={limit}&replies={limit + 5}")
+    assert cache.comment_pages.entries() == []
+    assert cache.thread_pages.entries() == []
+
+    client.get(f"/comments/?post_id={test_post.id}")
+    client.get(f"/comments/threads?post_id={test_post.id}")
+    assert [variant for _, variant, _ in cache.comment_pages.entries()] == [cache.COMMENT_PAGE]
+    assert [variant for _, variant, _ in cache.thread_pages.entries()] == [cache.THREAD_PAGE]
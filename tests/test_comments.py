@@ -0,0 +1,117 @@
+"""
+Test comments router.
+"""
+from datetime import datetime
+
+from starlette import status
+
+import ratelimit
+from models import Comment
+from routers import posts
+from routers.comments import get_db, get_current_user
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[posts.get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+
+@pytest.fixture
+def thread(test_post):
+    """Fixture that builds a small comment thread on the test post.
+
+    Layout::
+
+        1
+        ├── 2
+        │   └── 4
+        └── 3
+        5
+    """
+    ratelimit.store.clear()
+
+    def reply(content, parent_id=None):
+        response = client.post(f"/comments/create_comment?post_id={test_post.id}",
+                               json={"content": content, "parent_id": parent_id})
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.json()["id"]
+
+    first = reply("first")
+    second = reply("second", first)
+    reply("third", first)
+    reply("fourth", second)
+    reply("fifth")
+    yield first
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM comments;"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'comments';"))
+        connection.commit()
+
+
+def contents(nodes):
+    """Flatten a nested thread into ``(content, depth)`` pairs in display order."""
+    result = []
+    for node in nodes:
+        result.append((node["content"], node["depth"]))
+        result.extend(contents(node["replies"]))
+    return result
+
+
+def test_create_reply_sets_path(thread):
+    """Test that replies get the materialized path of their parent."""
+    db = TestingSessionLocal()
+    root = db.get(Comment, thread)
+    reply = db.query(Comment).filter(Comment.parent_id == root.id).order_by(Comment.id).first()
+    assert reply.path.startswith(root.path)
+    assert reply.depth == 1
+
+
+def test_create_reply_to_missing_parent(test_post):
+    """Test replying to a comment that does not exist."""
+    response = client.post(f"/comments/create_comment?post_id={test_post.id}",
+                           json={"content": "orphan", "parent_id": 999})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Parent comment not found"}
+
+
+def test_get_thread(thread):
+    """Test retrieving a nested subtree."""
+    response = client.get(f"/comments/{thread}/thread")
+    assert response.status_code == status.HTTP_200_OK
+    assert contents([response.json()]) == [("first", 0), ("second", 1), ("fourth", 2), ("third", 1)]
+
+
+def test_get_thread_depth_limited(thread):
+    """Test that the subtree is cut at ``max_depth``."""
+    response = client.get(f"/comments/{thread}/thread?max_depth=1")
+    assert contents([response.json()]) == [("first", 0), ("second", 1), ("third", 1)]
+
+
+def test_get_threads_with_first_replies(thread, test_post):
+    """Test retrieving the top-level threads with a bounded number of replies each."""
+    response = client.get(f"/comments/threads?post_id={test_post.id}&replies=1")
+    assert response.status_code == status.HTTP_200_OK
+    assert contents(response.json()) == [("first", 0), ("second", 1), ("fifth", 0)]
+
+
+def test_delete_comment_hides_replies(thread):
+    """Test that deleting a comment also hides its replies."""
+    response = client.delete(f"/comments/{thread}")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = client.get(f"/comments/{thread + 1}")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_get_comments_since(thread, test_post):
+    """Test that comments are listed oldest first and ``since`` selects them by creation time."""
+    db = TestingSessionLocal()
+    for comment_id, day in ((1, 5), (2, 3), (3, 4), (4, 1), (5, 2)):
+        db.query(Comment).filter(Comment.id == comment_id).update({"created_at": datetime(2030, 1, day)})
+    db.commit()
+
+    response = client.get(f"/comments/?post_id={test_post.id}")
+    assert [comment["id"] for comment in response.json()] == [4, 5, 2, 3, 1]
+    response = client.get(f"/comments/?post_id={test_post.id}&since=2030-01-03T00:00:00Z&limit=2")
+    assert [comment["id"] for comment in response.json()] == [2, 3]
+    assert response.json()[0]["created_at"] == "2030-01-03T00:00:00Z"
@@ -0,0 +1,37 @@
+"""
+Test response compression.
+"""
+from starlette import status
+
+from compression import negotiate_encoding
+from routers.posts import get_db, get_current_user
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+
+def test_negotiate_encoding():
+    """Test picking an encoding from Accept-Encoding."""
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("") is None
+
+
+def test_large_response_is_gzipped(test_post):
+    """Test that responses over the threshold are compressed."""
+    for index in range(5):
+        client.post("/posts/create_post", json={"title": f"Post {index}", "content": "x" * 1000})
+
+    response = client.get("/posts/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 6
+
+
+def test_small_response_is_not_compressed(test_post):
+    """Test that responses under the threshold are sent as is."""
+    response = client.get("/posts/?view=summary", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == status.HTTP_200_OK
+    assert "content-encoding" not in response.headers
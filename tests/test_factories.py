@@ -0,0 +1,49 @@
+"""
+Test the bulk factories.
+"""
+import factories
+import passwords
+from models import Comment
+from .utils import *
+
+
+@pytest.fixture
+def clean_tables():
+    """Delete the seeded rows after each test."""
+    yield
+    with engine.connect() as connection:
+        for table in ("comments", "posts", "users"):
+            connection.execute(text(f"DELETE FROM {table};"))
+            connection.execute(text(f"DELETE FROM sqlite_sequence WHERE name = '{table}';"))
+        connection.commit()
+
+
+def test_seed_large_dataset(clean_tables):
+    """Test that tens of thousands of rows are seeded with one password hash."""
+    db = TestingSessionLocal()
+    user_ids = factories.users(db, 500, password="secret")
+    post_ids = factories.posts(db, 20000, owner_id=lambda index: user_ids[index % len(user_ids)])
+    comment_ids = factories.comments(db, post_ids[:2000], 5, author_id=user_ids[0])
+    db.commit()
+
+    assert db.query(Post).count() == 20000
+    assert db.query(Comment).filter(Comment.post_id == post_ids[0]).count() == 5
+    comment = db.get(Comment, comment_ids[-1])
+    assert comment.post_id == post_ids[1999]
+    assert comment.path == f"{comment.id:010d}"
+    users = db.query(User).filter(User.id.in_(user_ids[:2])).all()
+    assert users[0].hashed_password == users[1].hashed_password
+    assert passwords.verify_password("secret", users[0].hashed_password)
+    db.close()
+
+
+def test_overrides(clean_tables):
+    """Test that columns can be overridden with values or callables of the row index."""
+    db = TestingSessionLocal()
+    post_ids = factories.posts(db, 3, owner_id=1, published=False, title=lambda index: f"Draft {index}")
+    db.commit()
+
+    assert [(post.title, post.published) for post in db.query(Post).filter(Post.id.in_(post_ids))] == [
+        ("Draft 0", False), ("Draft 1", False), ("Draft 2", False)
+    ]
+    db.close()
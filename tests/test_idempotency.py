@@ -0,0 +1,188 @@
+"""
+Test idempotency keys.
+"""
+import asyncio
+import threading
+from datetime import timedelta
+
+from fastapi import HTTPException
+from starlette import status
+
+import idempotency
+import ratelimit
+from models import Comment, IdempotencyKey, utcnow
+from schemas import PostResponse
+from routers import comments, posts
+from .utils import *
+
+app.dependency_overrides[posts.get_db] = override_get_db
+app.dependency_overrides[comments.get_db] = override_get_db
+app.dependency_overrides[posts.get_current_user] = override_get_current_user
+
+
+@pytest.fixture(autouse=True)
+def clean_keys():
+    """Reset the rate limits and delete the stored keys and comments after each test."""
+    ratelimit.store.clear()
+    yield
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM idempotency_keys;"))
+        connection.execute(text("DELETE FROM comments;"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'comments';"))
+        connection.commit()
+
+
+def test_retry_replays_stored_response(test_post):
+    """Test that a retried create returns the first response without creating another post."""
+    request = {"title": "Once", "content": "Only once", "tags": ["retry"]}
+    first = client.post("/posts/create_post", json=request, headers={"Idempotency-Key": "abc"})
+    retry = client.post("/posts/create_post", json=request, headers={"Idempotency-Key": "abc"})
+
+    assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+    assert retry.json() == first.json()
+    assert retry.headers[idempotency.REPLAYED_HEADER] == "true"
+    assert idempotency.REPLAYED_HEADER not in first.headers
+    db = TestingSessionLocal()
+    assert db.query(Post).filter(Post.title == "Once").count() == 1
+    db.close()
+
+
+def test_replays_are_not_rate_limited(test_post, monkeypatch):
+    """Test that retries answered from the stored response do not use up the rate limit."""
+    monkeypatch.setattr(ratelimit.create_post_limit, "capacity", 1)
+    monkeypatch.setattr(ratelimit.create_post_limit, "rate", 0.001)
+    request = {"title": "Limited", "content": "Once"}
+    for _ in range(3):
+        response = client.post("/posts/create_post", json=request, headers={"Idempotency-Key": "limited"})
+        assert response.status_code == status.HTTP_201_CREATED
+
+    response = client.post("/posts/create_post", json={"title": "New", "content": "Other"})
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def test_key_reused_for_other_request(test_post):
+    """Test that a key cannot be reused with a different body."""
+    client.post("/posts/create_post", json={"title": "A", "content": "A"}, headers={"Idempotency-Key": "k"})
+    response = client.post("/posts/create_post", json={"title": "B", "content": "B"}, headers={"Idempotency-Key": "k"})
+
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_comment_retry_and_failed_request(test_post):
+    """Test that failed requests release their key and successful comment creations replay."""
+    missing = client.post("/comments/create_comment?post_id=999", json={"content": "Hi"},
+                          headers={"Idempotency-Key": "c"})
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+    db = TestingSessionLocal()
+    assert db.query(IdempotencyKey).count() == 0
+
+    url = f"/comments/create_comment?post_id={test_post.id}"
+    first = client.post(url, json={"content": "Hi"}, headers={"Idempotency-Key": "c"})
+    retry = client.post(url, json={"content": "Hi"}, headers={"Idempotency-Key": "c"})
+    assert first.status_code == retry.status_code == status.HTTP_201_CREATED
+    assert retry.json() == first.json()
+    assert db.query(Comment).count() == 1
+    db.close()
+
+
+def test_concurrent_duplicate_waits_for_first_request(test_user):
+    """Test that a duplicate in flight waits for the first request's response."""
+    async def scenario():
+        first_db, second_db = TestingSessionLocal(), TestingSessionLocal()
+        try:
+            claimed = await idempotency.claim(first_db, test_user.id, "test", "key", "digest")
+            duplicate = asyncio.create_task(idempotency.claim(second_db, test_user.id, "test", "key", "digest"))
+            await asyncio.sleep(0.1)
+            assert not duplicate.done()
+
+            claimed.complete(first_db, PostResponse(id=1, owner_id=1, title="T", content="C"))
+            first_db.commit()
+            idempotency._finish(claimed)
+            with pytest.raises(idempotency.Replay) as replay:
+                await duplicate
+            return replay.value.response
+        finally:
+            first_db.close()
+            second_db.close()
+
+    response = asyncio.run(scenario())
+    assert response.status_code == status.HTTP_201_CREATED
+    assert b'"title":"T"' in response.body
+
+
+def test_claim_writes_off_the_event_loop(test_user, monkeypatch):
+    """Test that claiming a key does not block the event loop on the database."""
+    original_claim = idempotency._claim
+    threads = []
+
+    def record_thread(session, ident, digest):
+        threads.append(threading.current_thread())
+        return original_claim(session, ident, digest)
+
+    monkeypatch.setattr(idempotency, "_claim", record_thread)
+    db = TestingSessionLocal()
+    try:
+        asyncio.run(idempotency.claim(db, test_user.id, "test", "key", "digest"))
+    finally:
+        db.close()
+    assert threads and threading.main_thread() not in threads
+
+
+def test_abandoned_claim_times_out_then_expires(test_user, monkeypatch):
+    """Test that a held key answers 409 and is taken over once its lease expires."""
+    monkeypatch.setattr(idempotency, "WAIT_SECONDS", 0.1)
+    db = TestingSessionLocal()
+
+    async def scenario():
+        await idempotency.claim(db, test_user.id, "test", "key", "digest")
+        with pytest.raises(HTTPException) as error:
+            await idempotency.claim(db, test_user.id, "test", "key", "digest")
+        assert error.value.status_code == status.HTTP_409_CONFLICT
+
+        db.query(IdempotencyKey).update({IdempotencyKey.locked_until: utcnow() - timedelta(seconds=1)})
+        db.commit()
+        return await idempotency.claim(db, test_user.id, "test", "key", "digest")
+
+    try:
+        assert asyncio.run(scenario()).ident == (test_user.id, "test", "key")
+    finally:
+        db.close()
+
+
+def test_request_outliving_its_lease_does_not_commit(test_user, monkeypatch):
+    """Test that a request whose key was taken over by a retry fails instead of creating a duplicate."""
+    db = TestingSessionLocal()
+    original_claim = idempotency._claim
+
+    def slow_first_request(session, ident, digest):
+        claimed = original_claim(session, ident, digest)
+        # The lease runs out while the endpoint is still working, and a retry takes the key over.
+        db.query(IdempotencyKey).update({IdempotencyKey.locked_until: utcnow() - timedelta(seconds=1)})
+        db.commit()
+        assert original_claim(db, ident, digest) is not None
+        return claimed
+
+    monkeypatch.setattr(idempotency, "_claim", slow_first_request)
+    response = client.post("/posts/create_post", json={"title": "Slow", "content": "Body"},
+                           headers={"Idempotency-Key": "slow"})
+    monkeypatch.undo()
+
+    assert response.status_code == status.HTTP_409_CONFLICT
+    assert db.query(Post).filter(Post.title == "Slow").count() == 0
+    assert db.query(IdempotencyKey.status_code).filter(IdempotencyKey.key == "slow").scalar() is None
+    db.close()
+
+
+def test_prune_removes_expired_keys(test_user):
+    """Test that keys older than the window are deleted."""
+    db = TestingSessionLocal()
+    old = utcnow() - idempotency.WINDOW - timedelta(minutes=1)
+    db.add(IdempotencyKey(user_id=test_user.id, scope="test", key="old", fingerprint="x", status_code=201,
+                          body="{}", created_at=old))
+    db.add(IdempotencyKey(user_id=test_user.id, scope="test", key="new", fingerprint="x", status_code=201,
+                          body="{}", created_at=utcnow()))
+    db.commit()
+
+    assert idempotency.prune(db) == 1
+    assert [row.key for row in db.query(IdempotencyKey)] == ["new"]
+    db.close()
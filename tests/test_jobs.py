@@ -0,0 +1,110 @@
+"""
+Test the background job queue.
+"""
+import asyncio
+from datetime import timedelta
+
+import jobs
+from models import Job, utcnow
+from .utils import *
+
+
+@pytest.fixture
+def job_handlers():
+    """Fixture that registers test job handlers and cleans up the queue afterwards."""
+    calls = []
+    db = TestingSessionLocal()
+    db.query(Job).delete()
+    db.commit()
+
+    @jobs.task("record")
+    def record(db, value):
+        calls.append(value)
+
+    @jobs.task("explode")
+    def explode(db):
+        raise RuntimeError("boom")
+
+    yield calls
+    db.query(Job).delete()
+    db.commit()
+
+
+def test_enqueue_and_run(job_handlers):
+    """Test that an enqueued job runs once it is committed."""
+    db = TestingSessionLocal()
+    jobs.enqueue(db, "record", {"value": 42})
+    db.commit()
+
+    assert jobs.run_pending(TestingSessionLocal) == 1
+    assert job_handlers == [42]
+    assert db.query(Job).one().status == jobs.DONE
+
+
+def test_workers_are_woken_after_commit(job_handlers, monkeypatch):
+    """Test that idle workers are woken when the enqueuing transaction commits, not before."""
+    woken = []
+    monkeypatch.setattr(jobs, "notify", lambda: woken.append(True))
+    db = TestingSessionLocal()
+
+    jobs.enqueue(db, "record", {"value": 1})
+    assert woken == []
+    db.rollback()
+    db.commit()
+    assert woken == []
+
+    jobs.enqueue(db, "record", {"value": 2})
+    db.commit()
+    assert woken == [True]
+    db.close()
+
+
+def test_idempotency_key_deduplicates(job_handlers):
+    """Test that a job with an already used idempotency key is not enqueued twice."""
+    db = TestingSessionLocal()
+    jobs.enqueue(db, "record", {"value": 1}, key="same")
+    jobs.enqueue(db, "record", {"value": 2}, key="same")
+    db.commit()
+
+    jobs.run_pending(TestingSessionLocal)
+    assert job_handlers == [1]
+
+
+def test_failed_job_is_retried_with_backoff(job_handlers):
+    """Test that a failing job is rescheduled and eventually marked as failed."""
+    db = TestingSessionLocal()
+    jobs.enqueue(db, "explode", max_attempts=2)
+    db.commit()
+
+    assert jobs.run_pending(TestingSessionLocal) == 1
+    job = db.query(Job).one()
+    assert job.status == jobs.QUEUED
+    assert job.attempts == 1
+    assert "boom" in job.last_error
+
+    job.run_at = job.created_at
+    db.commit()
+    jobs.run_pending(TestingSessionLocal)
+    db.refresh(job)
+    assert job.status == jobs.FAILED
+    assert job.attempts == 2
+
+
+def test_workers_prune_finished_jobs_periodically(job_handlers):
+    """Test that finished jobs are pruned while the workers run, not only when they start."""
+    db = TestingSessionLocal()
+    old = utcnow() - jobs.RETENTION - timedelta(minutes=1)
+
+    async def scenario():
+        workers = asyncio.create_task(jobs.run_workers(poll_interval=0.05, session_factory=TestingSessionLocal,
+                                                       prune_interval=0.05))
+        await asyncio.sleep(0.1)
+        db.add(Job(name="record", payload="{}", status=jobs.DONE, attempts=1, max_attempts=1, run_at=old))
+        db.commit()
+        await asyncio.sleep(0.2)
+        workers.cancel()
+        await asyncio.gather(workers, return_exceptions=True)
+
+    asyncio.run(scenario())
+    assert db.query(Job).count() == 0
+    db.close()
@@ -0,0 +1,97 @@
+"""
+Test database migrations and startup checks.
+"""
+import asyncio
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from alembic.script import ScriptDirectory
+
+import startup
+from database import SCHEMA_REVISION
+from .utils import *
+
+
+def test_schema_revision_is_head():
+    """Test that ``SCHEMA_REVISION`` points at the latest migration."""
+    script = ScriptDirectory.from_config(Config(str(startup.ALEMBIC_INI)))
+    assert script.get_current_head() == SCHEMA_REVISION
+
+
+def test_migrations_match_models(tmp_path):
+    """Test that upgrading an empty database produces exactly the models' schema."""
+    migrated = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    startup.upgrade(migrated)
+
+    with migrated.connect() as connection:
+        assert compare_metadata(MigrationContext.configure(connection), Base.metadata) == []
+    assert startup.current_revision(migrated) == SCHEMA_REVISION
+
+
+def test_ids_are_never_reused(tmp_path):
+    """Test that the tables counted by watermark keep AUTOINCREMENT through every migration and back."""
+    migrated = create_engine(f"sqlite:///{tmp_path / 'autoincrement.db'}")
+    startup.upgrade(migrated)
+
+    def autoincrement_tables():
+        with migrated.connect() as connection:
+            tables = connection.execute(text("SELECT name, sql FROM sqlite_master WHERE type = 'table'"))
+            return {name for name, sql in tables if "AUTOINCREMENT" in sql}
+
+    assert {"users", "posts", "comments"} <= autoincrement_tables()
+
+    config = Config(str(startup.ALEMBIC_INI))
+    config.attributes["configure_logger"] = False
+    with migrated.begin() as connection:
+        config.attributes["connection"] = connection
+        command.downgrade(config, "0010")
+    assert {"users", "posts", "comments"} <= autoincrement_tables()
+
+
+def test_timestamps_backfilled_in_id_order(tmp_path):
+    """Test that posts stamped with a process start time get the latest time of the posts before them."""
+    migrated = create_engine(f"sqlite:///{tmp_path / 'stamped.db'}")
+    config = Config(str(startup.ALEMBIC_INI))
+    config.attributes["configure_logger"] = False
+    with migrated.begin() as connection:
+        config.attributes["connection"] = connection
+        command.upgrade(config, "0010")
+        for post_id, created_at in ((1, "2030-01-01 10:00:00"), (2, "2030-01-01 12:00:00"),
+                                    (3, "2030-01-01 09:00:00"), (4, None), (5, "2030-01-01 13:00:00")):
+            connection.execute(
+                text("INSERT INTO posts (id, title, content, owner_id, created_at) VALUES (:id, 't', 'c', 1, :at)"),
+                {"id": post_id, "at": created_at},
+            )
+    startup.upgrade(migrated)
+
+    with migrated.connect() as connection:
+        rows = connection.execute(text("SELECT created_at, updated_at FROM posts ORDER BY id")).all()
+    assert [created_at for created_at, _ in rows] == [
+        "2030-01-01 10:00:00", "2030-01-01 12:00:00", "2030-01-01 12:00:00", "2030-01-01 12:00:00",
+        "2030-01-01 13:00:00",
+    ]
+    assert all(created_at == updated_at for created_at, updated_at in rows)
+
+
+def test_check_schema_rejects_unmigrated_database(tmp_path):
+    """Test that startup refuses to serve from a database that is behind."""
+    unmigrated = create_engine(f"sqlite:///{tmp_path / 'empty.db'}")
+
+    with pytest.raises(RuntimeError):
+        startup.check_schema(unmigrated, auto_migrate=False)
+
+    startup.check_schema(unmigrated, auto_migrate=True)
+    assert startup.current_revision(unmigrated) == SCHEMA_REVISION
+
+
+def test_ready_after_warm_up(tmp_path):
+    """Test that the readiness probe flips once warm-up has finished."""
+    assert client.get("/ready").status_code == 503
+
+    warm = create_engine(f"sqlite:///{tmp_path / 'warm.db'}")
+    startup.upgrade(warm)
+    asyncio.run(startup.warm_up(app, warm))
+    assert client.get("/ready").json() == {"status": "Ready"}
+    app.state.ready = False
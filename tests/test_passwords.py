@@ -0,0 +1,62 @@
+"""
+Test password hashing and the password policy.
+"""
+import pytest
+
+import passwords
+from passwords import PasswordPolicy
+from routers.auth import authenticate_user
+from .utils import *
+
+
+def test_verify_accepts_str_and_bytes():
+    """Test that hashes stored as text or bytes both verify."""
+    policy = PasswordPolicy(bcrypt_rounds=4)
+    hashed = policy.hash("secret")
+
+    assert policy.verify("secret", hashed)
+    assert policy.verify("secret", hashed.encode("utf-8"))
+    assert not policy.verify("wrong", hashed)
+    assert not policy.verify("secret", "not a hash")
+
+
+def test_needs_rehash():
+    """Test that hashes made with another cost need rehashing."""
+    old = PasswordPolicy(bcrypt_rounds=4).hash("secret")
+
+    assert not PasswordPolicy(bcrypt_rounds=4).needs_rehash(old)
+    assert PasswordPolicy(bcrypt_rounds=5).needs_rehash(old)
+    assert PasswordPolicy(bcrypt_rounds=5).needs_rehash("plain text")
+
+
+def test_invalid_policy():
+    """Test that unusable settings are rejected."""
+    with pytest.raises(ValueError):
+        PasswordPolicy(scheme="md5")
+    with pytest.raises(ValueError):
+        PasswordPolicy(bcrypt_rounds=3)
+
+
+def test_login_rehashes_with_current_policy(test_user, monkeypatch):
+    """Test that a successful login upgrades a hash made under an older policy."""
+    monkeypatch.setattr(passwords, "policy", PasswordPolicy(bcrypt_rounds=5))
+    db = TestingSessionLocal()
+    try:
+        assert authenticate_user(test_user.username, "wrongpassword", db) is False
+        assert passwords.needs_rehash(db.get(User, test_user.id).hashed_password)
+
+        user = authenticate_user(test_user.username, "testpassword", db)
+        db.expire_all()
+        stored = db.get(User, user.id).hashed_password
+        assert not passwords.needs_rehash(stored)
+        assert passwords.verify_password("testpassword", stored)
+    finally:
+        db.close()
+
+
+def test_calibrate_stops_at_target():
+    """Test that calibration returns the cheapest cost when the target cannot be met."""
+    settings, elapsed = passwords.calibrate(0.0)
+
+    assert settings == {"PASSWORD_SCHEME": "bcrypt", "PASSWORD_BCRYPT_ROUNDS": 4}
+    assert elapsed > 0
@@ -0,0 +1,107 @@
+"""
+Test the access policy of posts and comments.
+"""
+from starlette import status
+
+import ratelimit
+from models import Comment
+from routers import comments, posts
+from routers.auth import get_current_user
+from .utils import *
+
+app.dependency_overrides[posts.get_db] = override_get_db
+app.dependency_overrides[comments.get_db] = override_get_db
+
+
+def other_user():
+    """Override the dependency to return a user who does not own the test post."""
+    return {"username": "other", "id": 2, "is_superuser": False}
+
+
+@pytest.fixture(autouse=True)
+def as_owner():
+    """Act as the non-admin owner of the test post, and clean up comments after each test."""
+    ratelimit.store.clear()
+    app.dependency_overrides[get_current_user] = override_get_current_non_superuser
+    yield
+    app.dependency_overrides[get_current_user] = override_get_current_user
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM comments;"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'comments';"))
+        connection.commit()
+
+
+def set_published(post, published):
+    """Set the published flag of a post directly in the database."""
+    db = TestingSessionLocal()
+    db.query(Post).filter(Post.id == post.id).update({"published": published})
+    db.commit()
+    db.close()
+
+
+def test_comment_on_other_users_published_post(test_post):
+    """Test that any user may read and comment on a published post."""
+    app.dependency_overrides[get_current_user] = other_user
+
+    assert client.get(f"/posts/{test_post.id}").status_code == status.HTTP_200_OK
+    response = client.post(f"/comments/create_comment?post_id={test_post.id}", json={"content": "Nice post"})
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["author_id"] == 2
+    db = TestingSessionLocal()
+    assert db.get(Comment, response.json()["id"]).path == comments.path_segment(response.json()["id"])
+
+
+def test_unpublished_post_is_hidden_from_other_users(test_post):
+    """Test that an unpublished post and its comments look missing to everyone but its owner and admins."""
+    client.post(f"/comments/create_comment?post_id={test_post.id}", json={"content": "Draft note"})
+    set_published(test_post, False)
+    assert client.get(f"/posts/{test_post.id}").status_code == status.HTTP_200_OK
+
+    app.dependency_overrides[get_current_user] = other_user
+    assert client.get(f"/posts/{test_post.id}").status_code == status.HTTP_404_NOT_FOUND
+    assert client.get(f"/comments/?post_id={test_post.id}").status_code == status.HTTP_404_NOT_FOUND
+    assert client.get("/comments/1").status_code == status.HTTP_404_NOT_FOUND
+    response = client.post(f"/comments/create_comment?post_id={test_post.id}", json={"content": "Sneaky"})
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    app.dependency_overrides[get_current_user] = override_get_current_user
+    assert client.get(f"/posts/{test_post.id}").status_code == status.HTTP_200_OK
+    assert len(client.get(f"/comments/?post_id={test_post.id}").json()) == 1
+
+
+def test_hidden_comments_are_not_queried(test_post, monkeypatch):
+    """Test that a user who may not read a post is rejected before its comment pages are loaded."""
+    set_published(test_post, False)
+
+    def no_query(*args):
+        raise AssertionError("page loaded for a user who may not read it")
+
+    monkeypatch.setattr(comments, "read_comments", no_query)
+    monkeypatch.setattr(comments, "read_threads", no_query)
+    app.dependency_overrides[get_current_user] = other_user
+    for path in ("/comments/", "/comments/?limit=50", "/comments/threads", "/comments/threads?skip=10"):
+        response = client.get(path, params={"post_id": test_post.id})
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_guarded_writes_reject_other_users(test_post):
+    """Test that only the owner or an admin may change or delete a post or comment."""
+    comment_id = client.post(f"/comments/create_comment?post_id={test_post.id}", json={"content": "Mine"}).json()["id"]
+
+    app.dependency_overrides[get_current_user] = other_user
+    post_update = {"title": "Taken", "content": "Taken over", "published": True}
+    assert client.put(f"/posts/{test_post.id}", json=post_update).status_code == status.HTTP_404_NOT_FOUND
+    assert client.delete(f"/posts/{test_post.id}").status_code == status.HTTP_404_NOT_FOUND
+    assert client.put(f"/comments/{comment_id}", json={"content": "Taken"}).status_code == status.HTTP_404_NOT_FOUND
+    assert client.delete(f"/comments/{comment_id}").status_code == status.HTTP_404_NOT_FOUND
+
+    db = TestingSessionLocal()
+    assert db.get(Comment, comment_id).content == "Mine"
+    assert db.get(Comment, comment_id).deleted_at is None
+    assert db.get(Post, test_post.id).deleted_at is None
+
+    app.dependency_overrides[get_current_user] = override_get_current_user
+    assert client.put(f"/comments/{comment_id}", json={"content": "Moderated"}).status_code == status.HTTP_204_NO_CONTENT
+    assert client.delete(f"/comments/{comment_id}").status_code == status.HTTP_204_NO_CONTENT
+    assert client.get(f"/comments/{comment_id}").status_code == status.HTTP_404_NOT_FOUND
@@ -1,5 +1,10 @@
+from datetime import datetime
+
 from starlette import status
 
+import factories
+from models import Comment
+from reaper import purge_deleted
 from routers.posts import get_db, get_current_user
 from .utils import *
 
@@ -17,6 +22,8 @@ def test_get_posts(test_post):
         "id": 1,
         "owner_id": 1,
         "published": True,
+        "created_at": test_post.created_at.isoformat() + "Z",
+        "updated_at": test_post.created_at.isoformat() + "Z",
     }]
 
 
@@ -30,6 +37,9 @@ def test_get_post(test_post):
         "id": 1,
         "owner_id": 1,
         "published": True,
+        "tags": [],
+        "created_at": test_post.created_at.isoformat() + "Z",
+        "updated_at": test_post.created_at.isoformat() + "Z",
     }
 
 
@@ -75,6 +85,44 @@ def test_update_post(test_post):
         assert getattr(model, key) == value
 
 
+def test_updated_at_tracks_edits_only(test_post):
+    """Test that editing a post moves ``updated_at`` but counting views does not."""
+    import trending
+
+    db = TestingSessionLocal()
+    client.get("/posts/1")
+    trending.flush(db)
+    db.expire_all()
+    assert db.get(Post, 1).updated_at == test_post.updated_at
+
+    client.put("/posts/1", json={"title": "Edited", "content": "Locked in...", "published": True})
+    db.expire_all()
+    post = db.get(Post, 1)
+    assert post.updated_at > post.created_at == test_post.created_at
+
+
+def test_get_posts_since(test_post):
+    """Test that ``since`` selects posts by creation time, with offsets converted to UTC, from the index."""
+    db = TestingSessionLocal()
+    post_ids = factories.posts(db, 3, owner_id=1, created_at=lambda index: datetime(2030, 1, 1, (12, 10, 11)[index]))
+    db.commit()
+
+    response = client.get("/posts/", params={"since": "2030-01-01T11:30:00+02:00", "fields": "id"})
+    assert [post["id"] for post in response.json()] == [post_ids[1], post_ids[2], post_ids[0]]
+    response = client.get("/posts/", params={"since": "2030-01-01T11:00:00Z", "fields": "id,created_at"})
+    assert response.json() == [
+        {"id": post_ids[2], "created_at": "2030-01-01T11:00:00Z"},
+        {"id": post_ids[0], "created_at": "2030-01-01T12:00:00Z"},
+    ]
+
+    plan = " ".join(row[-1] for row in db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM posts WHERE owner_id = 1 AND created_at >= '2030-01-01' "
+        "ORDER BY created_at, id"
+    )))
+    assert "ix_posts_owner_id_created_at" in plan
+    assert "TEMP B-TREE" not in plan
+
+
 def test_update_post_not_found(test_post):
     """Test updating a post that does not exist."""
     request_data = {
@@ -94,7 +142,23 @@ def test_delete_post(test_post):
     assert response.status_code == status.HTTP_204_NO_CONTENT
     db = TestingSessionLocal()
     model = db.query(Post).filter(Post.id == 1).first()
-    assert model is None
+    assert model.deleted_at is not None
+
+    response = client.get("/posts/1")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def test_purge_deleted_post_with_comments(test_post):
+    """Test that the reaper hard-deletes a soft-deleted post and its comments in batches."""
+    db = TestingSessionLocal()
+    factories.comments(db, [test_post.id], 25, author_id=1)
+    db.commit()
+
+    client.delete("/posts/1")
+    assert purge_deleted(db, batch_size=10) == 26
+
+    assert db.query(Post).filter(Post.id == 1).first() is None
+    assert db.query(Comment).filter(Comment.post_id == 1).count() == 0
 
 
 def test_delete_post_not_found():
@@ -102,3 +166,30 @@ def test_delete_post_not_found():
     response = client.delete("/posts/99")
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json() == {"detail": "Post not found"}
+
+
+def test_get_posts_summary_view(test_post):
+    """Test retrieving posts with an excerpt instead of the full content."""
+    response = client.get("/posts/?view=summary")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{
+        "excerpt": "I need to lock in...",
+        "title": "Test Title",
+        "id": 1,
+        "owner_id": 1,
+        "published": True,
+    }]
+
+
+def test_get_posts_selected_fields(test_post):
+    """Test retrieving only the requested post columns."""
+    response = client.get("/posts/?fields=id,title")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [{"id": 1, "title": "Test Title"}]
+
+
+def test_get_posts_unknown_field(test_post):
+    """Test requesting a column that does not exist."""
+    response = client.get("/posts/?fields=id,hashed_password")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    assert response.json() == {"detail": "Unknown fields: hashed_password"}
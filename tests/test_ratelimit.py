@@ -0,0 +1,107 @@
+"""
+Test rate limiting.
+"""
+import os
+
+from fastapi import HTTPException
+from starlette import status
+
+import ratelimit
+import shared_state
+from ratelimit import MemoryBucketStore, SharedBucketStore, SQLiteBucketStore
+from routers.auth import get_db
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+
+
+class FakeClock:
+    """A manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_burst_then_refills():
+    """Test that a bucket allows its burst and then refills at the configured rate."""
+    clock = FakeClock()
+    store = MemoryBucketStore(clock=clock)
+
+    assert [store.take("k", rate=1.0, capacity=3) for _ in range(3)] == [0, 0, 0]
+    assert store.take("k", rate=1.0, capacity=3) == pytest.approx(1.0)
+
+    clock.now += 1.0
+    assert store.take("k", rate=1.0, capacity=3) == 0
+
+
+def test_limits_can_be_scaled_or_disabled():
+    """Test that the scale multiplies a limit's burst and that a zero scale disables it."""
+    ratelimit.store.clear()
+    doubled = ratelimit.RateLimit("scaled", rate=1, burst=2, scale=2)
+    for _ in range(4):
+        doubled.hit("user:1")
+    with pytest.raises(HTTPException):
+        doubled.hit("user:1")
+
+    disabled = ratelimit.RateLimit("disabled", rate=1, burst=1, scale=0)
+    for _ in range(10):
+        disabled.hit("user:1")
+    ratelimit.store.clear()
+
+
+def test_bucket_store_evicts_least_recently_used():
+    """Test that the store keeps at most ``max_keys`` buckets."""
+    store = MemoryBucketStore(max_keys=2, clock=FakeClock())
+    store.take("a", rate=1.0, capacity=1)
+    store.take("b", rate=1.0, capacity=1)
+    store.take("a", rate=1.0, capacity=1)
+    store.take("c", rate=1.0, capacity=1)
+
+    assert len(store) == 2
+    assert store.take("b", rate=1.0, capacity=1) == 0
+
+
+def test_sqlite_bucket_store_is_shared(tmp_path):
+    """Test that two SQLite stores on the same file share their buckets."""
+    clock = FakeClock()
+    path = str(tmp_path / "buckets.db")
+    first = SQLiteBucketStore(path, clock=clock)
+    second = SQLiteBucketStore(path, clock=clock)
+
+    assert first.take("k", rate=1.0, capacity=1) == 0
+    assert second.take("k", rate=1.0, capacity=1) == pytest.approx(1.0)
+
+
+def test_shared_bucket_store_clear_keeps_other_state(monkeypatch):
+    """Test that clearing the shared buckets leaves revocations and counters in place."""
+    monkeypatch.setattr(shared_state, "_state", shared_state.SharedStore())
+    monkeypatch.setattr(shared_state, "_state_pid", os.getpid())
+    store = SharedBucketStore()
+    shared_state.get_state().sadd("revoked", "token")
+    shared_state.get_state().incr("hits")
+    assert store.take("k", rate=0.001, capacity=1) == 0
+    assert store.take("k", rate=0.001, capacity=1) > 0
+
+    store.clear()
+
+    assert store.take("k", rate=0.001, capacity=1) == 0
+    assert shared_state.get_state().sismember("revoked", "token")
+    assert shared_state.get_state().get("hits") == 1
+
+
+def test_login_rate_limited():
+    """Test that login attempts over the limit are rejected with a Retry-After header."""
+    ratelimit.store.clear()
+    form = {"username": "nobody", "password": "wrong"}
+
+    for _ in range(int(ratelimit.login_limit.capacity)):
+        response = client.post("/auth/token", data=form)
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = client.post("/auth/token", data=form)
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(response.headers["Retry-After"]) >= 1
+    ratelimit.store.clear()
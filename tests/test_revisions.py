@@ -0,0 +1,70 @@
+"""
+Test post revision history.
+"""
+from starlette import status
+
+import revisions
+from models import PostRevision
+from routers.posts import get_db, get_current_user
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+
+def test_diff_patch_round_trip():
+    """Test that applying a diff reproduces the new document."""
+    old = {"title": "Title", "content": "The quick brown fox jumps over the lazy dog.", "published": True}
+    new = {"title": "Title", "content": "The quick red fox leaps over the lazy dog!", "published": False}
+
+    delta = revisions.diff(old, new)
+    assert "title" not in delta
+    assert revisions.patch(old, delta) == new
+
+
+def test_update_post_records_revisions(test_post):
+    """Test that updates are stored as revisions that can be listed and fetched."""
+    for index in range(3):
+        response = client.put(f"/posts/{test_post.id}", json={"title": "Test Title", "content": f"Edit {index}"})
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = client.get(f"/posts/{test_post.id}/revisions")
+    assert response.status_code == status.HTTP_200_OK
+    assert [revision["version"] for revision in response.json()] == [4, 3, 2, 1]
+
+    response = client.get(f"/posts/{test_post.id}/revisions/1")
+    assert response.json()["content"] == "I need to lock in..."
+    response = client.get(f"/posts/{test_post.id}/revisions/3")
+    assert response.json()["content"] == "Edit 1"
+
+    response = client.get(f"/posts/{test_post.id}/revisions/9")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {"detail": "Revision not found"}
+
+
+def test_restore_revision(test_post):
+    """Test restoring a post to a previous version."""
+    client.put(f"/posts/{test_post.id}", json={"title": "Changed", "content": "Changed content"})
+
+    response = client.post(f"/posts/{test_post.id}/revisions/1/restore")
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    response = client.get(f"/posts/{test_post.id}")
+    assert response.json()["title"] == "Test Title"
+    assert response.json()["content"] == "I need to lock in..."
+
+
+def test_revisions_are_compact(test_post):
+    """Test that many small edits of a long post take a fraction of full copies."""
+    words = [f"word{index}" for index in range(700)]
+    edits = 30
+    for edit in range(edits):
+        words[edit * 20] = f"edited{edit}"
+        response = client.put(f"/posts/{test_post.id}", json={"title": "Test Title", "content": " ".join(words)[:5000]})
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    db = TestingSessionLocal()
+    stored = sum(len(revision.data) for revision in db.query(PostRevision).filter(PostRevision.post_id == test_post.id))
+    assert stored < 0.1 * edits * 5000
+
+    assert revisions.reconstruct(db, test_post.id, edits + 1)["content"] == " ".join(words)[:5000]
@@ -0,0 +1,103 @@
+"""
+Test comment shards.
+"""
+from starlette import status
+
+import factories
+import ratelimit
+import sharding
+from models import Comment
+from reaper import purge_deleted
+from routers import posts
+from routers.comments import get_db, get_current_user
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[posts.get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    """Fixture that routes comments to three temporary shard files."""
+    layout = sharding.CommentShards(3, f"sqlite:///{tmp_path}/comments-{{shard}}.db")
+    monkeypatch.setattr(sharding, "comment_shards", layout)
+    ratelimit.store.clear()
+    yield layout
+    ratelimit.store.clear()
+    layout.dispose()
+
+
+@pytest.fixture
+def many_posts(test_post):
+    """Fixture that adds posts 2-12 next to the test post."""
+    db = TestingSessionLocal()
+    post_ids = factories.posts(db, 11, owner_id=1, title=lambda index: f"Post {index + 2}")
+    db.commit()
+    db.close()
+    return [test_post.id] + post_ids
+
+
+def test_jump_hash_moves_only_to_new_shards():
+    """Test that growing the shard count only moves keys to the added shards."""
+    for key in range(1000):
+        before = sharding.jump_hash(key, 4)
+        after = sharding.jump_hash(key, 6)
+        assert 0 <= before < 4
+        assert after == before or after >= 4
+
+
+def test_comments_are_routed_by_post(shards, many_posts):
+    """Test that comments and replies land in the shard of their post and are served from it."""
+    ids = []
+    for post_id in many_posts:
+        response = client.post(f"/comments/create_comment?post_id={post_id}", json={"content": f"On {post_id}"})
+        assert response.status_code == status.HTTP_201_CREATED
+        ids.append(response.json()["id"])
+    assert len(set(ids)) == len(ids)
+
+    parent = ids[4]
+    response = client.post(f"/comments/create_comment?post_id={many_posts[4]}",
+                           json={"content": "Reply", "parent_id": parent})
+    assert response.status_code == status.HTTP_201_CREATED
+    reply = response.json()["id"]
+
+    with sharding.comment_sessions(TestingSessionLocal(), shards) as sessions:
+        for shard, session in enumerate(sessions.all()):
+            for comment in session.query(Comment).all():
+                assert shards.shard_for(comment.post_id) == shard
+        used = {shards.shard_for(post_id) for post_id in many_posts}
+        assert len(used) > 1
+
+    response = client.get(f"/comments/{parent}/thread")
+    assert response.json()["replies"][0]["id"] == reply
+    response = client.get("/comments/", params={"post_id": many_posts[4]})
+    assert [comment["id"] for comment in response.json()] == [parent, reply]
+
+    assert client.delete(f"/comments/{parent}").status_code == status.HTTP_204_NO_CONTENT
+    assert client.get(f"/comments/{reply}").status_code == status.HTTP_404_NOT_FOUND
+    assert purge_deleted(TestingSessionLocal()) == 2
+
+
+def test_rebalance(shards, many_posts, tmp_path):
+    """Test that rebalancing moves comments to the new layout and keeps IDs unique."""
+    for post_id in many_posts:
+        client.post(f"/comments/create_comment?post_id={post_id}", json={"content": f"On {post_id}"})
+
+    target = sharding.CommentShards(5, shards.url)
+    db = TestingSessionLocal()
+    moved = sharding.rebalance(db, shards, target)
+    assert moved == sum(1 for post_id in many_posts if target.shard_for(post_id) != shards.shard_for(post_id))
+
+    with sharding.comment_sessions(db, target) as sessions:
+        ids = set()
+        for shard, session in enumerate(sessions.all()):
+            for comment in session.query(Comment).all():
+                assert target.shard_for(comment.post_id) == shard
+                ids.add(comment.id)
+        assert len(ids) == len(many_posts)
+
+        new_id = sessions.next_id(many_posts[0])
+        assert new_id > max(ids)
+    db.close()
+    target.dispose()
@@ -0,0 +1,61 @@
+"""
+Test state shared between worker processes.
+"""
+import multiprocessing
+import os
+
+import shared_state
+from shared_state import SharedStore
+from .utils import *
+
+
+def _increment_in_child(counter_key):
+    shared_state.get_state().incr(counter_key, 5)
+
+
+def test_store_counters_and_sets():
+    """Test the in-process store operations."""
+    store = SharedStore()
+    assert store.incr("hits") == 1
+    assert store.incr("hits", 2) == 3
+    assert store.get("missing") == 0
+
+    assert store.sadd("revoked", "token") is True
+    assert store.sadd("revoked", "token") is False
+    assert store.sismember("revoked", "token")
+    assert store.srem("revoked", "token")
+    assert not store.sismember("revoked", "token")
+
+
+def test_publish_dispatches_to_subscribers(monkeypatch):
+    """Test that published events reach subscribers exactly once."""
+    monkeypatch.setattr(shared_state, "_state", SharedStore())
+    monkeypatch.setattr(shared_state, "_state_pid", os.getpid())
+    received = []
+    shared_state.subscribe("test-channel", received.append)
+
+    sequence = shared_state.get_state().last_sequence()
+    shared_state.publish("test-channel", {"post_id": 1})
+    shared_state.publish("other-channel", "ignored")
+    sequence = shared_state.dispatch_pending(sequence)
+    shared_state.dispatch_pending(sequence)
+
+    assert received == [{"post_id": 1}]
+    shared_state._subscribers.pop("test-channel")
+
+
+def test_broker_is_shared_between_processes(monkeypatch):
+    """Test that a counter incremented in another process is visible through the broker."""
+    monkeypatch.setattr(shared_state, "_state", None)
+    broker = shared_state.start_broker()
+    try:
+        process = multiprocessing.Process(target=_increment_in_child, args=("shared-hits",))
+        process.start()
+        process.join()
+
+        assert shared_state.get_state().get("shared-hits") == 5
+    finally:
+        broker.shutdown()
+        os.environ.pop(shared_state.ADDRESS_ENV)
+        os.environ.pop(shared_state.AUTHKEY_ENV)
+        shared_state._state = None
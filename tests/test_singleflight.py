@@ -0,0 +1,104 @@
+"""
+Test request coalescing.
+"""
+import asyncio
+import threading
+import time
+
+from starlette import status
+
+import sharding
+import singleflight
+from routers import comments, posts
+from routers.admin import get_current_superuser
+from .utils import *
+
+
+@pytest.fixture(autouse=True)
+def restore_groups():
+    """Unregister the groups created by a test."""
+    groups = dict(singleflight.groups)
+    yield
+    singleflight.groups.clear()
+    singleflight.groups.update(groups)
+
+
+def test_concurrent_calls_share_one_flight():
+    """Test that concurrent calls with one key run the function once and share its result."""
+    group = singleflight.Group("test-shared")
+    calls = []
+
+    def query(value):
+        calls.append(value)
+        time.sleep(0.05)
+        return {"value": value}
+
+    async def scenario():
+        return await asyncio.gather(*(group.do("key", query, index) for index in range(10)),
+                                    group.do("other", query, 99))
+
+    results = asyncio.run(scenario())
+
+    assert sorted(calls) == [0, 99]
+    assert results[:10] == [{"value": 0}] * 10
+    assert results[10] == {"value": 99}
+    stats = group.stats()
+    assert (stats["flights"], stats["absorbed"], stats["max_absorbed"], stats["in_flight"]) == (2, 9, 9, 0)
+    assert stats["histogram"] == {"0": 1, "1": 0, "4": 0, "16": 1, "64": 0, ">64": 0}
+
+
+def test_exception_is_shared_and_not_cached():
+    """Test that every caller of a failed flight gets its exception and the next call runs again."""
+    group = singleflight.Group("test-errors")
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.05)
+        raise ValueError("boom")
+
+    async def scenario():
+        return await asyncio.gather(*(group.do("key", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert asyncio.run(group.do("key", lambda: "fresh")) == "fresh"
+    assert group.stats()["flights"] == 2
+
+
+def test_coalescing_stats_endpoint():
+    """Test that superusers can read the counts of the read paths."""
+    app.dependency_overrides[get_current_superuser] = override_get_current_user
+    try:
+        response = client.get("/admin/stats/coalescing")
+    finally:
+        del app.dependency_overrides[get_current_superuser]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert {"posts", "comments", "threads"} <= set(response.json())
+    assert set(response.json()["posts"]) == {"flights", "absorbed", "max_absorbed", "in_flight", "histogram"}
+
+
+def test_flight_outlives_the_leader_session(test_post, monkeypatch):
+    """Test that a shared read keeps working after the request that started it closes its sessions."""
+    leader_db = TestingSessionLocal()
+    original_read_post, original_read_comments = posts.read_post, comments.read_comments
+
+    def read_post(db, post_id):
+        leader_db.close()
+        assert db is not leader_db
+        return original_read_post(db, post_id)
+
+    def read_comments(db, shards, *args):
+        leader_db.close()
+        assert db is not leader_db and shards.db is db
+        return original_read_comments(db, shards, *args)
+
+    monkeypatch.setattr(posts, "read_post", read_post)
+    monkeypatch.setattr(comments, "read_comments", read_comments)
+    with sharding.comment_sessions(leader_db) as shards:
+        post = asyncio.run(posts.post_reads.do("test", posts.read_post_detached, leader_db.get_bind(), test_post.id))
+        page = asyncio.run(comments.comment_reads.do("test", comments.detached, comments.read_comments,
+                                                     leader_db, shards, test_post.id, 10, 0))
+    assert post["id"] == test_post.id
+    assert page == ((test_post.owner_id, True), [])
@@ -0,0 +1,98 @@
+"""
+Test read-cache snapshots.
+"""
+import os
+import time
+
+import cache
+import factories
+import snapshot
+from routers import comments, posts
+from .utils import *
+
+app.dependency_overrides[posts.get_db] = override_get_db
+app.dependency_overrides[comments.get_db] = override_get_db
+app.dependency_overrides[posts.get_current_user] = override_get_current_user
+
+
+@pytest.fixture
+def hot_posts():
+    """Create three posts with two comments each."""
+    db = TestingSessionLocal()
+    post_ids = factories.posts(db, 3, owner_id=1, hot_score=lambda index: float(index))
+    factories.comments(db, post_ids, 2, author_id=1)
+    db.commit()
+    yield post_ids
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM comments;"))
+        connection.execute(text("DELETE FROM posts;"))
+        connection.commit()
+
+
+def test_snapshot_warms_caches(hot_posts, tmp_path, monkeypatch):
+    """Test that a loaded snapshot serves the hottest posts and their comments without queries."""
+    path = tmp_path / "snapshot.bin"
+    db = TestingSessionLocal()
+    assert snapshot.write(db, path, limit=2) == 6
+
+    assert snapshot.load(db, path) == 6
+    assert set(group for group, _, _ in cache.posts.entries()) == set(hot_posts[1:])
+
+    def no_query(*args):
+        raise AssertionError("served from the database")
+
+    monkeypatch.setattr(posts, "read_post", no_query)
+    monkeypatch.setattr(comments, "read_comments", no_query)
+    monkeypatch.setattr(comments, "read_threads", no_query)
+    hottest = hot_posts[2]
+    assert client.get(f"/posts/{hottest}").json()["title"] == "Post 2"
+    assert len(client.get(f"/comments/?post_id={hottest}").json()) == 2
+    assert len(client.get(f"/comments/threads?post_id={hottest}").json()) == 2
+
+
+def test_stale_snapshots_and_posts_are_skipped(hot_posts, tmp_path):
+    """Test that old snapshots are ignored and that posts deleted since the snapshot are not loaded."""
+    path = tmp_path / "snapshot.bin"
+    db = TestingSessionLocal()
+    snapshot.write(db, path)
+    db.query(Post).filter(Post.id == hot_posts[0]).update({"published": False})
+    db.commit()
+
+    assert snapshot.load(db, path, max_age=0) == 0
+    assert snapshot.load(db, path) == 6
+    assert cache.posts.get(hot_posts[0]) is cache.MISSING
+
+    path.write_bytes(b"not a snapshot")
+    assert snapshot.load(db, path) == 0
+    assert snapshot.load(db, tmp_path / "missing.bin") == 0
+
+
+def test_entries_changed_since_the_snapshot_are_skipped(hot_posts, tmp_path):
+    """Test that edited posts and the comment pages of posts with new comments are not loaded."""
+    path = tmp_path / "snapshot.bin"
+    db = TestingSessionLocal()
+    assert snapshot.write(db, path) == 9
+    edited, commented, untouched = hot_posts
+    db.query(Post).filter(Post.id == edited).update({"title": "Edited"})
+    factories.comments(db, [commented], 1, author_id=1)
+    db.commit()
+
+    assert snapshot.load(db, path) == 4
+    assert cache.posts.get(edited) is cache.MISSING
+    assert cache.posts.get(commented)["id"] == commented
+    assert cache.comment_pages.get(commented, cache.COMMENT_PAGE) is cache.MISSING
+    assert cache.thread_pages.get(commented, cache.THREAD_PAGE) is cache.MISSING
+    assert len(cache.comment_pages.get(untouched, cache.COMMENT_PAGE)[1]) == 2
+    db.close()
+
+
+def test_writer_skips_fresh_snapshots(hot_posts, tmp_path, monkeypatch):
+    """Test that a worker does not rewrite a snapshot another worker has just written."""
+    monkeypatch.setattr(snapshot, "SessionLocal", TestingSessionLocal)
+    path = tmp_path / "snapshot.bin"
+    assert snapshot._write_if_due(60, path) == 9
+    assert snapshot._write_if_due(60, path) is None
+
+    old = time.time() - 60
+    os.utime(path, (old, old))
+    assert snapshot._write_if_due(60, path) == 9
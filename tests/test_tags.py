@@ -0,0 +1,141 @@
+"""
+Test post tags and the tag index.
+"""
+from array import array
+from datetime import timedelta
+
+from starlette import status
+
+import tagging
+from reaper import purge_deleted
+from routers import posts
+from routers.posts import get_db, get_current_user
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+
+@pytest.fixture(autouse=True)
+def clear_index():
+    """Start every test with an empty tag index."""
+    tagging.index.clear()
+    yield
+    tagging.index.clear()
+
+
+def create_post(title: str, tags: list[str]) -> int:
+    response = client.post("/posts/create_post", json={"title": title, "content": "Content", "tags": tags})
+    assert response.status_code == status.HTTP_201_CREATED
+    return response.json()["id"]
+
+
+def test_intersect_and_union():
+    """Test the sorted-array set operations."""
+    postings = [array("q", [1, 3, 5, 7, 9]), array("q", [3, 4, 5, 9]), array("q", [5, 9, 11])]
+    assert tagging.intersect(postings).tolist() == [5, 9]
+    assert tagging.union(postings).tolist() == [1, 3, 4, 5, 7, 9, 11]
+    assert tagging.intersect([]).tolist() == []
+
+
+def test_normalize():
+    """Test that tag names are normalised and deduplicated."""
+    assert tagging.normalize_all(["  Python ", "python", "Web   Dev"]) == ["python", "web dev"]
+
+
+def test_create_post_with_tags(test_post):
+    """Test that tags are normalised on create and returned with the post."""
+    post_id = create_post("Tagged", ["Python", "sqlite", "python"])
+
+    response = client.get(f"/posts/{post_id}")
+    assert response.json()["tags"] == ["python", "sqlite"]
+
+
+def test_invalid_tag(test_post):
+    """Test that an invalid tag is rejected."""
+    response = client.post("/posts/create_post", json={"title": "Bad", "content": "Content", "tags": ["<b>"]})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_filter_posts_by_tags(test_post):
+    """Test any/all tag filters, including index updates after edits."""
+    first = create_post("First", ["python", "web"])
+    second = create_post("Second", ["python"])
+    third = create_post("Third", ["web", "sqlite"])
+
+    response = client.get("/posts/", params={"tags": ["python", "web"], "fields": "id"})
+    assert [post["id"] for post in response.json()] == [first, second, third]
+
+    response = client.get("/posts/", params={"tags": ["Python", "web"], "match": "all", "fields": "id"})
+    assert [post["id"] for post in response.json()] == [first]
+
+    response = client.put(f"/posts/{third}", json={"title": "Third", "content": "Content", "tags": ["python", "web"]})
+    assert response.status_code == status.HTTP_204_NO_CONTENT
+    response = client.get("/posts/", params={"tags": ["python", "web"], "match": "all", "fields": "id"})
+    assert [post["id"] for post in response.json()] == [first, third]
+
+    response = client.put(f"/posts/{third}", json={"title": "Third v2", "content": "Content"})
+    assert client.get(f"/posts/{third}").json()["tags"] == ["python", "web"]
+
+    response = client.get("/posts/", params={"tags": ["python"], "skip": 1, "limit": 1, "fields": "id"})
+    assert [post["id"] for post in response.json()] == [second]
+
+
+def test_deleted_posts_leave_tag_results(test_post):
+    """Test that deleted posts are filtered immediately and unlinked when purged."""
+    post_id = create_post("Doomed", ["python"])
+
+    client.delete(f"/posts/{post_id}")
+    response = client.get("/posts/", params={"tags": ["python"]})
+    assert response.json() == []
+
+    db = TestingSessionLocal()
+    purge_deleted(db)
+    assert db.execute(text("SELECT COUNT(*) FROM post_tags")).scalar() == 0
+    assert tagging.index.postings(db, "python").tolist() == []
+    db.close()
+
+
+@pytest.mark.parametrize("inline_ids", [500, 0])
+def test_tag_filter_orders_by_creation_time(test_post, monkeypatch, inline_ids):
+    """Test that tagged listings match the untagged order, with ID lists and with SQL filters."""
+    monkeypatch.setattr(posts, "TAG_INLINE_IDS", inline_ids)
+    first = create_post("First", ["python", "web"])
+    second = create_post("Second", ["python"])
+    third = create_post("Third", ["web", "sqlite"])
+    db = TestingSessionLocal()
+    # An older row with a later timestamp, like rows backfilled by the timestamps migration.
+    latest = db.query(Post.created_at).filter(Post.id == third).scalar()
+    db.query(Post).filter(Post.id == first).update({Post.created_at: latest + timedelta(hours=1)})
+    db.commit()
+    db.close()
+
+    response = client.get("/posts/", params={"tags": ["python", "web"], "fields": "id"})
+    assert [post["id"] for post in response.json()] == [second, third, first]
+
+    response = client.get("/posts/", params={"tags": ["python", "web"], "match": "all", "fields": "id"})
+    assert [post["id"] for post in response.json()] == [first]
+
+    response = client.get("/posts/", params={"tags": ["web"], "skip": 1, "fields": "id"})
+    assert [post["id"] for post in response.json()] == [first]
+
+
+def test_posting_loaded_across_a_change_is_reloaded(test_post, monkeypatch):
+    """Test that a posting read before a concurrent tag change is not installed."""
+    post_id = create_post("Tagged", ["python"])
+    original_load = tagging.index._load
+    loads = []
+
+    def load_then_change(db, name):
+        posting = original_load(db, name)
+        loads.append(posting.tolist())
+        if len(loads) == 1:
+            # Another request removes the tag after the load read the rows.
+            client.put(f"/posts/{post_id}", json={"title": "Tagged", "content": "Content", "tags": []})
+        return posting
+
+    monkeypatch.setattr(tagging.index, "_load", load_then_change)
+    db = TestingSessionLocal()
+    assert tagging.index.postings(db, "python").tolist() == []
+    assert loads == [[post_id], []]
+    db.close()
@@ -0,0 +1,70 @@
+"""
+Test hot post ranking.
+"""
+import math
+
+from starlette import status
+
+import trending
+from routers.posts import get_db, get_current_user
+from .utils import *
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_current_user] = override_get_current_user
+
+
+@pytest.fixture(autouse=True)
+def clear_ranking():
+    """Start every test with an empty ranking and no pending events."""
+    trending.ranking.replace([])
+    trending.ranking.loaded = False
+    trending._pending.clear()
+    yield
+    trending._pending.clear()
+
+
+def test_scores_decay_at_the_same_rate():
+    """Test that later events weigh more and that stored scores decay with time."""
+    earlier = trending.event_score("view", at=trending.EPOCH + 3600)
+    later = trending.event_score("view", at=trending.EPOCH + 3600 + trending.HALF_LIFE_HOURS * 3600)
+    assert trending.current_score(later, at=trending.EPOCH + 3600 + trending.HALF_LIFE_HOURS * 3600) == pytest.approx(1.0)
+    assert trending.logaddexp(earlier, earlier) - earlier == pytest.approx(math.log(2))
+    assert trending.current_score(earlier, at=trending.EPOCH + 3600 + trending.HALF_LIFE_HOURS * 3600) \
+        == pytest.approx(0.5)
+
+
+def test_ranking_keeps_best_posts():
+    """Test that the ranking is bounded and re-sorted on updates."""
+    ranking = trending.HotRanking(capacity=3)
+    for post_id, score in enumerate([5.0, 1.0, 3.0, 4.0], start=1):
+        ranking.update(post_id, score)
+    assert [post_id for post_id, _ in ranking.top(10)] == [1, 4, 3]
+
+    ranking.update(3, 9.0)
+    ranking.discard(1)
+    assert [post_id for post_id, _ in ranking.top(10)] == [3, 4]
+
+
+def test_hot_posts(test_post):
+    """Test that views and comments are flushed and move posts up the ranking."""
+    response = client.post("/posts/create_post", json={"title": "Newer", "content": "Content"})
+    newer = response.json()["id"]
+    response = client.post("/posts/create_post", json={"title": "Draft", "content": "Content", "published": False})
+    draft = response.json()["id"]
+
+    response = client.get("/posts/hot")
+    assert response.status_code == status.HTTP_200_OK
+    assert [post["id"] for post in response.json()] == [newer, test_post.id]
+
+    for _ in range(30):
+        client.get(f"/posts/{test_post.id}")
+    client.get(f"/posts/{draft}")
+    assert trending.flush(TestingSessionLocal()) == 2
+
+    response = client.get("/posts/hot")
+    assert [post["id"] for post in response.json()] == [test_post.id, newer]
+    assert response.json()[0]["view_count"] == 30
+
+    client.delete(f"/posts/{test_post.id}")
+    response = client.get("/posts/hot")
+    assert [post["id"] for post in response.json()] == [newer]
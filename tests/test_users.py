@@ -19,6 +19,7 @@ def test_return_user(test_user):
         'id': 1,
         'is_active': True,
         'is_superuser': True,
+        'tokens_valid_after': None,
         'username': 'dartrisen',
     }
 
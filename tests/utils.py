@@ -9,7 +9,8 @@ from main import app
 from models import Post, User
 from routers.auth import get_password_hash
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./testdb.db"
+# Each test process (and so each pytest-xdist worker) gets its own in-memory database.
+SQLALCHEMY_DATABASE_URL = "sqlite://"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
@@ -68,7 +69,11 @@ def test_post():
     db.refresh(post)
     yield post
     with engine.connect() as connection:
+        connection.execute(text("DELETE FROM post_tags;"))
+        connection.execute(text("DELETE FROM tags;"))
+        connection.execute(text("DELETE FROM post_revisions;"))
         connection.execute(text("DELETE FROM posts;"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'posts';"))
         connection.commit()
 
 
@@ -96,4 +101,5 @@ def test_user():
     yield user
     with engine.connect() as connection:
         connection.execute(text("DELETE FROM users;"))
+        connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'users';"))
         connection.commit()
@@ -0,0 +1,276 @@
+"""
+Hot posts.
+
+Every post has a time-decayed ``hot_score`` built from its creation, comments
+and views. Scores use forward decay: an event of weight ``w`` at time ``t`` adds
+``w * e^((t - EPOCH) / TAU)``, stored as a natural logarithm so it never
+overflows. All scores decay at the same rate, so the order of two posts only
+changes when one of them gets a new event and the ranking never has to be
+re-sorted as time passes.
+
+Views and comments are counted in memory by :func:`record` and written in one
+transaction per :func:`flush`. Each worker keeps the best
+:data:`RANKING_SIZE` published posts in a :class:`HotRanking`, updated with the
+scores of flushed posts (its own and, through :mod:`shared_state`, other
+workers'), so ``GET /posts/hot`` never sorts the ``posts`` table.
+"""
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import shared_state
+from database import SessionLocal
+from models import Post
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()
+HALF_LIFE_HOURS = 12.0
+TAU = HALF_LIFE_HOURS * 3600 / math.log(2)
+EVENT_WEIGHTS = {"post": 10.0, "comment": 5.0, "view": 1.0}
+RANKING_SIZE = 1000
+FLUSH_INTERVAL_SECONDS = 5.0
+REFILL_INTERVAL_SECONDS = 300.0
+FLUSH_CHUNK = 500
+
+
+def logaddexp(a: float, b: float) -> float:
+    """Return ``log(e^a + e^b)`` without overflowing."""
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def event_score(event: str, at: Optional[float] = None) -> float:
+    """Return the log-space contribution of one event.
+
+    :param event: A key of :data:`EVENT_WEIGHTS`.
+    :param at: The event time as a UNIX timestamp; defaults to now.
+    """
+    at = time.time() if at is None else at
+    return math.log(EVENT_WEIGHTS[event]) + (at - EPOCH) / TAU
+
+
+def current_score(score: float, at: Optional[float] = None) -> float:
+    """Convert a stored score into the decayed weight at time ``at`` (default now)."""
+    at = time.time() if at is None else at
+    return math.exp(score - (at - EPOCH) / TAU)
+
+
+class HotRanking:
+    """The highest-scoring posts, kept sorted and updated one post at a time.
+
+    :param capacity: The number of posts kept.
+    """
+
+    def __init__(self, capacity: int = RANKING_SIZE):
+        self.capacity = capacity
+        self.loaded = False
+        self._scores: dict[int, float] = {}
+        self._order: list[tuple[float, int]] = []
+        self._lock = threading.Lock()
+
+    def _remove(self, post_id: int):
+        score = self._scores.pop(post_id, None)
+        if score is not None:
+            del self._order[bisect_left(self._order, (-score, post_id))]
+
+    def update(self, post_id: int, score: float):
+        """Set the score of a post, keeping it only if it is among the best ``capacity``."""
+        with self._lock:
+            self._remove(post_id)
+            if len(self._order) >= self.capacity and (-score, post_id) >= self._order[-1]:
+                return
+            insort(self._order, (-score, post_id))
+            self._scores[post_id] = score
+            if len(self._order) > self.capacity:
+                _, evicted = self._order.pop()
+                del self._scores[evicted]
+
+    def discard(self, post_id: int):
+        """Drop a post, e.g. because it was deleted or unpublished."""
+        with self._lock:
+            self._remove(post_id)
+
+    def replace(self, items: list[tuple[int, float]]):
+        """Replace the whole ranking with ``(post_id, score)`` pairs."""
+        with self._lock:
+            self._order = sorted((-score, post_id) for post_id, score in items)[:self.capacity]
+            self._scores = {post_id: -negated for negated, post_id in self._order}
+            self.loaded = True
+
+    def top(self, limit: int, skip: int = 0) -> list[tuple[int, float]]:
+        """Return the ``(post_id, score)`` pairs at ranks ``skip`` to ``skip + limit``."""
+        with self._lock:
+            return [(post_id, -negated) for negated, post_id in self._order[skip:skip + limit]]
+
+    def __len__(self):
+        return len(self._order)
+
+
+ranking = HotRanking()
+
+_pending: dict[int, list] = {}
+_pending_lock = threading.Lock()
+
+
+def _add_pending(post_id: int, views: int, score: float):
+    entry = _pending.get(post_id)
+    if entry is None:
+        _pending[post_id] = [views, score]
+    else:
+        entry[0] += views
+        entry[1] = logaddexp(entry[1], score)
+
+
+def record(post_id: int, event: str):
+    """Count a view or comment in memory; it is written by the next :func:`flush`.
+
+    :param post_id: The ID of the post.
+    :param event: ``"view"`` or ``"comment"``.
+    """
+    score = event_score(event)
+    with _pending_lock:
+        _add_pending(post_id, int(event == "view"), score)
+
+
+def publish_scores(scores: dict[int, Optional[float]]):
+    """Apply new scores to this worker's ranking and send them to the others.
+
+    :param scores: The new score of each post, or None for posts that left the ranking.
+    """
+    _apply(scores)
+    shared_state.publish("trending", {"pid": os.getpid(), "scores": list(scores.items())})
+
+
+def _apply(scores: dict[int, Optional[float]]):
+    for post_id, score in scores.items():
+        if score is None:
+            ranking.discard(post_id)
+        else:
+            ranking.update(post_id, score)
+
+
+def _on_message(message: dict):
+    if message.get("pid") != os.getpid():
+        _apply(dict(message.get("scores", ())))
+
+
+shared_state.subscribe("trending", _on_message)
+
+
+def remove(post_id: int):
+    """Take a deleted or unpublished post out of every worker's ranking."""
+    publish_scores({post_id: None})
+
+
+def flush(db: Session) -> int:
+    """Write the pending views and scores and update the rankings.
+
+    View counts are incremented first, which takes the write lock, so the scores
+    read afterwards cannot be changed by another worker before they are written back.
+
+    :param db: The database session.
+
+    :return: The number of updated posts.
+    """
+    with _pending_lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return 0
+
+    table = Post.__table__
+    # Counters are not edits: keep updated_at as it is.
+    unchanged = table.c.updated_at
+    try:
+        updated = {}
+        post_ids = list(pending)
+        for start in range(0, len(post_ids), FLUSH_CHUNK):
+            chunk = post_ids[start:start + FLUSH_CHUNK]
+            db.execute(
+                update(table)
+                .where(table.c.id == bindparam("post_id"))
+                .values(view_count=table.c.view_count + bindparam("views"), updated_at=unchanged),
+                [{"post_id": post_id, "views": pending[post_id][0]} for post_id in chunk],
+            )
+            rows = db.execute(
+                select(Post.id, Post.hot_score, Post.published, Post.deleted_at).where(Post.id.in_(chunk))
+            ).all()
+            scores = [
+                {"post_id": row.id, "score": logaddexp(row.hot_score, pending[row.id][1])} for row in rows
+            ]
+            if scores:
+                db.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("post_id"))
+                    .values(hot_score=bindparam("score"), updated_at=unchanged),
+                    scores,
+                )
+            eligible = {row.id for row in rows if row.published and row.deleted_at is None}
+            updated.update(
+                (entry["post_id"], entry["score"] if entry["post_id"] in eligible else None) for entry in scores
+            )
+        db.commit()
+    except Exception:
+        db.rollback()
+        with _pending_lock:
+            for post_id, (views, score) in pending.items():
+                _add_pending(post_id, views, score)
+        raise
+
+    publish_scores(updated)
+    return len(updated)
+
+
+def refill(db: Session):
+    """Reload this worker's ranking from the ``hot_score`` index."""
+    rows = db.execute(
+        select(Post.id, Post.hot_score)
+        .where(Post.published.is_(True), Post.deleted_at.is_(None))
+        .order_by(Post.hot_score.desc())
+        .limit(ranking.capacity)
+    ).all()
+    ranking.replace([(row.id, row.hot_score) for row in rows])
+
+
+def _run_once(refill_due: bool):
+    db = SessionLocal()
+    try:
+        flush(db)
+        if refill_due:
+            refill(db)
+    finally:
+        db.close()
+
+
+async def run_flusher(interval: float = FLUSH_INTERVAL_SECONDS, refill_interval: float = REFILL_INTERVAL_SECONDS):
+    """Flush pending events every ``interval`` seconds until cancelled.
+
+    The ranking is reloaded from the database at start and every ``refill_interval``
+    seconds, which brings back posts that left it when better ones were deleted.
+
+    :param interval: The number of seconds between flushes.
+    :param refill_interval: The number of seconds between reloads of the ranking.
+    """
+    last_refill = None
+    while True:
+        now = time.monotonic()
+        refill_due = last_refill is None or now - last_refill >= refill_interval
+        try:
+            await run_in_threadpool(_run_once, refill_due)
+            if refill_due:
+                last_refill = now
+        except Exception:
+            logger.exception("Trending flush failed")
+        await asyncio.sleep(interval)
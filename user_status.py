@@ -0,0 +1,135 @@
+"""
+Cached account status.
+
+Almost every user is active and has never had their tokens revoked, so each
+worker keeps only the exceptions in memory: users that are deactivated or
+whose tokens issued before a given time are invalid. Checking a token is then
+a dictionary lookup instead of a query per request.
+
+The cache is loaded at startup; until then, users are looked up in the
+database. After changing users, call :func:`changed` so every worker reloads
+them through :mod:`shared_state`.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+import shared_state
+from database import SessionLocal
+from models import User, utcnow
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 500
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class UserStatusCache:
+    """Users that are inactive or have revoked tokens, keyed by ID."""
+
+    def __init__(self):
+        self.loaded = False
+        self._restricted: dict[int, tuple[bool, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _rows(self, db: Session, *criteria):
+        return db.execute(select(User.id, User.is_active, User.tokens_valid_after).where(*criteria)).all()
+
+    def load(self, db: Session):
+        """Load every restricted user."""
+        rows = self._rows(db, or_(User.is_active.is_(False), User.tokens_valid_after.isnot(None)))
+        with self._lock:
+            self._restricted = {
+                row.id: (bool(row.is_active), _timestamp(row.tokens_valid_after)) for row in rows
+            }
+            self.loaded = True
+
+    def refresh(self, db: Session, user_ids: Iterable[int]):
+        """Reload the status of some users."""
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), CHUNK_SIZE):
+            chunk = user_ids[start:start + CHUNK_SIZE]
+            rows = {row.id: row for row in self._rows(db, User.id.in_(chunk))}
+            with self._lock:
+                for user_id in chunk:
+                    row = rows.get(user_id)
+                    if row is not None and (not row.is_active or row.tokens_valid_after is not None):
+                        self._restricted[user_id] = (bool(row.is_active), _timestamp(row.tokens_valid_after))
+                    else:
+                        self._restricted.pop(user_id, None)
+
+    def clear(self):
+        """Forget every user; the cache is considered unloaded."""
+        with self._lock:
+            self._restricted.clear()
+            self.loaded = False
+
+    def _lookup(self, user_id: int) -> Optional[tuple[bool, Optional[float]]]:
+        db = SessionLocal()
+        try:
+            row = db.execute(
+                select(User.is_active, User.tokens_valid_after).where(User.id == user_id)
+            ).first()
+        finally:
+            db.close()
+        if row is None or (row.is_active and row.tokens_valid_after is None):
+            return None
+        return bool(row.is_active), _timestamp(row.tokens_valid_after)
+
+    def allows(self, user_id: int, issued_at: Optional[float]) -> bool:
+        """Return True if the user is active and the token was issued after any revocation.
+
+        Until the cache is loaded, this queries the database.
+
+        :param user_id: The ID of the user.
+        :param issued_at: The token's ``iat`` claim, or None if it has none.
+        """
+        if self.loaded:
+            status = self._restricted.get(user_id)
+        else:
+            status = self._lookup(user_id)
+        if status is None:
+            return True
+        is_active, valid_after = status
+        if not is_active:
+            return False
+        return valid_after is None or (issued_at is not None and issued_at >= valid_after)
+
+
+cache = UserStatusCache()
+
+
+def changed(db: Session, user_ids: Iterable[int]):
+    """Reload users in this worker's cache and tell the other workers to do the same."""
+    user_ids = list(user_ids)
+    cache.refresh(db, user_ids)
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        shared_state.publish("users", {"pid": os.getpid(), "user_ids": user_ids[start:start + CHUNK_SIZE]})
+
+
+def _on_message(message: dict):
+    if message.get("pid") == os.getpid():
+        return
+    db = SessionLocal()
+    try:
+        cache.refresh(db, message.get("user_ids", ()))
+    finally:
+        db.close()
+
+
+shared_state.subscribe("users", _on_message)
+
+
+def revocation_time() -> datetime:
+    """Return the value to store in ``tokens_valid_after`` to revoke all current tokens."""
+    return utcnow()